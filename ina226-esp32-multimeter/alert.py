@@ -0,0 +1,72 @@
+'''Event-driven wakeup from the INA226 ALERT pin.
+
+With config.alert['enabled'] the INA226 stays powered in continuous mode
+while the MCU sleeps and compares every conversion against the configured
+limit. Its open-drain ALERT output is wired to an RTC GPIO, which wakes the
+ESP32 from deepsleep (ext0). The periodic interval can then be long
+(config.alert['interval_seconds']).
+
+After an alert wake the next sleep is timer-only with the normal interval,
+so a condition that persists cannot keep the node awake; the alert is armed
+again on the wake after that.
+'''
+
+import machine
+import config
+
+_woke = None
+
+
+def enabled():
+    return config.alert['enabled']
+
+
+def woke():
+    '''True if this wake was caused by the ALERT pin.'''
+    global _woke
+    if _woke is None:
+        _woke = machine.reset_cause() == machine.DEEPSLEEP_RESET \
+            and machine.wake_reason() == machine.EXT0_WAKE
+    return _woke
+
+
+def armed():
+    '''True if the next sleep should wake on the ALERT pin.'''
+    return enabled() and not woke()
+
+
+def reason():
+    '''Wake reason published with the measurement.'''
+    if woke():
+        return 'alert'
+    if machine.reset_cause() == machine.DEEPSLEEP_RESET:
+        return 'timer'
+    return 'reset'
+
+
+def arm(ina):
+    '''Switch the INA226 to continuous conversions and set the alert limit.'''
+    from lib.ina226 import make_config, CONFIG_MODE_SANDBVOLT_CONTINUOUS
+    cfg = config.alert
+    ina.configure(make_config(mode=CONFIG_MODE_SANDBVOLT_CONTINUOUS, **cfg['profile']))
+    if cfg['function'] == 'over_current':
+        ina.alert_over_current(cfg['limit'])
+    elif cfg['function'] == 'under_voltage':
+        ina.alert_under_voltage(cfg['limit'])
+    elif cfg['function'] == 'over_power':
+        ina.alert_over_power(cfg['limit'])
+    else:
+        raise ValueError('unknown alert function: %s' % cfg['function'])
+    # clear a latched alert from before
+    ina.alert
+
+
+def wake_source():
+    '''Enable the ext0 wakeup on the ALERT pin. Call right before deepsleep.'''
+    import rtcmem
+    # only if the reader's pwr(False) left the INA226 watching the limit
+    if not armed() or not rtcmem.get('ina_on'):
+        return
+    import esp32
+    pin = machine.Pin(config.alert['pin'], machine.Pin.IN, machine.Pin.PULL_UP)
+    esp32.wake_on_ext0(pin=pin, level=esp32.WAKEUP_ALL_LOW)
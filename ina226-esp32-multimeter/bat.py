@@ -1,44 +1,69 @@
 import config as config
 from machine import Pin, ADC
-from time import sleep
-import json
-from machine import deepsleep
+import rtcmem
 
 
 _bat = ADC(Pin(config.battery['pin']['bat_sense'], Pin.IN))
 _bat.atten(ADC.ATTN_11DB)
 _bat.width(ADC.WIDTH_12BIT)
 
+# read_uv() applies the eFuse calibration of the ADC
+_UV = hasattr(_bat, 'read_uv')
+
 VREF = 3.578  # in volts, from eFuse or calibration
+# battery volts per raw unit (1M+1M divider): raw is mV at the ADC pin with
+# read_uv(), otherwise 12 bit ADC counts of 0-VREF
+SCALE = 2 / 1000 if _UV else VREF / 4095 * 2
+
+
+def percentage(voltage):
+    '''Map voltage to percentage (3.3V = 0%, 4.2V = 100%), 0.0 - 1.0'''
+    return max(min((voltage - 3.3) / (4.2 - 3.3), 1.0), 0.0)
+
 
 def read_battery_voltage():
     """
-    Reads the battery voltage by averaging several ADC samples and applying the voltage divider correction.
-    Returns a tuple: (averaged ADC value, voltage in volts (float)).
+    Reads the battery voltage from a burst of ADC samples without sleeps,
+    drops the outliers at both ends and applies the voltage divider correction.
+    Returns a tuple: (raw value, voltage in volts (float)), see SCALE.
     """
+    n = config.battery['meansby']
+    read = _bat.read_uv if _UV else _bat.read
+    vals = sorted([read() for _ in range(n)])
+    # trimmed mean
+    k = int(n * config.battery['trim'])
+    vals = vals[k:n - k]
+    raw = sum(vals) / len(vals)
+    if _UV:
+        raw /= 1000
+    raw = round(raw)
+    return raw, raw * SCALE
 
-    mean_cnt = config.battery['meansby']
-    raw = 0
-    for _ in range(mean_cnt):
-        raw += _bat.read()
-        sleep(0.01)
-    raw //= mean_cnt
 
-    # Convert ADC reading to voltage at the ADC pin
-    # MicroPython ADC returns 0-4095 for 0-VREF (12 bit)
-    # Vref = (4.22 * 4095) / raw
-    # print(f'Vref: {Vref:.2f}V')
-    measured_voltage = (raw / 4095) * VREF  # voltage at ADC pin
-    battery_voltage = measured_voltage * 2    # correct for 1M+1M divider
-    return raw, battery_voltage
+def _battery_voltage(deadline=None):
+    """
+    Battery voltage, re-measured only every `cache_cycles` wakes while it is
+    stable (changed by at most `stable_mv` between two measurements). The last
+    measurement is kept in RTC memory as [raw, wakes since measured, stable].
+    With an expired `deadline` any cached measurement is used.
+    """
+    cache = rtcmem.get('bat')
+    late = deadline is not None and deadline.expired()
+    if cache and (late or cache[2] and cache[1] < config.battery['cache_cycles']):
+        cache[1] += 1
+        return cache[0], cache[0] * SCALE
+    raw, voltage = read_battery_voltage()
+    stable = bool(cache) and abs(raw - cache[0]) * SCALE * 1000 <= config.battery['stable_mv']
+    rtcmem.put('bat', [raw, 0, stable])
+    return raw, voltage
 
 
-def bat_idle(reader = None):
+def bat_idle(reader = None, deadline = None):
     """
     call this method to do actions on low battery
-    returns ADC value, voltage, and perc of the battery measurement
-
-    ADC value range 0 (0.0v) - 4095 (3.3v)
+    returns raw value, voltage, and perc of the battery measurement
+    reader: CurrentReader, powered off before the critical deepsleep
+    deadline: optional Deadline, see _battery_voltage()
     
     Battery Mapping
     3.3v 0% - 4.2v 100%
@@ -47,9 +72,8 @@ def bat_idle(reader = None):
         # Battery monitoring disabled
         return
 
-    raw, voltage = read_battery_voltage()
-    # Map voltage to percentage (3.3V = 0%, 4.2V = 100%)
-    perc = max(min((voltage - 3.3) / (4.2 - 3.3), 1.0), 0.0)
+    raw, voltage = _battery_voltage(deadline)
+    perc = percentage(voltage)
 
     its_late = False
     if perc <= config.battery['critical']:
@@ -58,7 +82,15 @@ def bat_idle(reader = None):
         its_late = True
 
     if its_late:
-       deepsleep()
+       # may run inside the INA226 sampling (battery['concurrent']), switch
+       # it off before sleeping on an almost empty battery, also when the
+       # ALERT wakeup would keep it powered
+       if reader is not None:
+           reader.pwr(False, keep=False)
+       # sleeps forever unless the adaptive scheduler is enabled
+       import ds
+       from scheduler import critical_interval
+       ds.ds(critical_interval())
 
     print(f'Battery: {round(perc*100)}% ({voltage:.2f}V)')
-    return {"voltage_V": voltage, "percentage": perc*100}
\ No newline at end of file
+    return {"voltage_V": voltage, "percentage": perc*100, "raw": raw}
\ No newline at end of file
@@ -0,0 +1,78 @@
+'''Batching of measurements across deepsleep cycles.
+
+Every wake appends a compact record (see record.py) to RTC memory. Only every
+n-th wake (config.batch['size']) brings up WLAN/MQTT and publishes all
+buffered records in a single payload:
+
+    {"fields": ["t", "shunt_V", ...], "now": 1234, "records": [[...], ...]}
+
+`t` and `now` are seconds of the device RTC, so the receiver can compute the
+age of each record as `now - t`.
+
+The records stay in RTC memory until a publish succeeds (clear()); a wake
+that goes to sleep before appending its measurement (WLAN timeout) has it
+appended by store() if it was held with hold(). If batching is switched off
+while records are left, the next wake publishes them together with its own
+record (active()).
+'''
+
+import config
+import record
+import rtcmem
+
+_KEY = 'batch'
+
+_held = None
+
+
+def enabled():
+    return config.batch['enabled']
+
+
+def active():
+    '''True if this wake batches its record: batching is enabled, or it was
+    switched off (e.g. by remote) and records are left to publish.'''
+    return enabled() or bool(records())
+
+
+def records():
+    return rtcmem.get(_KEY, [])
+
+
+def due():
+    '''True if the record taken during this wake completes a batch.'''
+    return len(records()) + 1 >= config.batch['size']
+
+
+def hold(result):
+    '''Append `result` in store() if the MCU sleeps before append().'''
+    global _held
+    _held = result
+
+
+def append(result):
+    '''Store a `CurrentReader.read()` result (with optional 'bat' dict).'''
+    global _held
+    _held = None
+    recs = records()
+    recs.append(record.make(result))
+    # RTC memory is small; drop the oldest records when the buffer is full
+    while len(recs) > config.batch['max_records']:
+        recs.pop(0)
+    rtcmem.put(_KEY, recs)
+
+
+def store():
+    '''Append the held result if it is complete. Called by ds right before
+    going to sleep, ahead of journal.store().'''
+    result = _held
+    if result and 'shunt_raw' in result:
+        append(result)
+
+
+def payload(scale):
+    return record.expand(records(), scale)
+
+
+def clear():
+    rtcmem.put(_KEY, [])
@@ -0,0 +1,85 @@
+'''Hard time budget of one wake.
+
+The wake gets config.budget['wake_ms'] counted from reset. Every blocking
+step takes its slice of it (config.budget['slices']) with phase(), so a
+late phase only gets what is left and the node goes back to sleep in time
+even if WLAN, the broker or the INA226 misbehave. Code that hangs anyway is
+stopped by the hardware watchdog after 'wdt_ms'; deepsleep resets it.
+
+Phases that took longer than their slice and watchdog resets are counted in
+RTC memory and published with the next successful publish as `overrun`.
+
+usage:
+> budget.start()                 # first thing of a wake
+> d = budget.phase('wlan')       # Deadline for the WLAN connect
+> budget.check()                 # done by ds before going to sleep
+'''
+
+import config
+import rtcmem
+from deadline import Deadline
+
+_wake = None
+_wdt = None
+
+
+def start():
+    '''Start the wake budget and the watchdog; count a watchdog reset of
+    the previous wake. After a light sleep (planner.py) the budget starts
+    anew from now.'''
+    global _wake, _wdt
+    cfg = config.budget
+    if _wake is not None:
+        _wake = Deadline(cfg['wake_ms'])
+        feed()
+        return
+    import machine
+    _wake = Deadline(cfg['wake_ms'], start=0)
+    if machine.reset_cause() == machine.WDT_RESET:
+        _record('wdt')
+    if cfg['wdt_ms']:
+        _wdt = machine.WDT(timeout=cfg['wdt_ms'])
+
+
+def feed():
+    '''Feed the watchdog, e.g. between light sleeps.'''
+    if _wdt is not None:
+        _wdt.feed()
+
+
+def phase(name):
+    '''Deadline for phase `name`: its slice, but not past the wake budget.'''
+    ms = config.budget['slices'].get(name)
+    if _wake is None:
+        return Deadline(ms)
+    return _wake.slice(ms)
+
+
+def check():
+    '''Count the phases of this wake that overran their slice (and the wake
+    itself). Call before going to sleep.'''
+    if _wake is None:
+        return
+    import phases
+    for name, ms in config.budget['slices'].items():
+        took = phases.durations.get(name)
+        if took is not None and took > ms:
+            _record(name)
+    if _wake.expired():
+        _record('wake')
+
+
+def _record(name):
+    over = rtcmem.get('overrun') or {}
+    over[name] = over.get(name, 0) + 1
+    rtcmem.put('overrun', over)
+
+
+def report():
+    '''Overrun counts per phase since the last publish, None if there were none.'''
+    return rtcmem.get('overrun')
+
+
+def clear():
+    '''Forget the reported overruns. Call after a successful publish.'''
+    rtcmem.pop('overrun')
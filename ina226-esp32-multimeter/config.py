@@ -19,6 +19,10 @@ if override:
         'ssid':'Rechnernetze',
         'psk':'rnFIW625'
     }
+# give up on the cached BSSID/IP lease after this and associate by SSID + DHCP
+wlan['fast_timeout_ms'] = 3000
+# scan for the strongest AP if associating by SSID takes longer than this
+wlan['direct_timeout_ms'] = 6000
 
 
 # Static ip config. Comment or remove to disable
@@ -31,12 +35,17 @@ if override:
 #     }
 
 
-def id():
-    import machine
-    from binascii import hexlify
-    return hexlify(machine.unique_id()).decode('ascii')
+_id = None
+
 
-id = id()
+def id():
+    '''Hex id of the board, computed on first use (not at import).'''
+    global _id
+    if _id is None:
+        import machine
+        from binascii import hexlify
+        _id = hexlify(machine.unique_id()).decode('ascii')
+    return _id
 
 # mqtt credentials + topics
 mqtt = {
@@ -48,7 +57,18 @@ mqtt = {
     'topics': {
         # EPD
         'current'   : 'ct/current',
+        'current_bin': 'ct/current/bin',
+        # frames of the continuous mode, see stream
+        'stream': 'ct/current/stream',
+        # retained settings per device ({} = config.id()), see remote
+        'config': 'ct/config/{}',
     },
+    # 'json' or 'bin' (compact binary records, see record.py)
+    'format': 'json',
+    # time budget in ms for connect, CONNACK and PUBACK of one wake; when
+    # exceeded the measurement is journaled and the node goes to sleep. DNS
+    # is not bounded, an IP address as 'host' needs none
+    'budget_ms': 3000,
 }
 if override:
     mqtt['host'] = '141.45.191.185'
@@ -69,6 +89,62 @@ ina226 = {
     'current_additive_correction': 0.02020, # additive correction
     'pwr_pin': 25, #GPIO pin controlling power to INA226 trough AO3401 MOSFET
     'pwr_on_delay_ms': 100, #delay after powering on INA226 before it can be used
+    'samples': 3, # samples per wake, the median is published
+    # 'switch': cut the INA226 supply with the MOSFET during deepsleep,
+    # 'powerdown': keep it powered in power-down mode (~2 uA); saves the
+    # power-on delay and the calibration on every wake
+    # (compare with python-scripts/firmware-sim/power-benchmark.py)
+    'power': 'switch',
+    'triggered': True, # single-shot conversions polled via Conversion Ready instead of continuous mode + sleeps
+    'accumulate': True, # running charge/energy totals across wakes (RTC memory)
+    'profile': 'precise', # averaging/conversion-time profile, see 'profiles'
+    # Averaging and conversion-time profiles (AVGMODE/VBUSCT/VSHUNTCT bits).
+    # Time per sample is avg * (vbus_ct_us + vshunt_ct_us). Compare latency
+    # and noise with python-scripts/ina226-profiles/profile-benchmark.py
+    'profiles': {
+        'fast':     {'avg': 4,   'vbus_ct_us': 140, 'vshunt_ct_us': 332},  # ~2 ms
+        'balanced': {'avg': 64,  'vbus_ct_us': 588, 'vshunt_ct_us': 1100}, # ~108 ms
+        'precise':  {'avg': 512, 'vbus_ct_us': 588, 'vshunt_ct_us': 588},  # ~602 ms
+    },
+    # Several INA226 on the same bus (MultiReader); empty = single INA at
+    # ina_addr. The first channel is published at the top level and used for
+    # batching/binary records, all channels are published under 'channels'.
+    # r_shunt_mohm / v_shunt_drop_voltage_at_max_current_mv default to the above.
+    'channels': [
+        # {'name': 'panel',   'addr': 0x40},
+        # {'name': 'battery', 'addr': 0x41, 'r_shunt_mohm': 100},
+        # {'name': 'load',    'addr': 0x44, 'r_shunt_mohm': 100},
+    ],
+}
+
+# Adaptive sampling interval (scheduler.py). Without 'adaptive' the node
+# always sleeps ina226['interval_seconds'] and sleeps forever on critical
+# battery.
+schedule = {
+    'adaptive': False,
+    'min_seconds': 30,        # surplus energy
+    'max_seconds': 900,       # low battery or no harvest
+    'critical_seconds': 3600, # critical battery, instead of sleeping forever
+    'low_perc': 30,           # battery % at or below which the node saves energy
+    'high_perc': 80,          # battery % at or above which surplus is possible
+    'dark_A': 0.00001,        # harvest current at or below which it is dark
+    'surplus_A': 0.0005,      # harvest current needed for surplus
+    'hysteresis_perc': 5,     # band around the % thresholds
+    'hysteresis_A': 0.00002,  # band around the current thresholds
+}
+
+# Wake on the INA226 ALERT pin (alert.py). The INA226 (primary channel)
+# stays powered in continuous mode during deepsleep (~0.35 mA) and wakes the
+# ESP32 through ext0 when the limit is crossed; without an event the node
+# only wakes every alert['interval_seconds'].
+alert = {
+    'enabled': False,
+    'pin': 27,                  # RTC GPIO wired to ALERT (open drain, active low)
+    'function': 'over_current', # 'over_current' (A), 'under_voltage' (V) or 'over_power' (W)
+    'limit': 0.005,
+    'interval_seconds': 3600,   # periodic wake without events
+    # conversions while sleeping, alert latency ~ avg * (vbus_ct + vshunt_ct)
+    'profile': {'avg': 16, 'vbus_ct_us': 1100, 'vshunt_ct_us': 1100},
 }
 
 # shutdown at critical battery level
@@ -78,6 +154,84 @@ battery = {
         'bat_sense': 34,
         # 'ext_sense': 1 # not present on firebeetle
     },
-    'meansby': 10,
+    'meansby': 10,        # ADC samples per burst
+    'trim': 0.2,          # share of lowest/highest samples dropped as outliers
+    'cache_cycles': 10,   # re-measure every n-th wake while the voltage is stable
+    'stable_mv': 10,      # max. change between two measurements to count as stable
+    'concurrent': True,   # sample while the INA226 converts
     'critical': 0.1,
-}
\ No newline at end of file
+}
+
+# Batch several wake cycles in RTC memory and publish them in one radio
+# session. With 'size': 5 WLAN/MQTT is only brought up on every 5th wake.
+batch = {
+    'enabled': False,
+    'size': 5,          # records per publish
+    'max_records': 20,  # oldest records are dropped, also when RTC memory (2 KB) is full
+}
+
+# Store-and-forward journal (journal.py). Records of wakes whose publish
+# failed are kept on flash and sent after the next successful publish.
+journal = {
+    'enabled': True,
+    'path': '/journal.bin',
+    'max_records': 1024,  # flash ring buffer, 18 bytes per record
+    'block_records': 8,   # collected in RTC memory, then written to flash at once
+    'chunk_records': 50,  # records per MQTT message when flushing
+    'flush_records': 200, # max. records flushed per wake
+    'flush_ms': 2000,     # max. time spent flushing per wake
+}
+
+# Continuous streaming (stream.py) for bench and mains-powered installations:
+# no deepsleep, the INA226 is sampled at rate_hz and frames of frame_ms are
+# published on mqtt['topics']['stream'] over one persistent MQTT session.
+stream = {
+    'enabled': False,
+    'rate_hz': 50,        # 10..100, the profile's conversion time must fit
+    'profile': 'fast',    # see ina226['profiles']
+    'frame_ms': 250,      # samples per frame = rate_hz * frame_ms / 1000
+    'keepalive': 30,      # s, PINGREQ every keepalive / 2
+}
+
+# Remote tuning (remote.py): publishing wakes read the retained JSON message
+# on mqtt['topics']['config'] and apply the listed keys, e.g.
+#   {"v": 3, "ina226.interval_seconds": 300, "ina226.profile": "balanced"}
+remote = {
+    'enabled': False,
+    'wait_ms': 300,            # max. wait for the retained message per wake
+    'path': '/remote.json',    # copy on flash for wakes after a power loss
+    'keys': (
+        'ina226.interval_seconds', 'ina226.samples', 'ina226.profile',
+        'batch.enabled', 'batch.size',
+        'schedule.adaptive', 'schedule.min_seconds', 'schedule.max_seconds',
+        'alert.enabled', 'alert.limit', 'alert.interval_seconds',
+    ),
+}
+
+# Time budget of a wake (budget.py): every blocking phase gets a slice of
+# wake_ms (counted from reset), the hardware watchdog resets the node after
+# wdt_ms (0 = off). Overruns are published as `overrun` with the next publish.
+budget = {
+    'wake_ms': 20000,
+    'wdt_ms': 25000,
+    'slices': {
+        'ina': 500,
+        'wlan': 12000,    # incl. sampling while the link comes up
+        'sample': 2000,
+        'bat': 500,
+        'mqtt': 3000,     # connect, CONNACK
+        'publish': 2000,  # PUBACK of the measurement
+    },
+}
+
+# Sleep between measurements (planner.py): 'deep' always deep-sleeps, 'light'
+# keeps WLAN and the MQTT session through machine.lightsleep(), 'auto' picks
+# the cheaper of both for the interval from the measured awake times.
+sleep = {
+    'mode': 'deep',
+    'deep_ua': 10,     # board in deepsleep
+    'light_ua': 2000,  # lightsleep with WLAN associated (power save, DTIM)
+    'cpu_ma': 40,      # awake, radio off
+    'radio_ma': 80,    # extra while WLAN is active
+    'boot_ms': 250,    # reset until main.py runs, not in ticks_ms
+}
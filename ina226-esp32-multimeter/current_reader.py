@@ -1,8 +1,19 @@
 
+import gc
 import time
 from machine import I2C, Pin
-from lib.ina226 import INA226
+from lib.ina226 import (
+	INA226,
+	convert,
+	make_config,
+	CONFIG_MODE_SANDBVOLT_CONTINUOUS,
+	CONFIG_MODE_SANDBVOLT_TRIGGERED,
+)
 import esp32
+import rtcmem
+import phases
+import alert
+from stats import Stats
 
 try:
 	import config
@@ -17,10 +28,12 @@ Usage example (on the ESP32 REPL):
 
 	from current_reader import CurrentReader
 	r = CurrentReader()
-	r.run()  # blocking loop printing measurements
+	r.pwr(True)
+	r.run()  # blocking loop printing a line per frame (Ctrl-C to stop)
 
 The class also exposes `read()` which returns a dict with current readings
-so it can be unit-tested or called from another scheduler.
+so it can be unit-tested or called from another scheduler. `MultiReader`
+does the same for several INA226 on one bus (config.ina226['channels']).
 """
 
 
@@ -59,6 +72,9 @@ class CurrentReader:
 		self.pwr_pin_cfg = cfg.get('pwr_pin')
 		self.pwr_pin = None
 		self.pwr_on_delay_ms = cfg.get('pwr_on_delay_ms', 20)
+		# 'switch': cut the supply with the MOSFET while sleeping,
+		# 'powerdown': keep it powered in power-down mode (registers retained)
+		self.power_mode = cfg.get('power', 'switch')
 
 		self.interval_seconds = interval_seconds if interval_seconds is not None else cfg.get('interval_seconds', 2)
 		self.r_shunt_mohm = r_shunt_mohm if r_shunt_mohm is not None else cfg.get('r_shunt_mohm', 10050)
@@ -71,6 +87,14 @@ class CurrentReader:
 		self.ina_addr = ina_addr if ina_addr is not None else cfg.get('ina_addr', 0x40)
 		self.current_multiplicative_correction = cfg.get('current_multiplicative_correction', 1.0)
 		self.current_additive_correction = cfg.get('current_additive_correction', 0.0)
+		# triggered (single-shot) conversions: each sample is taken as soon as
+		# its conversion has finished, the chip idles in between
+		self.triggered = cfg.get('triggered', True)
+		# averaging/conversion-time profiles, switchable with set_profile()
+		self.profiles = cfg.get('profiles', {})
+		self.profile = cfg.get('profile')
+		# integrate charge/energy across wakes into totals kept in RTC memory
+		self.accumulate = cfg.get('accumulate', True)
 
 		# create or use provided I2C
 		self.i2c = i2c or self.init_i2c(self.sda_pin, self.scl_pin, self.i2c_freq)
@@ -84,6 +108,17 @@ class CurrentReader:
 		# track whether we've powered the INA on via pwr(); starts as False
 		self._powered = False
 
+		# (calibration value, current LSB) of the INA, kept after power off so
+		# raw register codes can still be converted
+		self.scale = None
+
+		# sample buffers of read(), see _channels()
+		self._stats = None
+
+		# frame handed from run() to its sender thread (None = sender idle)
+		self._frame = None
+		self._handover = None
+
 		# calibration will be applied when INA is initialized (after powering on)
 
 	@staticmethod
@@ -94,13 +129,37 @@ class CurrentReader:
 		except Exception:
 			return I2C(scl=Pin(scl_pin), sda=Pin(sda_pin), freq=freq)
 
-	def read(self, samples=1, delay=1):
+	def ina_config(self):
+		"""Config register value written on calibration."""
+		mode = CONFIG_MODE_SANDBVOLT_TRIGGERED if self.triggered else CONFIG_MODE_SANDBVOLT_CONTINUOUS
+		return make_config(mode=mode, **self.profiles.get(self.profile, {}))
+
+	def set_profile(self, name):
+		"""Switch to one of the named profiles in `config.ina226['profiles']`.
+
+		Takes effect immediately when the INA is powered, otherwise on the
+		next pwr(True).
+		"""
+		if name not in self.profiles:
+			raise ValueError("unknown INA226 profile: {}".format(name))
+		self.profile = name
+		if self.ina is not None:
+			self.ina.configure(self.ina_config())
+
+	def read(self, samples=1, delay=0, during=None, deadline=None):
 		"""Read values from INA226.
 
 		If `samples` > 1, take multiple readings and return the median for each
-		measured key. `delay` controls seconds between samples;.
+		measured key plus `stats` with mean, min, max and std of `current_A`
+		and `power_W` (see stats.py). In triggered mode every sample starts a
+		conversion and is read as soon as the Conversion Ready flag is set. `delay` adds seconds
+		between samples (only needed in continuous mode). `during` is an
+		optional callable run once while the first conversion is in progress.
+		Once the optional `deadline` has expired no further samples are taken.
 
-		Returns a dict with keys: `shunt_V`, `bus_V`, `current_A`.
+		Returns a dict with keys: `shunt_V`, `bus_V`, `current_A`, `power_W`,
+		the raw register codes `shunt_raw`, `bus_raw` and, if accumulation is
+		enabled, `charge_mAh` and `energy_mWh`.
 		"""
 		# At this point the caller must ensure the INA is powered and initialized
 		# (call pwr(True) before calling read()). We do not change power here.
@@ -109,63 +168,259 @@ class CurrentReader:
 		
 		print("Taking readings... ", end='')
 
+		pending = [during] if during is not None else []
+
 		def _single_read():
-			shunt_v = self.ina.shunt_voltage / 1000.0
-			bus_v = self.ina.bus_voltage
-			current = self.ina.current
-			return {"shunt_V": shunt_v, "bus_V": bus_v, "current_A": current}
-		
-		def _median(vals):
-			s = sorted(vals)
-			n = len(s)
-			mid = n // 2
-			if n % 2 == 1:
-				return s[mid]
-			return (s[mid - 1] + s[mid]) / 2
+			work = pending.pop() if pending else None
+			if self.ina.triggered:
+				self.ina.trigger()
+				if not self.ina.wait_conversion(work=work):
+					raise RuntimeError("INA226 conversion timed out")
+			elif work is not None:
+				work()
+			shunt_raw, bus_raw = self.ina.read_raw()
+			_, _, current, power = convert(shunt_raw, bus_raw, *self.scale)
+			return shunt_raw, bus_raw, current, power
+
+		def _result(shunt_raw, bus_raw, current, power):
+			shunt_mv, bus_v, _, _ = convert(shunt_raw, bus_raw, *self.scale)
+			return {"shunt_V": shunt_mv / 1000.0, "bus_V": bus_v, "current_A": current, "power_W": power,
+				"shunt_raw": shunt_raw, "bus_raw": bus_raw}
 
 		# single sample fast path
 		if not samples or samples <= 1:
-			return _single_read()
-
-		# collect samples
-		raw = []
-		for i in range(int(samples)):
-			raw.append(_single_read())
-			print(i+1, end=' ')
-			if i + 1 < samples:
+			return self._accumulate(_result(*_single_read()))
+
+		# collect samples into the preallocated per-channel buffers
+		samples = int(samples)
+		channels = self._channels(samples)
+		for st in channels:
+			st.reset()
+		n = 0
+		for i in range(samples):
+			if n and deadline is not None and deadline.expired():
+				break
+			values = _single_read()
+			for j in range(4):
+				channels[j].add(values[j])
+			n += 1
+			if delay and i + 1 < samples:
 				time.sleep(delay)
 
-		print(' done')
-		print('Computing medians...', end='')
-
-		# compute medians
-		keys = set()
-		for rr in raw:
-			keys.update(rr.keys())
-		result = {}
-		for k in keys:
-			vals = [rr[k] for rr in raw if k in rr]
-			if vals:
-				result[k] = _median(vals)
-		print('done')
+		print('%d samples done' % n)
+
+		result = self._summary(channels, self.scale)
 		print("Read result (medians):", result)
+		return self._accumulate(result)
+
+	@staticmethod
+	def _summary(channels, scale):
+		"""Result dict from the shunt_raw, bus_raw, current_A, power_W Stats."""
+		shunt_raw, bus_raw, current, power = [st.median() for st in channels]
+		shunt_mv, bus_v, _, _ = convert(shunt_raw, bus_raw, *scale)
+		return {"shunt_V": shunt_mv / 1000.0, "bus_V": bus_v, "current_A": current, "power_W": power,
+			"shunt_raw": shunt_raw, "bus_raw": bus_raw,
+			"stats": {
+				"current_A": channels[2].summary(),
+				"power_W": channels[3].summary(),
+			}}
+
+	def _channels(self, samples):
+		"""Stats buffers for shunt_raw, bus_raw, current_A, power_W; reallocated
+		only when more samples than before are requested."""
+		if self._stats is None or len(self._stats[0].buf) < samples:
+			self._stats = None
+			gc.collect()
+			self._stats = [Stats(samples) for _ in range(4)]
+		return self._stats
+
+	def run(self, rate_hz=None, frame_ms=None, sink=None, profile=None, frames=None):
+		"""Sample continuously and hand out frames of raw samples. Blocking.
+
+		Samples are taken at `rate_hz` with the INA226 `profile` and collected
+		into a stream frame (record.py) of `frame_ms`. Two frame buffers are
+		used in turns: while one is passed to `sink(frame)` by a sender thread
+		(e.g. an MQTT publish, see stream.py), sampling goes on into the other,
+		so network I/O never delays a sample. If the sender is still busy when
+		the next frame is complete, that frame is dropped (a gap in the frame
+		sequence numbers). Without `sink` a summary line is printed per frame.
+
+		Defaults come from config.stream. `MultiReader` streams its primary
+		channel. Runs until `frames` frames are done,
+		KeyboardInterrupt or an exception of the sampling; exceptions raised by
+		`sink` are printed and the frame is lost. Returns (frames, dropped).
+		"""
+		import _thread
+		import record
+		cfg = getattr(config, 'stream', {}) if config else {}
+		rate_hz = rate_hz or cfg.get('rate_hz', 50)
+		frame_ms = frame_ms or cfg.get('frame_ms', 250)
+		profile = profile or cfg.get('profile')
+		if self.ina is None:
+			raise RuntimeError("INA not initialized. Call pwr(True) before run().")
+		if profile:
+			self.set_profile(profile)
+		if sink is None:
+			sink = self._print_frame
+
+		period_us = int(1000000 // rate_hz)
+		per_frame = max(int(frame_ms * 1000 // period_us), 1)
+		bufs = [record.frame_buffer(per_frame), record.frame_buffer(per_frame)]
+		active = 0
+		count = 0
+		seq = 0
+		dropped = 0
+		t0 = 0
+
+		self._frame = None
+		# released whenever there is a frame for the sender (or it has to stop)
+		self._handover = _thread.allocate_lock()
+		self._handover.acquire()
+		_thread.start_new_thread(self._sender, (sink,))
+		ina = self.ina
+		next_us = time.ticks_us()
+		try:
+			while frames is None or seq < frames:
+				if ina.triggered:
+					ina.trigger()
+					if not ina.wait_conversion():
+						raise RuntimeError("INA226 conversion timed out")
+				shunt_raw, bus_raw = ina.read_raw()
+				if not count:
+					t0 = time.ticks_ms()
+				record.put_sample(bufs[active], count, shunt_raw, bus_raw)
+				count += 1
+				if count == per_frame:
+					frame = record.finish_frame(bufs[active], count, seq, t0, period_us, self.scale)
+					seq += 1
+					count = 0
+					if self._frame is None:
+						# hand over and continue in the other buffer
+						self._frame = frame
+						self._handover.release()
+						active ^= 1
+					else:
+						# sender still busy with the previous frame
+						dropped += 1
+				next_us = time.ticks_add(next_us, period_us)
+				wait = time.ticks_diff(next_us, time.ticks_us())
+				if wait >= 1000:
+					# sleep_ms releases the GIL, the sender thread runs meanwhile;
+					# sleep_us busy-waits and keeps it
+					time.sleep_ms(wait // 1000)
+					wait = time.ticks_diff(next_us, time.ticks_us())
+				if wait > 0:
+					time.sleep_us(wait)
+				elif wait < -period_us:
+					# fell behind by more than a sample, do not try to catch up
+					next_us = time.ticks_us()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			# let the sender finish the last frame, then stop it
+			while self._frame is not None:
+				time.sleep_ms(1)
+			self._handover.release()
+		if dropped:
+			print("stream: %d of %d frames dropped" % (dropped, seq))
+		return seq, dropped
+
+	def _sender(self, sink):
+		"""Thread of run(): passes each handed-over frame to sink()."""
+		while True:
+			self._handover.acquire()
+			frame = self._frame
+			if frame is None:
+				return
+			try:
+				sink(frame)
+			except Exception as exc:
+				print("stream: sending frame failed:", exc)
+			# the buffer may be filled again
+			self._frame = None
+
+	def _print_frame(self, frame):
+		import record
+		n = record.frame_count(frame)
+		shunt_raw, bus_raw = record.get_sample(frame, n - 1)
+		_, bus_v, current, power = convert(shunt_raw, bus_raw, *self.scale)
+		print("%d samples, last: %.6f A %.3f V %.6f W" % (n, current, bus_v, power))
+
+	def _accumulate(self, result):
+		"""Add charge (mAh) and energy (mWh) since the last wake to the totals.
+
+		The device only sees one snapshot per wake, so current and power are
+		integrated with the trapezoidal rule between the previous and this
+		snapshot. State is kept in RTC memory as [t, current_A, power_W, mAh,
+		mWh] and survives deepsleep; the totals restart after a power loss.
+		"""
+		if not self.accumulate:
+			return result
+		now = time.time()
+		current = result["current_A"]
+		power = result["power_W"]
+		acc = rtcmem.get('acc')
+		if acc:
+			t, prev_current, prev_power, mah, mwh = acc
+			dt_h = (now - t) / 3600
+			# a negative interval means the RTC was reset; skip that interval
+			if dt_h > 0:
+				mah += (prev_current + current) / 2 * 1000 * dt_h
+				mwh += (prev_power + power) / 2 * 1000 * dt_h
+		else:
+			mah = mwh = 0.0
+		rtcmem.put('acc', [now, current, power, mah, mwh])
+		result["charge_mAh"] = mah
+		result["energy_mWh"] = mwh
 		return result
 
-	def pwr(self, on):
+	def _init_ina(self, retained=False):
+		"""Create and calibrate the INA226 driver after power-up. With
+		`retained` the chip stayed powered and calibration is skipped if its
+		registers survived (INA226.restore())."""
+		try:
+			self.ina = INA226(self.i2c, addr=self.ina_addr, init=not retained)
+			if self.r_shunt_mohm is not None:
+				try:
+					setup = self.ina.restore if retained else self.ina.calibrate
+					setup(config=self.ina_config(), r_shunt=self.r_shunt_mohm, v_shunt=self.v_shunt_drop_voltage_at_max_current_mv)
+				except Exception as exc:
+					print("Warning: failed to set custom calibration:", exc)
+			elif retained:
+				self.ina.calibrate()
+			self.scale = self.ina.scale
+		except Exception as exc:
+			raise RuntimeError("Failed to initialize INA226: {}".format(exc))
+
+	def _power_down(self):
+		self.ina.power_down()
+
+	def pwr(self, on, keep=True):
 		"""Control power to the INA226.
 
 		Parameters:
 			on (bool): True to power ON (drive MOSFET gate low), False to power OFF.
+			keep (bool): False switches the supply off for good, even if the ALERT
+				wakeup is armed, power is 'powerdown' or an earlier pwr(False) left
+				the chip powered.
 
 		This method is idempotent. When powering ON it will initialize the INA
 		object (and apply calibration). When powering OFF it will deinitialize the
 		INA object and attempt to enable pin hold so the pin state persists during
-		deep sleep.
+		deep sleep. If the ALERT wakeup is armed (see alert.py) the INA226 is
+		left powered in continuous mode with the alert limit set instead.
+
+		With config.ina226['power'] = 'powerdown' the supply stays on and the
+		chip is put into its power-down mode. Powering on after deepsleep then
+		skips the power-on delay and, if the registers were retained, the
+		calibration (one register read and one write instead).
 		"""
 		if on:
 			if self._powered:
 				return
 			print("Powering on INA226...",end='')
+			# the chip stayed powered during deepsleep (RTC memory is lost on reset)
+			retained = bool(rtcmem.get('ina_on'))
 			# drive low to power on (active-low MOSFET gate)
 			try:
 				esp32.gpio_deep_sleep_hold(False)
@@ -173,32 +428,159 @@ class CurrentReader:
 			except Exception:
 				pass
 			# wait for device to become ready
-			time.sleep(self.pwr_on_delay_ms / 1000.0)
+			if not retained:
+				time.sleep(self.pwr_on_delay_ms / 1000.0)
 			# initialize INA if not present
 			if self.ina is None:
-				try:
-					self.ina = INA226(self.i2c, addr=self.ina_addr)
-					if self.r_shunt_mohm is not None:
-						try:
-							self.ina.calibrate(r_shunt=self.r_shunt_mohm, v_shunt=self.v_shunt_drop_voltage_at_max_current_mv)
-						except Exception as exc:
-							print("Warning: failed to set custom calibration:", exc)
-				except Exception as exc:
-					raise RuntimeError("Failed to initialize INA226: {}".format(exc))
+				self._init_ina(retained)
+				# boot + imports + power-up until the INA226 answered
+				phases.since_reset('first_i2c')
 			self._powered = True
 			print(" done")
 		else:
 			# power off
 			print("Powering off INA226... ",end='')
 			print(self._powered)
-			if not self._powered:
+			off = not keep
+			if not self._powered and not (off and rtcmem.get('ina_on')):
 				return
 			print(self.pwr_pin)
+			# with ALERT wakeup the INA226 stays powered and watches the limit
+			keep = not off and alert.armed() and self.ina is not None
+			if keep:
+				try:
+					alert.arm(self.ina)
+				except Exception as exc:
+					print("Failed to arm INA226 alert:", exc)
+					keep = False
+			elif not off and self.power_mode == 'powerdown' and self.ina is not None:
+				try:
+					self._power_down()
+					keep = True
+				except Exception as exc:
+					print("Failed to power down INA226:", exc)
+			rtcmem.put('ina_on', keep)
 			try:
 				esp32.gpio_deep_sleep_hold(True)
-				self.pwr_pin = Pin(self.pwr_pin_cfg, Pin.OUT, value=1, hold=True)
+				self.pwr_pin = Pin(self.pwr_pin_cfg, Pin.OUT, value=0 if keep else 1, hold=True)
 			except Exception:
 				pass
 			# deinitialize INA reference; will be recreated on next power-on
 			self.ina = None
 			self._powered = False
+
+
+class MultiReader(CurrentReader):
+	"""Several INA226 on the shared I2C bus and power switch.
+
+	Channels come from `config.ina226['channels']`, a list of dicts with
+	`name`, `addr` and optionally `r_shunt_mohm` and
+	`v_shunt_drop_voltage_at_max_current_mv` (defaults from config.ina226).
+	All chips use the same profile; their conversions are triggered together
+	and collected in one pass, so a sample takes one conversion time no matter
+	how many channels there are.
+
+	The first channel is the primary one: `read()` returns its values at the
+	top level like `CurrentReader.read()` (used for batching, the binary
+	format, charge accumulation and the scheduler) and all channels under
+	`channels`, keyed by name.
+	"""
+
+	def __init__(self, channels=None, **kwargs):
+		super().__init__(**kwargs)
+		cfg = getattr(config, 'ina226', {}) if config else {}
+		self.channels = channels if channels is not None else cfg.get('channels', [])
+		if not self.channels:
+			raise ValueError("MultiReader needs at least one channel")
+		self.inas = {}
+		self._stat_sets = None
+
+	def _init_ina(self, retained=False):
+		self.inas = {}
+		for ch in self.channels:
+			try:
+				ina = INA226(self.i2c, addr=ch['addr'], init=not retained)
+				setup = ina.restore if retained else ina.calibrate
+				setup(
+					config=self.ina_config(),
+					r_shunt=ch.get('r_shunt_mohm', self.r_shunt_mohm),
+					v_shunt=ch.get('v_shunt_drop_voltage_at_max_current_mv', self.v_shunt_drop_voltage_at_max_current_mv),
+				)
+			except Exception as exc:
+				raise RuntimeError("Failed to initialize INA226 '{}' at 0x{:02x}: {}".format(ch['name'], ch['addr'], exc))
+			self.inas[ch['name']] = ina
+		self.ina = self.inas[self.channels[0]['name']]
+		self.scale = self.ina.scale
+
+	def _power_down(self):
+		for ina in self.inas.values():
+			ina.power_down()
+
+	def pwr(self, on, keep=True):
+		super().pwr(on, keep)
+		if not on:
+			self.inas = {}
+
+	def set_profile(self, name):
+		super().set_profile(name)
+		for ina in self.inas.values():
+			ina.configure(self.ina_config())
+
+	def read(self, samples=1, delay=0, during=None, deadline=None):
+		"""Read all channels, see the class docstring. Parameters as for
+		`CurrentReader.read()`."""
+		if not self.inas:
+			raise RuntimeError("INA not initialized. Call pwr(True) before read().")
+
+		print("Taking readings of %d channels... " % len(self.channels), end='')
+
+		samples = max(int(samples or 1), 1)
+		inas = [self.inas[ch['name']] for ch in self.channels]
+		sets = self._stats_for(samples)
+		for channels in sets:
+			for st in channels:
+				st.reset()
+		work = during
+		n = 0
+		for i in range(samples):
+			if n and deadline is not None and deadline.expired():
+				break
+			if self.triggered:
+				for ina in inas:
+					ina.trigger()
+				# all started together: after the first wait the others are ready
+				for ina in inas:
+					if not ina.wait_conversion(work=work):
+						raise RuntimeError("INA226 0x{:02x} conversion timed out".format(ina.i2c_addr))
+					work = None
+			elif work is not None:
+				work()
+				work = None
+			for ina, channels in zip(inas, sets):
+				shunt_raw, bus_raw = ina.read_raw()
+				_, _, current, power = convert(shunt_raw, bus_raw, *ina.scale)
+				channels[0].add(shunt_raw)
+				channels[1].add(bus_raw)
+				channels[2].add(current)
+				channels[3].add(power)
+			n += 1
+			if delay and i + 1 < samples:
+				time.sleep(delay)
+
+		print('%d samples done' % n)
+
+		by_name = {}
+		for ch, ina, channels in zip(self.channels, inas, sets):
+			by_name[ch['name']] = self._summary(channels, ina.scale)
+		result = dict(by_name[self.channels[0]['name']])
+		result["channels"] = by_name
+		print("Read result (medians):", result)
+		return self._accumulate(result)
+
+	def _stats_for(self, samples):
+		"""One set of channel Stats per INA226, see `CurrentReader._channels()`."""
+		if self._stat_sets is None or len(self._stat_sets[0][0].buf) < samples:
+			self._stat_sets = None
+			gc.collect()
+			self._stat_sets = [[Stats(samples) for _ in range(4)] for _ in self.channels]
+		return self._stat_sets
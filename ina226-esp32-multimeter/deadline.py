@@ -0,0 +1,74 @@
+'''Time budget shared by several blocking steps.
+
+A Deadline is created once (e.g. per MQTT session) and handed to every step
+that may block. Socket waits go through wait(), which polls with whatever is
+left of the budget and raises OSError(ETIMEDOUT) when it is used up, so a
+slow or silent peer cannot keep the node awake.
+
+usage:
+> d = Deadline(5000)
+> d.wait(sock, select.POLLIN)   # raises OSError(ETIMEDOUT) after 5 s in total
+> d.remaining()                 # ms left, None without a limit
+> d.slice(1000)                 # 1 s from now, but not past d
+'''
+
+import errno
+import select
+from time import ticks_ms, ticks_diff
+
+
+class Deadline:
+    def __init__(self, ms=None, start=None):
+        '''`ms` is the budget from `start` (ticks_ms, default now); None
+        means no limit.'''
+        self.start = ticks_ms() if start is None else start
+        self.ms = ms
+        self._poll = None
+
+    def remaining(self):
+        '''ms left (>= 0), or None without a limit.'''
+        if self.ms is None:
+            return None
+        return max(self.ms - ticks_diff(ticks_ms(), self.start), 0)
+
+    def expired(self):
+        return self.ms is not None and self.remaining() == 0
+
+    def slice(self, ms):
+        '''Deadline of `ms` from now (None: no own limit) that does not
+        outlast this one.'''
+        remaining = self.remaining()
+        if remaining is not None and (ms is None or ms > remaining):
+            ms = remaining
+        return Deadline(ms)
+
+    def check(self):
+        '''Raise OSError(ETIMEDOUT) if the budget is used up.'''
+        if self.expired():
+            raise OSError(errno.ETIMEDOUT)
+
+    def wait(self, sock, event):
+        '''
+        Block until `sock` is ready for `event` (select.POLLIN or POLLOUT).
+        Raises OSError(ETIMEDOUT) when the budget runs out first and
+        OSError(ECONNRESET) if the socket reports an error or hangup.
+        '''
+        self.check()
+        if self._poll is None:
+            self._poll = select.poll()
+        self._poll.register(sock, event)
+        try:
+            remaining = self.remaining()
+            ready = self._poll.poll(-1 if remaining is None else remaining)
+        finally:
+            self._poll.unregister(sock)
+        if not ready:
+            raise OSError(errno.ETIMEDOUT)
+        if ready[0][1] & (select.POLLERR | select.POLLHUP):
+            raise OSError(errno.ECONNRESET)
+
+    def sleep(self, ms):
+        '''Sleep for `ms`, but not past the deadline.'''
+        from time import sleep_ms
+        remaining = self.remaining()
+        sleep_ms(ms if remaining is None else min(ms, remaining))
@@ -5,7 +5,20 @@ def ds(time):
     import esp32
     from time import sleep
     import config as config
+    import rtcmem
+    import phases
+    import journal
+    import budget
+    import batch
+    import alert
 
+    budget.check()
+    phases.store()
+    batch.store()
+    # straight to flash if we may not wake up again
+    journal.store(sync=time == -1)
+    rtcmem.save()
+    alert.wake_source()
     if not time == -1:
         print(f'wakeup in {time}ms')
         sleep(0.1)
@@ -17,11 +30,31 @@ def ds(time):
     sleep(0.1)
     deepsleep()
 
-def ds_interval_seconds():
-    '''Put the MCU into deepsleep for the configured interval seconds'''
+def ds_interval_seconds(seconds=None):
+    '''Put the MCU into deepsleep for the interval seconds, by default the
+    one chosen by the scheduler (or the configured one)'''
     import config as config
     from machine import deepsleep, Pin
     import time
+    import rtcmem
+    import scheduler
 
+    import phases
+    import journal
+    import alert
+    import budget
+    import planner
+    import batch
+
+    if seconds is None:
+        seconds = scheduler.interval()
+    budget.check()
+    planner.store()
+    phases.store()
+    batch.store()
+    journal.store()
+    rtcmem.save()
+    alert.wake_source()
     print("main end ticks_ms:", time.ticks_ms())
-    deepsleep(config.ina226['interval_seconds'] * 1000 - time.ticks_ms())
\ No newline at end of file
+    # awake time of this cycle, ticks_ms() after a wake from reset
+    deepsleep(max(seconds * 1000 - planner.awake_ms(), 1))
\ No newline at end of file
@@ -1,18 +1,35 @@
 import network
-from machine import idle
+from binascii import hexlify, unhexlify
+from time import ticks_ms, ticks_diff
 import config as config
+import rtcmem
 from timeout import timeout
-from time import sleep
 
-def connect(reader=None, timeout_ms=12000):
-    print('.', end='')
-    sleep(0.1)
+# connect-time stats of this wake, published with the measurement
+stats = {}
 
-    nic = network.WLAN(network.STA_IF)
 
-    print('.', end='')
-    sleep(0.1)
+def _start_fast(nic, cache):
+    '''Start connecting with the cached IP config (no DHCP), to the cached AP
+    if its BSSID is known (no scan).'''
+    try:
+        nic.ifconfig(tuple(cache['ip']))
+        if cache['ch']:
+            try:
+                nic.config(channel=cache['ch'])
+            except (OSError, ValueError):
+                pass
+        bssid = cache['bssid']
+        nic.connect(config.wlan['ssid'], config.wlan['psk'], bssid=unhexlify(bssid) if bssid else None)
+    except OSError as exc:
+        print('fast reconnect failed:', exc)
+        return False
+    return True
+
 
+def _start_full(nic):
+    '''Start associating by SSID with the configured IP config (static or
+    DHCP), the driver picks the AP. Returns at once.'''
     try:
         nic.ifconfig((
             config.ip['addr'],
@@ -21,28 +38,127 @@ def connect(reader=None, timeout_ms=12000):
             config.ip['dns']
         ))
     except AttributeError:
-        pass
+        try:
+            nic.ifconfig('dhcp')
+        except (OSError, ValueError, TypeError):
+            pass
+    nic.connect(config.wlan['ssid'], config.wlan['psk'])
 
-    print('.', end='')
-    sleep(0.1)
 
-    nic.active(True)
-    print('.', end='')
-    sleep(0.1)
+def _channel(nic):
+    '''Channel of the associated AP, None if the port does not tell.'''
+    try:
+        return nic.config('channel')
+    except (OSError, ValueError):
+        return None
 
-    nic.connect(config.wlan['ssid'], config.wlan['psk'])
 
-    print('.', end='')
-    sleep(0.1)
+def _scan(nic):
+    '''Strongest AP of the configured SSID as scan entry (ssid, bssid,
+    channel, RSSI, security, hidden) or None. Blocks for the scan.'''
+    ssid = config.wlan['ssid'].encode()
+    aps = [ap for ap in nic.scan() if ap[0] == ssid]
+    if not aps:
+        return None
+    return max(aps, key=lambda ap: ap[3])
+
+
+# state of the connection attempt started by begin()
+_nic = None
+_start = 0
+_fast = False
+_ap = None
+
+
+def begin():
+    '''
+    Start connecting to the configured WLAN and return immediately. Tries the
+    cached BSSID/channel/IP lease from the last wake first, else associates
+    by SSID with DHCP; wait() falls back to the other if that does not come
+    up. Nothing here scans.
+    '''
+    global _nic, _start, _fast, _ap
+    _start = ticks_ms()
+    _nic = network.WLAN(network.STA_IF)
+    if _nic.isconnected():
+        # still associated after a light sleep (planner.py)
+        _fast = True
+        _ap = None
+        return _nic
+    _nic.active(True)
 
     print('Connecting to WLAN %s...' % config.wlan['ssid'], end='')
 
-    if timeout(nic.isconnected, timeout_ms):
+    cache = rtcmem.get('wlan')
+    _ap = None
+    _fast = bool(cache) and _start_fast(_nic, cache)
+    if not _fast:
+        _start_full(_nic)
+    return _nic
+
+
+def radio_ms():
+    '''ms since begin() switched the radio on.'''
+    return ticks_diff(ticks_ms(), _start)
+
+
+def wait(reader=None, timeout_ms=12000, work=None, deadline=None):
+    '''
+    Wait until the connection started by begin() is up. Callables in the
+    `work` list are run (and removed) one at a time while waiting. The wait
+    ends `timeout_ms` after begin() or, given a Deadline, when that expires.
+    On timeout the reader is powered off and the MCU goes to deepsleep.
+
+    A fast reconnect that does not come up falls back to associating by
+    SSID, that in turn to a scan for the strongest AP. After a connect
+    without the cache the IP lease and channel are cached for the next wake,
+    the BSSID only if the scan chose it (the driver does not report the one
+    it associated with).
+    '''
+    global _fast, _ap
+
+    def left():
+        if deadline is not None and deadline.ms is not None:
+            return deadline.remaining()
+        return timeout_ms - ticks_diff(ticks_ms(), _start)
+
+    if _fast and timeout(_nic.isconnected, min(config.wlan.get('fast_timeout_ms', 3000), left()), work):
+        # AP changed or lease expired
+        print(' fast reconnect timed out', end='')
+        rtcmem.pop('wlan')
+        _nic.disconnect()
+        _fast = False
+        _start_full(_nic)
+
+    if (not _fast and timeout(_nic.isconnected, min(config.wlan.get('direct_timeout_ms', 6000), left()), work)
+            and left() > 0):
+        # the driver did not get a link, try the strongest AP
+        print(' scanning', end='')
+        _nic.disconnect()
+        _ap = _scan(_nic)
+        _nic.connect(config.wlan['ssid'], config.wlan['psk'], bssid=_ap[1] if _ap else None)
+
+    if not _fast and timeout(_nic.isconnected, left(), work):
         print('WLAN connect timed out')
         reader.pwr(False)
         import ds as ds
         ds.ds_interval_seconds()
         return False
 
-    print(' connected')
-    return True
\ No newline at end of file
+    stats['ms'] = ticks_diff(ticks_ms(), _start)
+    stats['fast'] = _fast
+    print(' connected (%s, %d ms)' % ('fast' if _fast else 'full', stats['ms']))
+
+    if not _fast:
+        rtcmem.put('wlan', {
+            'bssid': hexlify(_ap[1]).decode() if _ap else None,
+            'ch': _ap[2] if _ap else _channel(_nic),
+            'ip': list(_nic.ifconfig()),
+        })
+    return True
+
+
+def connect(reader=None, timeout_ms=12000, deadline=None):
+    '''Connect to the configured WLAN, blocking until the link is up.'''
+    begin()
+    return wait(reader, timeout_ms, deadline=deadline)
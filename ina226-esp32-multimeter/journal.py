@@ -0,0 +1,225 @@
+'''Store-and-forward journal for measurements that could not be published.
+
+main arms the journal with hold() before connecting and disarms it with
+release() after a successful publish. If the MCU goes to sleep in between
+(WLAN or MQTT failure, see ds.py), the records of this wake (and the pending
+batch) are journaled by store().
+
+To avoid many small flash writes, journaled records are first collected in
+RTC memory and written to flash in blocks of config.journal['block_records'].
+The flash file is a ring buffer of fixed-size records:
+
+    header  <II      head, tail (sequence numbers of the next write / read)
+    record  <IhHHff  t, shunt_raw, bus_raw, bat_raw (0xFFFF = none),
+                     charge_mAh, energy_mWh (NaN = none)
+
+Record i is stored at slot i % config.journal['max_records']; when the ring
+is full the oldest records are overwritten. flush() publishes the backlog
+oldest first after the next successful publish, bounded per wake by
+'flush_records' and 'flush_ms', and persists the read offset after every
+message so the next wake resumes where this one stopped.
+'''
+
+import json
+import struct
+import config
+import rtcmem
+
+_KEY = 'journal'
+_HEADER = '<II'
+_RECORD = '<IhHHff'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_SIZE = struct.calcsize(_RECORD)
+_NO_BAT = 0xFFFF
+
+_armed = False
+_result = None
+
+
+def hold(result=None):
+    '''
+    Arm the journal: if the MCU sleeps before release(), the pending batch
+    and `result` (a `CurrentReader.read()` result, if complete) are journaled.
+    '''
+    global _armed, _result
+    _armed = config.journal['enabled']
+    _result = result
+
+
+def release():
+    '''Disarm the journal after the records of this wake were published.'''
+    global _armed, _result
+    _armed = False
+    _result = None
+
+
+def pending():
+    '''Records collected in RTC memory, not yet written to flash.'''
+    return rtcmem.get(_KEY, [])
+
+
+def store(sync=False):
+    '''
+    Journal the records of this wake if the journal is armed. Called by ds
+    right before going to sleep. With `sync` (or a full block) the collected
+    records are written to flash, e.g. before sleeping until reset.
+    '''
+    global _armed
+    if not _armed:
+        return
+    _armed = False
+    import batch
+    import record
+    recs = pending()
+    if batch.active():
+        recs.extend(batch.records())
+        batch.clear()
+    if _result and 'shunt_raw' in _result:
+        recs.append(record.make(_result))
+    if recs and (sync or len(recs) >= config.journal['block_records']):
+        try:
+            _append(recs)
+            recs = []
+        except OSError as exc:
+            # keep them in RTC memory and try again next time
+            print('journal write failed:', exc)
+            recs = recs[-config.journal['block_records']:]
+    rtcmem.put(_KEY, recs)
+
+
+def _pack(rec):
+    t, shunt, bus, bat, mah, mwh = rec
+    nan = float('nan')
+    return struct.pack(
+        _RECORD, t, shunt, bus,
+        _NO_BAT if bat is None else bat,
+        nan if mah is None else mah,
+        nan if mwh is None else mwh)
+
+
+def _unpack(buf, offset):
+    t, shunt, bus, bat, mah, mwh = struct.unpack_from(_RECORD, buf, offset)
+    # NaN != NaN
+    return [t, shunt, bus,
+            None if bat == _NO_BAT else bat,
+            None if mah != mah else mah,
+            None if mwh != mwh else mwh]
+
+
+def _open():
+    '''Journal file and its (head, tail); created if missing or broken.'''
+    cap = config.journal['max_records']
+    try:
+        f = open(config.journal['path'], 'r+b')
+        head, tail = struct.unpack(_HEADER, f.read(_HEADER_SIZE))
+        if tail <= head <= tail + cap:
+            return f, head, tail
+        f.close()
+    except (OSError, ValueError):
+        pass
+    f = open(config.journal['path'], 'w+b')
+    _write_header(f, 0, 0)
+    return f, 0, 0
+
+
+def _write_header(f, head, tail):
+    f.seek(0)
+    f.write(struct.pack(_HEADER, head, tail))
+
+
+def _segments(seq, n):
+    '''(slot, count) of the contiguous file regions of n records from seq.'''
+    cap = config.journal['max_records']
+    while n:
+        slot = seq % cap
+        k = min(n, cap - slot)
+        yield slot, k
+        seq += k
+        n -= k
+
+
+def _append(recs):
+    cap = config.journal['max_records']
+    recs = recs[-cap:]
+    buf = bytearray()
+    for rec in recs:
+        buf.extend(_pack(rec))
+    mv = memoryview(buf)
+    f, head, tail = _open()
+    try:
+        i = 0
+        for slot, k in _segments(head, len(recs)):
+            f.seek(_HEADER_SIZE + slot * _SIZE)
+            f.write(mv[i * _SIZE:(i + k) * _SIZE])
+            i += k
+        head += len(recs)
+        # drop what was overwritten
+        _write_header(f, head, max(tail, head - cap))
+    finally:
+        f.close()
+
+
+def _read(f, tail, n):
+    buf = bytearray(n * _SIZE)
+    mv = memoryview(buf)
+    i = 0
+    for slot, k in _segments(tail, n):
+        f.seek(_HEADER_SIZE + slot * _SIZE)
+        f.readinto(mv[i * _SIZE:(i + k) * _SIZE])
+        i += k
+    return [_unpack(buf, i * _SIZE) for i in range(n)]
+
+
+def _publish(client, recs, scale):
+    import record
+    if config.mqtt['format'] == 'bin':
+        client.publish(config.mqtt['topics']['current_bin'], record.encode(recs, scale), qos=1)
+    else:
+        client.publish(config.mqtt['topics']['current'], json.dumps(record.expand(recs, scale)), qos=1)
+
+
+def flush(client, scale):
+    '''
+    Publish the backlog (flash first, then RTC memory) as batch payloads of
+    up to config.journal['chunk_records'] records. Stops after
+    'flush_records' records or 'flush_ms' ms, which also bounds the PUBACK
+    waits of the client. Returns the number of records sent.
+    '''
+    if not config.journal['enabled']:
+        return 0
+    from deadline import Deadline
+    cfg = config.journal
+    client.deadline = deadline = Deadline(cfg['flush_ms'])
+    budget = cfg['flush_records']
+    sent = 0
+
+    def _more():
+        return sent < budget and not deadline.expired()
+
+    try:
+        f, head, tail = _open()
+    except OSError as exc:
+        print('journal open failed:', exc)
+        f = None
+    if f is not None:
+        try:
+            while head > tail and _more():
+                n = min(head - tail, cfg['chunk_records'], budget - sent)
+                _publish(client, _read(f, tail, n), scale)
+                tail += n
+                sent += n
+                # persist the read offset after every delivered message
+                _write_header(f, head, tail)
+        finally:
+            f.close()
+
+    recs = pending()
+    while recs and _more():
+        n = min(len(recs), cfg['chunk_records'], budget - sent)
+        _publish(client, recs[:n], scale)
+        del recs[:n]
+        sent += n
+    rtcmem.put(_KEY, recs)
+    if sent:
+        print('journal: sent %d record(s)' % sent)
+    return sent
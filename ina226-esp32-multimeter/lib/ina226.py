@@ -36,6 +36,7 @@ Micropython driver for the INA226 current sensor.
 
 
 from micropython import const
+from time import sleep_ms, ticks_ms, ticks_diff
 
 __version__ = "1.1.0"
 __repo__ = "https://github.com/ankcn/TI_INA226_micropython.git"
@@ -61,6 +62,12 @@ _REG_CURRENT = const(0x04)
 # Calibration register (R/W)
 _REG_CALIBRATION = const(0x05)
 
+# Mask/Enable register (R/W)
+_REG_MASK_ENABLE = const(0x06)
+
+# Alert Limit register (R/W)
+_REG_ALERT_LIMIT = const(0x07)
+
 
 # Configuration register values
 
@@ -114,6 +121,26 @@ CONFIG_MODE_SVOLT_CONTINUOUS = const(0x0005)
 CONFIG_MODE_BVOLT_CONTINUOUS = const(0x0006)
 CONFIG_MODE_SANDBVOLT_CONTINUOUS = const(0x0007)
 
+# Mask/Enable register bits
+# Alert functions, only one can be active (the highest set bit wins)
+MASK_SOL = const(0x8000)  # Shunt Voltage Over-Voltage
+MASK_SUL = const(0x4000)  # Shunt Voltage Under-Voltage
+MASK_BOL = const(0x2000)  # Bus Voltage Over-Voltage
+MASK_BUL = const(0x1000)  # Bus Voltage Under-Voltage
+MASK_POL = const(0x0800)  # Power Over-Limit
+MASK_CNVR = const(0x0400)  # Conversion Ready on ALERT
+MASK_AFF = const(0x0010)  # Alert Function Flag
+# Conversion Ready Flag, cleared by reading Mask/Enable or writing Config
+MASK_CVRF = const(0x0008)
+MASK_OVF = const(0x0004)  # Math Overflow Flag
+MASK_APOL = const(0x0002)  # ALERT active high (default active low, open drain)
+MASK_LEN = const(0x0001)  # Latch ALERT until Mask/Enable is read
+
+# Conversion times in us, indexed by the VBUSCT/VSHUNTCT bit value
+_CT_US = (140, 204, 332, 588, 1100, 2116, 4156, 8244)
+# Number of averages, indexed by the AVGMODE bit value
+_AVG = (1, 4, 16, 64, 128, 256, 512, 1024)
+
 # Default configuration register value
 _DEF_CONFIG = const(CONFIG_CONST_BITS |
     CONFIG_AVGMODE_512SAMPLES |
@@ -122,6 +149,50 @@ _DEF_CONFIG = const(CONFIG_CONST_BITS |
     CONFIG_MODE_SANDBVOLT_CONTINUOUS)
 
 
+def conversion_time_us(config):
+    """Time in us for one (averaged) conversion with the given config value"""
+    avg = _AVG[(config & CONFIG_AVGMODE_MASK) >> 9]
+    mode = config & CONFIG_MODE_MASK
+    t = 0
+    if mode & CONFIG_MODE_SVOLT_TRIGGERED:
+        t += _CT_US[(config & CONFIG_VSHUNTCT_MASK) >> 3]
+    if mode & CONFIG_MODE_BVOLT_TRIGGERED:
+        t += _CT_US[(config & CONFIG_VBUSCT_MASK) >> 6]
+    return avg * t
+
+
+def make_config(avg=512, vbus_ct_us=588, vshunt_ct_us=588,
+                mode=CONFIG_MODE_SANDBVOLT_CONTINUOUS):
+    """
+    Build a config register value from the number of averages and the
+    conversion times in us. Raises ValueError for values the chip does not
+    support.
+    """
+    try:
+        return (CONFIG_CONST_BITS |
+            _AVG.index(avg) << 9 |
+            _CT_US.index(vbus_ct_us) << 6 |
+            _CT_US.index(vshunt_ct_us) << 3 |
+            (mode & CONFIG_MODE_MASK))
+    except ValueError:
+        raise ValueError("unsupported averaging or conversion time: {} {} {}".format(
+            avg, vbus_ct_us, vshunt_ct_us))
+
+
+def convert(shunt, bus, cal_value, current_lsb):
+    """
+    Convert raw SHUNT (signed) and BUS register codes into shunt voltage
+    (mV), bus voltage (V), current and power. CURRENT and POWER are computed
+    like the chip does it (datasheet eq. 3 and 4).
+    """
+    raw_current = shunt * cal_value // 2048
+    raw_power = abs(raw_current) * bus // 20000
+    return (shunt * 0.0025,
+            bus * 1.25 / 1000,
+            raw_current * current_lsb,
+            raw_power * 25 * current_lsb)
+
+
 def _to_signed(num):
     if num > 0x7FFF:
         num -= 0x10000
@@ -130,18 +201,33 @@ def _to_signed(num):
 
 class INA226:
     """Driver for the INA226 current sensor"""
-    def __init__(self, i2c_device, addr=0x40):
+    def __init__(self, i2c_device, addr=0x40, cal_check_interval=16, init=True):
         self.i2c_device = i2c_device
 
         self.i2c_addr = addr
         self.buf = bytearray(2)
+        # Shunt and bus register contents for read_all(), filled in place
+        self._rbuf = bytearray(4)
+        self._rbuf_shunt = memoryview(self._rbuf)[0:2]
+        self._rbuf_bus = memoryview(self._rbuf)[2:4]
+        # The calibration register is only verified every n-th read of
+        # CURRENT/POWER instead of being rewritten on every read
+        self.cal_check_interval = cal_check_interval
+        self._reads = 0
         # Multiplier in mA used to determine current from raw reading
         self._current_lsb = 0
         # Multiplier in W used to determine power from raw reading
         self._power_lsb = 0
+        # Last value written to the config register
+        self._config = _DEF_CONFIG
+        # ticks_ms() of the last trigger(), wait_conversion() counts from there
+        self._triggered_at = None
+        self._cal_value = 0
 
-        # Set chip to known config values to start
-        self.calibrate()
+        # Set chip to known config values to start. With init=False the chip
+        # is not touched, call calibrate() or restore() before use.
+        if init:
+            self.calibrate()
 
     def _write_register(self, reg, value):
         self.buf[0] = (value >> 8) & 0xFF
@@ -167,26 +253,160 @@ class INA226:
         # Return Volts instead of milliVolts
         return self._read_register(_REG_BUSVOLTAGE) * 1.25 / 1000
 
-    @property
-    def current(self):
-        """The current through the shunt resistor in milliamps."""
-        # Sometimes a sharp load will reset the INA219, which will
+    def _check_calibration(self):
+        # Sometimes a sharp load will reset the INA226, which will
         # reset the cal register, meaning CURRENT and POWER will
-        # not be available ... athis by always setting a cal
-        # value even if it's an unfortunate extra step
-        self._write_register(_REG_CALIBRATION, self._cal_value)
+        # not be available. Check the cal register every n-th read
+        # and restore calibration and config only after a reset.
+        self._reads += 1
+        if self._reads < self.cal_check_interval:
+            return
+        self._reads = 0
+        if self._read_register(_REG_CALIBRATION) != self._cal_value:
+            self._write_register(_REG_CALIBRATION, self._cal_value)
+            self._write_register(_REG_CONFIG, self._config)
+
+    def read_raw(self):
+        """
+        Raw register codes (signed shunt, bus) of the last conversion.
+        Two bus transactions into a preallocated buffer.
+        """
+        self.i2c_device.readfrom_mem_into(self.i2c_addr, _REG_SHUNTVOLTAGE, self._rbuf_shunt)
+        self.i2c_device.readfrom_mem_into(self.i2c_addr, _REG_BUSVOLTAGE, self._rbuf_bus)
+        b = self._rbuf
+        return _to_signed((b[0] << 8) | b[1]), (b[2] << 8) | b[3]
+
+    def read_all(self):
+        """
+        Shunt voltage (mV), bus voltage (V), current and power of the last
+        conversion. The register pointer of the INA226 does not
+        auto-increment, so only SHUNT and BUS are read and CURRENT/POWER are
+        derived the same way the chip does it, see convert(). This needs two
+        bus transactions and does not depend on the calibration register
+        surviving a reset.
+        """
+        shunt, bus = self.read_raw()
+        return convert(shunt, bus, self._cal_value, self._current_lsb)
 
-        # Now we can safely read the CURRENT register!
+    @property
+    def scale(self):
+        """(calibration value, current LSB) needed to convert raw codes later"""
+        return self._cal_value, self._current_lsb
+
+    @property
+    def current(self):
+        """The current through the shunt resistor in amps."""
+        self._check_calibration()
         raw_current = _to_signed(self._read_register(_REG_CURRENT))
         return raw_current * self._current_lsb
 
     @property
     def power(self):
+        self._check_calibration()
         # INA226 stores the calculated power in this register
         raw_power = _to_signed(self._read_register(_REG_POWER))
         # Calculated power is derived by multiplying raw power value with the power LSB
         return raw_power * self._power_lsb
 
+    @property
+    def triggered(self):
+        """True if the chip is configured for triggered (single-shot) conversions"""
+        mode = self._config & CONFIG_MODE_MASK
+        return mode != CONFIG_MODE_POWERDOWN and not mode & CONFIG_MODE_ADCOFF
+
+    @property
+    def conversion_ready(self):
+        """Conversion Ready flag. Reading it clears the flag."""
+        return bool(self._read_register(_REG_MASK_ENABLE) & MASK_CVRF)
+
+    @property
+    def mask_enable(self):
+        """Mask/Enable register. Reading it clears CVRF and a latched alert."""
+        return self._read_register(_REG_MASK_ENABLE)
+
+    @mask_enable.setter
+    def mask_enable(self, value):
+        self._write_register(_REG_MASK_ENABLE, value)
+
+    @property
+    def alert_limit(self):
+        """Alert Limit register in units of the register the alert function compares"""
+        return self._read_register(_REG_ALERT_LIMIT)
+
+    @alert_limit.setter
+    def alert_limit(self, value):
+        self._write_register(_REG_ALERT_LIMIT, value & 0xFFFF)
+
+    def set_alert(self, function, limit, latch=True, active_high=False):
+        """
+        Drive the ALERT pin when the limit is crossed. The comparison happens
+        after every conversion, so the chip has to be converting (continuous
+        mode) for the alert to fire on its own.
+        Args:
+            function (int): one of MASK_SOL, MASK_SUL, MASK_BOL, MASK_BUL, MASK_POL
+            limit (int): raw limit in units of the compared register
+            latch (bool): keep ALERT asserted until Mask/Enable is read
+            active_high (bool): ALERT polarity, default active low
+        """
+        self.alert_limit = limit
+        self.mask_enable = function | (MASK_LEN if latch else 0) | (MASK_APOL if active_high else 0)
+
+    def alert_over_current(self, amps, **kwargs):
+        """Alert when the current exceeds `amps` (shunt voltage limit from the calibration)"""
+        # current register = shunt * CAL / 2048
+        self.set_alert(MASK_SOL, round(amps / self._current_lsb * 2048 / self._cal_value), **kwargs)
+
+    def alert_under_voltage(self, volts, **kwargs):
+        """Alert when the bus voltage drops below `volts`"""
+        self.set_alert(MASK_BUL, round(volts / 0.00125), **kwargs)
+
+    def alert_over_power(self, watts, **kwargs):
+        """Alert when the power exceeds `watts`"""
+        self.set_alert(MASK_POL, round(watts / self._power_lsb), **kwargs)
+
+    def disable_alert(self):
+        self.mask_enable = 0
+
+    @property
+    def alert(self):
+        """Alert Function Flag. Reading it clears a latched alert (and CVRF)."""
+        return bool(self.mask_enable & MASK_AFF)
+
+    def configure(self, config):
+        """Write a new config register value, keeping the calibration"""
+        self._config = config
+        self._write_register(_REG_CONFIG, config)
+
+    def trigger(self):
+        """Start a single conversion. Only useful in one of the triggered modes."""
+        self._write_register(_REG_CONFIG, self._config)
+        self._triggered_at = ticks_ms()
+
+    def wait_conversion(self, timeout_ms=None, work=None):
+        """
+        Block until the current conversion has finished. Runs `work` (a
+        callable) or sleeps until the expected conversion time since trigger()
+        has passed and then polls the Conversion Ready flag. Returns False if
+        the flag was not set within `timeout_ms` (default: twice the expected
+        conversion time plus 10 ms).
+        """
+        expected_ms = conversion_time_us(self._config) // 1000
+        if timeout_ms is None:
+            timeout_ms = 2 * expected_ms + 10
+        start = self._triggered_at
+        if start is None:
+            start = ticks_ms()
+        if work is not None:
+            work()
+        remaining = expected_ms - ticks_diff(ticks_ms(), start)
+        if remaining > 0:
+            sleep_ms(remaining)
+        while not self.conversion_ready:
+            if ticks_diff(ticks_ms(), start) > timeout_ms:
+                return False
+            sleep_ms(1)
+        return True
+
     def calibrate(self, config=_DEF_CONFIG, max_current=None, v_shunt=75.0, r_shunt=100.0):
         """
         Set up the INA226 by writing calibration and configuration values
@@ -200,10 +420,38 @@ class INA226:
             v_shunt (float): Nominal shunt drop voltage at maximum current (mV)
             r_shunt (float): Nominal shunt resistance (mOhm)
         """
+        self._set_scale(max_current, v_shunt, r_shunt)
+        self._config = config
+        self._reads = 0
+        self._write_register(_REG_CALIBRATION, self._cal_value)
+        self._write_register(_REG_CONFIG, config)
+
+    def _set_scale(self, max_current, v_shunt, r_shunt):
         if max_current == None:
             max_current = v_shunt / r_shunt
         self._cal_value = int(5.12 * (1 << 15) / v_shunt)
         self._current_lsb = max_current / (1 << 15)
         self._power_lsb = 25 * self._current_lsb
-        self._write_register(_REG_CALIBRATION, self._cal_value)
-        self._write_register(_REG_CONFIG, config)
\ No newline at end of file
+
+    def restore(self, config=_DEF_CONFIG, max_current=None, v_shunt=75.0, r_shunt=100.0):
+        """
+        Like calibrate(), for a chip that stayed powered (e.g. in power-down
+        mode) and may still hold its registers. If the calibration register
+        has the expected value only the config register is written (which
+        also ends power-down), otherwise the chip is calibrated. Returns True
+        if the registers were retained.
+        """
+        self._set_scale(max_current, v_shunt, r_shunt)
+        if self._read_register(_REG_CALIBRATION) != self._cal_value:
+            self.calibrate(config, max_current, v_shunt, r_shunt)
+            return False
+        self._reads = 0
+        self.configure(config)
+        return True
+
+    def power_down(self):
+        """
+        Enter power-down mode (about 2 uA). Registers are kept; configure(),
+        trigger() or restore() wake the chip up again with the stored config.
+        """
+        self._write_register(_REG_CONFIG, (self._config & ~CONFIG_MODE_MASK) | CONFIG_MODE_POWERDOWN)
\ No newline at end of file
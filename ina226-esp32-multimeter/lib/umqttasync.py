@@ -0,0 +1,330 @@
+"""asyncio variant of lib/umqttsimple.py.
+
+Same publish/subscribe API, but every network operation is a coroutine, so
+sampling, battery reads and flushing the journal can run in the same event
+loop while the client waits for the broker. A reader task takes all incoming
+packets: PUBACK and SUBACK are matched to the waiting call by packet id, so
+several QoS 1 messages can be in flight (up to `max_inflight`), incoming
+PUBLISH messages are queued for wait_msg() / check_msg().
+
+Runs on MicroPython (uasyncio) and CPython (asyncio), see
+python-scripts/firmware-sim/mqtt-async-check.py.
+
+usage:
+> client = MQTTClient(client_id, server, keepalive=60, timeout=3)
+> await client.connect()
+> await client.publish(topic, msg, qos=1)              # returns after PUBACK
+> for chunk in chunks:
+>     await client.publish(topic, chunk, qos=1, wait=False)
+> await client.acked()                                 # all PUBACKs in
+> op, topic, msg = client.check_msg()                  # (None, None, None) if none
+"""
+
+import errno
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+class MQTTException(Exception):
+    pass
+
+
+def _len(sz):
+    # remaining length, variable length encoding
+    out = bytearray()
+    while sz > 0x7F:
+        out.append((sz & 0x7F) | 0x80)
+        sz >>= 7
+    out.append(sz)
+    return out
+
+
+def _str(s):
+    if isinstance(s, str):
+        s = s.encode()
+    return bytes((len(s) >> 8, len(s) & 0xFF)) + s
+
+
+def _bytes(s):
+    return s.encode() if isinstance(s, str) else bytes(s)
+
+
+class MQTTClient:
+    def __init__(
+        self,
+        client_id,
+        server,
+        port=0,
+        user=None,
+        password=None,
+        keepalive=0,
+        ssl=None,
+        max_inflight=4,
+        timeout=None,
+    ):
+        """`timeout` in seconds bounds every wait for the broker (CONNACK,
+        PUBACK, SUBACK, a free in-flight slot), None waits forever. A timeout
+        raises OSError(ETIMEDOUT)."""
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._wlock = asyncio.Lock()
+        # packet id -> [Event, SUBACK return code] of the calls waiting for an ack
+        self._pending = {}
+        # set whenever an ack frees a slot or the connection fails
+        self._acked = asyncio.Event()
+        # incoming PUBLISH messages as (op, topic, msg)
+        self._inbox = []
+        self._received = asyncio.Event()
+        # exception that ended the reader task
+        self.error = None
+
+    def set_callback(self, f):
+        """Call f(topic, msg) for incoming messages instead of queueing them."""
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    async def _wait(self, event):
+        if self.timeout is None:
+            await event.wait()
+            return
+        try:
+            await asyncio.wait_for(event.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError(errno.ETIMEDOUT)
+
+    def _check(self):
+        if self.error is not None:
+            raise OSError(errno.ECONNRESET)
+
+    async def _send(self, *parts):
+        self._check()
+        # one packet at a time, tasks may publish concurrently
+        async with self._wlock:
+            for p in parts:
+                self._writer.write(p)
+            await self._writer.drain()
+
+    async def connect(self, clean_session=True):
+        """Connect, wait for CONNACK and start the reader task. Returns the
+        session present flag."""
+        async def _open():
+            return await asyncio.open_connection(self.server, self.port, ssl=self.ssl)
+
+        if self.timeout is None:
+            self._reader, self._writer = await _open()
+        else:
+            try:
+                self._reader, self._writer = await asyncio.wait_for(_open(), self.timeout)
+            except asyncio.TimeoutError:
+                raise OSError(errno.ETIMEDOUT)
+        self.error = None
+
+        flags = clean_session << 1
+        payload = _str(self.client_id)
+        if self.keepalive:
+            assert self.keepalive < 65536
+        if self.lw_topic:
+            payload += _str(self.lw_topic) + _str(self.lw_msg)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+        if self.user:
+            payload += _str(self.user) + _str(self.pswd)
+            flags |= 0xC0
+        head = b"\x00\x04MQTT\x04" + bytes((flags, self.keepalive >> 8, self.keepalive & 0xFF))
+        await self._send(b"\x10", _len(len(head) + len(payload)), head, payload)
+
+        try:
+            if self.timeout is None:
+                resp = await self._reader.readexactly(4)
+            else:
+                resp = await asyncio.wait_for(self._reader.readexactly(4), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError(errno.ETIMEDOUT)
+        assert resp[0] == 0x20 and resp[1] == 0x02
+        if resp[3] != 0:
+            raise MQTTException(resp[3])
+        self._task = asyncio.create_task(self._run())
+        return resp[2] & 1
+
+    async def disconnect(self):
+        try:
+            await self._send(b"\xe0\0")
+        finally:
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+            self._writer.close()
+            await self._writer.wait_closed()
+
+    async def ping(self):
+        await self._send(b"\xc0\0")
+
+    def _next_pid(self):
+        while True:
+            self.pid = self.pid % 0xFFFF + 1
+            if self.pid not in self._pending:
+                return self.pid
+
+    async def publish(self, topic, msg, retain=False, qos=0, wait=True):
+        """
+        Publish `msg`. With qos=1 this returns after the PUBACK or, with
+        wait=False, as soon as the message is sent and a slot of the
+        `max_inflight` window is free; acked() waits for the rest. Returns
+        the packet id (None for QoS 0).
+        """
+        assert qos in (0, 1)
+        topic = _str(topic)
+        msg = _bytes(msg)
+        if not qos:
+            await self._send(bytes((0x30 | retain,)), _len(len(topic) + len(msg)), topic, msg)
+            return None
+        while len(self._pending) >= self.max_inflight:
+            self._acked.clear()
+            await self._wait(self._acked)
+            self._check()
+        pid = self._next_pid()
+        ack = self._pending[pid] = [asyncio.Event(), None]
+        try:
+            await self._send(bytes((0x32 | retain,)), _len(len(topic) + 2 + len(msg)), topic,
+                             bytes((pid >> 8, pid & 0xFF)), msg)
+        except Exception:
+            self._pending.pop(pid, None)
+            raise
+        if wait:
+            await self._ack(pid, ack)
+        return pid
+
+    async def _ack(self, pid, ack):
+        try:
+            await self._wait(ack[0])
+        finally:
+            self._pending.pop(pid, None)
+        self._check()
+        return ack[1]
+
+    async def acked(self):
+        """Wait until every QoS 1 message in flight is acknowledged."""
+        while self._pending:
+            self._acked.clear()
+            await self._wait(self._acked)
+            self._check()
+
+    def inflight(self):
+        """Number of messages and subscriptions waiting for their ack."""
+        return len(self._pending)
+
+    async def subscribe(self, topic, qos=0):
+        pid = self._next_pid()
+        ack = self._pending[pid] = [asyncio.Event(), None]
+        topic = _str(topic)
+        try:
+            await self._send(b"\x82", _len(2 + len(topic) + 1), bytes((pid >> 8, pid & 0xFF)),
+                             topic, bytes((qos,)))
+        except Exception:
+            self._pending.pop(pid, None)
+            raise
+        if await self._ack(pid, ack) == 0x80:
+            raise MQTTException(0x80)
+
+    async def wait_msg(self):
+        """Next incoming message as (op, topic, msg)."""
+        while not self._inbox:
+            self._check()
+            self._received.clear()
+            await self._wait(self._received)
+        return self._inbox.pop(0)
+
+    def check_msg(self):
+        """Next incoming message or (None, None, None), never waits."""
+        if self._inbox:
+            return self._inbox.pop(0)
+        self._check()
+        return None, None, None
+
+    async def _recv_len(self):
+        n = 0
+        sh = 0
+        while 1:
+            b = (await self._reader.readexactly(1))[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+
+    async def _run(self):
+        # reader task: dispatch every packet of the broker
+        try:
+            while True:
+                op = (await self._reader.readexactly(1))[0]
+                sz = await self._recv_len()
+                body = await self._reader.readexactly(sz) if sz else b""
+                kind = op & 0xF0
+                if kind in (0x40, 0x90):  # PUBACK, SUBACK
+                    ack = self._pending.pop(body[0] << 8 | body[1], None)
+                    if ack is not None:
+                        if kind == 0x90:
+                            ack[1] = body[2]
+                        ack[0].set()
+                    self._acked.set()
+                elif kind == 0x30:
+                    pid = self._deliver(op, body)
+                    if pid is not None:
+                        await self._send(b"\x40\x02", pid)
+                # PINGRESP and anything else: nothing to do
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.error = exc
+            # wake every waiter, they raise OSError(ECONNRESET)
+            for ack in self._pending.values():
+                ack[0].set()
+            self._acked.set()
+            self._received.set()
+
+    def _deliver(self, op, body):
+        # queue or hand over an incoming PUBLISH; returns the packet id to
+        # acknowledge (QoS 1) or None
+        tl = body[0] << 8 | body[1]
+        topic = body[2:2 + tl].decode('utf-8')
+        i = 2 + tl
+        pid = None
+        if op & 6:
+            pid = body[i:i + 2]
+            i += 2
+            if op & 6 == 4:
+                assert 0
+        msg = body[i:].decode('utf-8')
+        if self.cb is not None:
+            self.cb(topic, msg)
+        else:
+            self._inbox.append((op, topic, msg))
+            self._received.set()
+        return pid
@@ -6,17 +6,32 @@ Modifikation:
 - Synchrone Struktur zum abholen eingehender Nachrichten. wait_msg ruft nicht
   callback auf. Stattdessen wird bei eingehender Nachricht die Nachricht zurück
   gegeben.
+- Pakete (CONNECT, PUBLISH, SUBSCRIBE, PUBACK) werden in einem wiederverwendeten
+  Puffer zusammengesetzt und mit einem einzigen sock.write gesendet.
+- Nicht blockierender Socket mit select.poll. Ein gemeinsames Zeitbudget
+  (Deadline) begrenzt TCP connect, CONNACK, PUBACK und SUBACK; wird es
+  überschritten, wirft jede Operation OSError(ETIMEDOUT). Die Namensauflösung
+  (getaddrinfo) blockiert und ist nicht begrenzt, sie wird nur gestartet,
+  solange das Budget nicht aufgebraucht ist. IP-Adressen brauchen kein DNS.
 '''
 
+import errno
+import select
 import socket
-import struct
 from binascii import hexlify
+from deadline import Deadline
 
 
 class MQTTException(Exception):
     pass
 
 
+def _is_ip(host):
+    # dotted quad IPv4 address, needs no name resolution
+    parts = host.split('.')
+    return len(parts) == 4 and all(p.isdigit() and int(p) < 256 for p in parts)
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -27,6 +42,7 @@ class MQTTClient:
         password=None,
         keepalive=0,
         ssl=None,
+        buf_size=256,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -44,16 +60,74 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # outgoing packets are assembled here and sent with one write
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._ack = bytearray(b"\x40\x02\0\0")
+        # time budget of the session, set by connect()
+        self.deadline = Deadline()
+
+    def _reserve(self, n):
+        # grow the packet buffer once if a packet does not fit
+        if len(self._buf) < n:
+            self._buf = bytearray(n)
+            self._mv = memoryview(self._buf)
+
+    def _put(self, i, data):
+        # MicroPython accepts str as a buffer; CPython (simulation) needs bytes
+        try:
+            self._mv[i:i + len(data)] = data
+        except TypeError:
+            data = data.encode()
+            self._mv[i:i + len(data)] = data
+        return i + len(data)
+
+    def _put_str(self, i, s):
+        n = len(s)
+        self._buf[i] = n >> 8
+        self._buf[i + 1] = n & 0xFF
+        return self._put(i + 2, s)
+
+    def _put_len(self, i, sz):
+        # remaining length, variable length encoding
+        while sz > 0x7F:
+            self._buf[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        self._buf[i] = sz
+        return i + 1
+
+    def _read(self, n):
+        # read exactly n bytes from the non-blocking socket within the deadline
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.read(n - len(data))
+            if chunk is None:
+                self.deadline.wait(self.sock, select.POLLIN)
+                continue
+            if chunk == b"":
+                raise OSError(-1)
+            data += chunk
+        return data
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    def _write(self, buf, n=None):
+        # write n bytes (default all) to the non-blocking socket within the deadline
+        if n is None:
+            n = len(buf)
+        mv = memoryview(buf)
+        i = 0
+        while i < n:
+            w = self.sock.write(mv[i:n])
+            if not w:
+                self.deadline.wait(self.sock, select.POLLOUT)
+                continue
+            i += w
 
     def _recv_len(self):
         n = 0
         sh = 0
         while 1:
-            b = self.sock.read(1)[0]
+            b = self._read(1)[0]
             n |= (b & 0x7F) << sh
             if not b & 0x80:
                 return n
@@ -70,121 +144,123 @@ class MQTTClient:
         self.lw_qos = qos
         self.lw_retain = retain
 
-    def connect(self, clean_session=True, timeout=None):
-        self.sock = socket.socket()
-        #self.sock.settimeout(timeout)
-        addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+    def connect(self, clean_session=True, timeout=None, deadline=None):
+        '''
+        Connect and wait for CONNACK. `deadline` (deadline.Deadline) is the
+        time budget for this and all later operations of the session; without
+        it, `timeout` in seconds starts a new one. Raises OSError(ETIMEDOUT)
+        when the budget is used up. Resolving a host name blocks and is not
+        bounded by the budget; use an IP address as server to avoid it.
+        '''
+        if deadline is None:
+            deadline = Deadline(None if timeout is None else int(timeout * 1000))
+        self.deadline = deadline
+        self.deadline.check()
+        if _is_ip(self.server):
+            addr = (self.server, self.port)
+        else:
+            addr = socket.getaddrinfo(self.server, self.port)[0][-1]
 
+        # retry refused connections with backoff while the budget lasts
         tries = 3
-        while tries > 0:
+        backoff = 100
+        while True:
+            self.deadline.check()
+            self.sock = socket.socket()
+            self.sock.setblocking(False)
             try:
-                self.sock.connect(addr)
+                try:
+                    self.sock.connect(addr)
+                except OSError as exc:
+                    if exc.args[0] not in (errno.EINPROGRESS, errno.EAGAIN):
+                        raise
+                self.deadline.wait(self.sock, select.POLLOUT)
                 break
-            except:
-                print('failed to connect to mqtt')
+            except OSError as exc:
+                self.sock.close()
                 tries -= 1
-        else:
-            raise OSError(-1)
-        
-        
+                if exc.args[0] == errno.ETIMEDOUT or not tries:
+                    raise
+                print('failed to connect to mqtt:', exc)
+                self.deadline.sleep(backoff)
+                backoff *= 2
+
         if self.ssl:
             self.sock = self.ssl.wrap_socket(
                 self.sock,
                 server_hostname=self.server
             )
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
         sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
+        flags = clean_session << 1
         if self.user:
             sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
+            flags |= 0xC0
         if self.keepalive:
             assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
         if self.lw_topic:
             sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
 
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
+        self._reserve(sz + 5)
+        buf = self._buf
+        buf[0] = 0x10
+        i = self._put_len(1, sz)
+        i = self._put(i, b"\x00\x04MQTT\x04")
+        buf[i] = flags
+        buf[i + 1] = self.keepalive >> 8
+        buf[i + 2] = self.keepalive & 0x00FF
+        i = self._put_str(i + 3, self.client_id)
         if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
+            i = self._put_str(i, self.lw_topic)
+            i = self._put_str(i, self.lw_msg)
         if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        
-        
-
-        from time import sleep
-        i = 0
-        resp = 0
-        while i < 3:
-            try:
-                resp = self.sock.read(4)
-                break
-            except OSError as err:
-                i+=1
-                print('except sock read')
-                sleep(0.1)
-        else:
-            raise OSError(-1)
-
+            i = self._put_str(i, self.user)
+            i = self._put_str(i, self.pswd)
+        # print(hex(i), hexlify(self._mv[:i], ":"))
+        self._write(buf, i)
 
+        resp = self._read(4)
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
             raise MQTTException(resp[3])
         return resp[2] & 1
 
     def disconnect(self):
-        self.sock.write(b"\xe0\0")
-        self.sock.close()
+        try:
+            self._write(b"\xe0\0")
+        finally:
+            self.sock.close()
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self._write(b"\xc0\0")
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
         sz = 2 + len(topic) + len(msg)
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        self._reserve(sz + 4)
+        buf = self._buf
+        buf[0] = 0x30 | qos << 1 | retain
+        i = self._put_len(1, sz)
+        i = self._put_str(i, topic)
         if qos > 0:
             self.pid += 1
             pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
+            buf[i] = pid >> 8
+            buf[i + 1] = pid & 0xFF
+            i += 2
+        i = self._put(i, msg)
+        # print(hex(i), hexlify(self._mv[:i], ":"))
+        self._write(buf, i)
         if qos == 1:
             while 1:
                 op, topic_aux, msg_aux = self.wait_msg()
                 if op == 0x40:
-                    sz = self.sock.read(1)
+                    sz = self._read(1)
                     assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
+                    rcv_pid = self._read(2)
                     rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
                     if pid == rcv_pid:
                         return
@@ -193,19 +269,24 @@ class MQTTClient:
 
     def subscribe(self, topic, qos=0):
         # assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
         self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        sz = 2 + 2 + len(topic) + 1
+        self._reserve(sz + 2)
+        buf = self._buf
+        buf[0] = 0x82
+        i = self._put_len(1, sz)
+        pid_hi = buf[i] = self.pid >> 8
+        pid_lo = buf[i + 1] = self.pid & 0xFF
+        i = self._put_str(i + 2, topic)
+        buf[i] = qos
+        # print(hex(i + 1), hexlify(self._mv[:i + 1], ":"))
+        self._write(buf, i + 1)
         while 1:
             op, topic_aux, msg_aux = self.wait_msg()
             if op == 0x90:
-                resp = self.sock.read(4)
+                resp = self._read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] == pid_hi and resp[2] == pid_lo
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
@@ -214,57 +295,41 @@ class MQTTClient:
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
-    def wait_msg(self):
-        
-        from time import sleep
-        
-
-        i = 0
-        res = 0
-        while i < 3:
-            try:
-                res = self.sock.read(1)
-                break
-            except OSError as err:
-                i+=1
-                print('except sock read')
-                sleep(0.1)
-
-        else:
-            raise OSError(-42)
-
-
-
-        self.sock.setblocking(True)
-        if res is None:
-            return None, None, None
+    # Blocks at most until the deadline of the session (OSError(ETIMEDOUT)).
+    def wait_msg(self, block=True):
+        res = self.sock.read(1)
+        while res is None:
+            if not block:
+                return None, None, None
+            self.deadline.wait(self.sock, select.POLLIN)
+            res = self.sock.read(1)
         if res == b"":
             raise OSError(-1337)
         if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
+            sz = self._read(1)[0]
             assert sz == 0
             return None, None, None
         op = res[0]
         if op & 0xF0 != 0x30:
             return op, None, None
         sz = self._recv_len()
-        topic_len = self.sock.read(2)
+        topic_len = self._read(2)
         topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
+        topic = self._read(topic_len)
         sz -= topic_len + 2
         if op & 6:
-            pid = self.sock.read(2)
+            pid = self._read(2)
             pid = pid[0] << 8 | pid[1]
             sz -= 2
-        msg = self.sock.read(sz)
-        
+        msg = self._read(sz)
+
         # Disabled callback. Instead, return topic and msg
         # self.cb(topic, msg)
 
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
+            self._ack[2] = pid >> 8
+            self._ack[3] = pid & 0xFF
+            self._write(self._ack)
         elif op & 6 == 4:
             assert 0
 
@@ -275,5 +340,4 @@ class MQTTClient:
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
     def check_msg(self):
-        self.sock.setblocking(False)
-        return self.wait_msg()
+        return self.wait_msg(block=False)
@@ -1,50 +1,174 @@
+import phases
 import config
-import time
-import json
-from current_reader import CurrentReader
-import ds as ds
-from time import sleep
-import internet
-from mqtt import get_client
+from current_reader import CurrentReader, MultiReader
+import batch
+import scheduler
+import budget
+# only needed on some paths, imported there: ds, internet, journal, mqtt,
+# bat, planner (precompile everything with python-scripts/mpy-build)
+
+phases.since_reset('import')
 
 def main():
 
+    if not config.stream['enabled']:
+        # streaming does not sleep, the watchdog would reset it
+        budget.start()
+
+    if config.remote['enabled']:
+        import remote
+        # settings received by an earlier wake
+        remote.load()
+
     print('Initializing CurrentReader...', end='')
     try:
-        reader = CurrentReader()
+        if config.ina226.get('channels'):
+            reader = MultiReader()
+        else:
+            reader = CurrentReader()
     except Exception as exc:
         print("Failed to initialize CurrentReader:", exc)
         return
     print(' done')
 
+    phases.start('ina')
     reader.pwr(True)
+    phases.end('ina')
 
-    print('init network', end='')
-    # establish network connection before proceeding; pass reader so
-    # internet can power down the reader on timeout
-    if not internet.connect(reader):
-        return
-    mqttClient = get_client(reader)
-    if not mqttClient:
+    if config.stream['enabled']:
+        import stream
+        stream.run(reader)
         return
 
-    try:
-        result = reader.read(samples=3)
-        reader.pwr(False)
-        
+    # in batching mode only every n-th wake brings up the radio
+    publish = not batch.enabled() or batch.due()
+    # records left after batching was switched off go out with this one
+    batched = batch.active()
+
+    if publish:
+        import internet
+        print('init network', end='')
+        # start associating now, sampling runs while the link comes up
+        phases.start('wlan')
+        wlan = budget.phase('wlan')
+        internet.begin()
+
+    result = {}
+
+    def battery():
+        phases.start('bat')
         from bat import bat_idle
-        result["bat"] = bat_idle()
+        result["bat"] = bat_idle(reader, deadline=budget.phase('bat'))
+        phases.end('bat')
+
+    # optionally read the battery while the INA226 converts
+    concurrent = config.battery['concurrent']
+
+    def sample():
+        phases.start('sample')
+        result.update(reader.read(samples=config.ina226.get('samples', 3), during=battery if concurrent else None,
+                                  deadline=budget.phase('sample')))
+        reader.pwr(False)
+        phases.end('sample')
 
-        mqttClient.publish(
-            config.mqtt['topics']['current'],
-            json.dumps(result),
-            qos=1
-        )
+    work = [sample] if concurrent else [sample, battery]
+
+    if publish:
+        import journal
+        if batched:
+            # batched (and with it journaled) if we go to sleep before append
+            batch.hold(result)
+            journal.hold()
+        else:
+            # journal the measurement if we go to sleep before it is published
+            journal.hold(result)
+
+    # MQTT session to keep if the planner chooses light sleep
+    kept = None
+    import planner
+
+    try:
+        # pass reader so internet can power down the reader on timeout
+        if publish and not internet.wait(reader, work=work, deadline=wlan):
+            return
+        phases.end('wlan')
+        # whatever did not run while waiting for the link
+        while work:
+            work.pop(0)()
+
+        interval = scheduler.next_interval(result)
+        mode = planner.plan(interval)
+
+        if batched:
+            batch.append(result)
+            if not publish:
+                print('batched %d/%d' % (len(batch.records()), config.batch['size']))
+                import ds
+                ds.ds_interval_seconds(interval)
+                return
+
+        phases.start('mqtt')
+        from mqtt import get_client
+        mqttClient = get_client(reader, budget.phase('mqtt'))
+        if not mqttClient:
+            return
+        phases.end('mqtt')
+
+        bat_scale = None
+        if config.battery['enabled']:
+            from bat import SCALE as bat_scale
+        scale = reader.scale + (bat_scale,)
+        overrun = None
+        if config.mqtt['format'] == 'bin':
+            topic = config.mqtt['topics']['current_bin']
+            import record
+            recs = batch.records() if batched else [record.make(result)]
+            data = record.encode(recs, scale, phases.report())
+        else:
+            import json
+            import alert
+            topic = config.mqtt['topics']['current']
+            if batched:
+                result = batch.payload(scale)
+            result["wlan"] = internet.stats
+            result["interval_s"] = interval
+            result["wake"] = alert.reason()
+            result["sleep"] = mode
+            result["t_ms"] = phases.report()
+            if config.remote['enabled']:
+                result["cfg"] = remote.version()
+            overrun = budget.report()
+            if overrun:
+                result["overrun"] = overrun
+            data = json.dumps(result)
+
+        phases.start('publish')
+        mqttClient.deadline = budget.phase('publish')
+        mqttClient.publish(topic, data, qos=1)
+        phases.end('publish')
+        journal.release()
+        if overrun:
+            budget.clear()
+        if batched:
+            batch.clear()
+
+        if config.remote['enabled']:
+            remote.fetch(mqttClient)
+
+        # backlog of earlier failed publishes
+        journal.flush(mqttClient, scale)
+        kept = mqttClient
 
     except Exception as exc:
         print("Error while running reader:", exc)
 
+    if planner.sleep(kept):
+        # next cycle, WLAN and the MQTT session are still up
+        return True
+
+    import ds
     ds.ds_interval_seconds()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    while main():
+        pass
\ No newline at end of file
@@ -1,23 +1,87 @@
 from lib.umqttsimple import MQTTClient
+from deadline import Deadline
 import binascii
 import config as config
 
 
-def get_client(reader=None):
-    """Create and connect an MQTT client. Returns the connected client or
-    None on failure (after calling ds interval fallback).
-    """
-    client = MQTTClient(
-        binascii.hexlify(config.id),
+# session kept over a light sleep, see planner
+_kept = None
+
+
+def keep(client):
+    '''Hand `client` to the next get_client() instead of connecting anew.'''
+    global _kept
+    _kept = client
+
+
+def ping(client):
+    '''Ping the broker and wait for the PINGRESP. Raises OSError if it does
+    not arrive within client.deadline or the session is gone.'''
+    client.ping()
+    # wait_msg() returns op None for the PINGRESP
+    while client.wait_msg()[0] is not None:
+        pass
+
+
+def make_client(keepalive=60):
+    """MQTT client for the configured broker, not yet connected."""
+    return MQTTClient(
+        binascii.hexlify(config.id()),
         config.mqtt['host'],
         port=config.mqtt['port'],
         user=config.mqtt['user'],
         password=config.mqtt['password'],
-        keepalive=60,
+        keepalive=keepalive,
     )
 
+
+def make_async_client(keepalive=60, max_inflight=4):
+    """asyncio MQTT client (lib/umqttasync.py) for the configured broker,
+    not yet connected. Every wait for the broker is bounded by
+    config.mqtt['budget_ms']."""
+    from lib.umqttasync import MQTTClient as AsyncMQTTClient
+    budget = config.mqtt.get('budget_ms')
+    return AsyncMQTTClient(
+        binascii.hexlify(config.id()),
+        config.mqtt['host'],
+        port=config.mqtt['port'],
+        user=config.mqtt['user'],
+        password=config.mqtt['password'],
+        keepalive=keepalive,
+        max_inflight=max_inflight,
+        timeout=None if budget is None else budget / 1000,
+    )
+
+
+def get_client(reader=None, deadline=None):
+    """Create and connect an MQTT client. Returns the connected client or
+    None on failure (after calling ds interval fallback).
+
+    Connect, CONNACK and the following PUBACKs share one time budget,
+    `deadline` or config.mqtt['budget_ms']; once it is used up the client
+    raises OSError(ETIMEDOUT). Resolving a broker host name is not bounded.
+    A session kept over a light sleep is pinged first and replaced by a new
+    one if it does not answer.
+    """
+    if deadline is None:
+        deadline = Deadline(config.mqtt.get('budget_ms'))
+    if _kept is not None:
+        client = _kept
+        keep(None)
+        client.deadline = deadline
+        try:
+            ping(client)
+            return client
+        except OSError as exc:
+            print('kept mqtt session lost:', exc)
+            try:
+                client.sock.close()
+            except Exception:
+                pass
+    client = make_client()
+
     try:
-        client.connect(timeout=4)
+        client.connect(deadline=deadline)
         return client
     except Exception:
         print('mqtt connect failed')
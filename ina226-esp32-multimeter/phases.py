@@ -0,0 +1,54 @@
+'''Wake-cycle phase timing.
+
+Durations in ms of the phases of this wake (import, first_i2c, ina, wlan,
+mqtt, sample, bat, ...) are published with the measurement as `t_ms`. import
+and first_i2c are ms since reset. Publishing and the total awake time are
+only known when the wake is over, so they are kept in RTC memory and
+reported with the next wake as prev_publish / prev_total.
+
+Phases may overlap: wlan runs while sample and bat are taken.
+'''
+
+from time import ticks_ms, ticks_diff
+import rtcmem
+
+durations = {}
+_started = {}
+# start of this cycle, see restart()
+_t0 = 0
+
+
+def since_reset(name):
+    '''Record the ms since reset, e.g. boot + imports.'''
+    durations[name] = ticks_ms()
+
+
+def start(name):
+    _started[name] = ticks_ms()
+
+
+def end(name):
+    if name in _started:
+        durations[name] = ticks_diff(ticks_ms(), _started.pop(name))
+
+
+def report():
+    '''Durations of this wake plus publish/total of the previous wake.'''
+    t = dict(durations)
+    prev = rtcmem.get('phases')
+    if prev:
+        t['prev_publish'], t['prev_total'] = prev
+    return t
+
+
+def restart():
+    '''Start a new cycle without a reset (after a light sleep).'''
+    global _t0
+    durations.clear()
+    _t0 = ticks_ms()
+
+
+def store():
+    '''Keep publish and total awake time for the next wake. Call right
+    before going to sleep.'''
+    rtcmem.put('phases', [durations.get('publish'), ticks_diff(ticks_ms(), _t0)])
@@ -0,0 +1,177 @@
+'''Deep sleep or light sleep with WLAN kept, whichever is cheaper.
+
+A deep sleep cycle pays boot, imports, WLAN association and the MQTT
+handshake on every wake. A light sleep keeps WLAN associated and the MQTT
+session open, so the next cycle only samples and publishes, but the board
+draws more while sleeping and the radio stays on for the whole cycle. With
+config.sleep['mode'] 'auto' plan() compares the charge of one cycle of each
+for the interval T:
+
+    deep   deep_ua  * T + cpu_ma * (boot_ms + t_deep) + radio_ma * r_deep
+    light  light_ua * T + (cpu_ma + radio_ma) * t_light
+
+t_deep is the awake time of the last deep sleep cycle with a fast WLAN
+reconnect (a full scan + DHCP is the exception) and r_deep the part of it
+with the radio on (from internet.begin()), t_light the awake time of the
+last cycle after a light sleep; they are kept in RTC memory as [t_deep,
+r_deep, t_light]. Until a light cycle has run t_light is estimated from the
+ina, sample, bat and publish phases (bat runs inside sample with
+battery['concurrent']). Without a t_deep this cycle up to plan() stands in
+for a deep cycle, less its WLAN connect after a full scan + DHCP. As that
+is too cheap the node only light sleeps if light is cheaper still, else it
+sleeps deep to measure a t_deep.
+
+usage:
+> mode = planner.plan(interval)  # 'deep' or 'light', published as "sleep"
+> if not planner.sleep(client):  # light sleeps and returns True if planned
+>     ds.ds_interval_seconds()
+'''
+
+from time import ticks_ms, ticks_diff, ticks_add
+import config
+import rtcmem
+
+# ticks_ms at the start of this cycle, 0 for a wake from reset
+_start = 0
+# this cycle follows a light sleep, WLAN and the MQTT session are kept
+_kept = False
+_mode = None
+
+
+def kept():
+    return _kept
+
+
+def awake_ms():
+    '''ms since the start of this cycle.'''
+    return ticks_diff(ticks_ms(), _start)
+
+
+def estimates(seconds):
+    '''Charge in uAs of one (deep, light) cycle of `seconds`. Before a deep
+    cycle was measured, deep is a lower bound from this cycle so far (less
+    the WLAN connect unless it was a fast one). None if WLAN is not up.'''
+    cfg = config.sleep
+    t_deep, r_deep, t_light = rtcmem.get('sleep') or (None, None, None)
+    if t_deep is None:
+        import sys
+        internet = sys.modules.get('internet')
+        if internet is None or 'ms' not in internet.stats:
+            return None
+        full = 0 if internet.stats['fast'] else internet.stats['ms']
+        t_deep = max(awake_ms() - full, 0)
+        r_deep = max(internet.radio_ms() - full, 0)
+    if t_light is None:
+        import phases
+        names = ['ina', 'sample', 'publish']
+        if not config.battery['concurrent']:
+            names.append('bat')
+        t_light = sum(phases.durations.get(k, 0) for k in names)
+    deep = (cfg['deep_ua'] * seconds + cfg['cpu_ma'] * (cfg['boot_ms'] + t_deep)
+            + cfg['radio_ma'] * r_deep)
+    light = cfg['light_ua'] * seconds + (cfg['cpu_ma'] + cfg['radio_ma']) * t_light
+    return deep, light
+
+
+def plan(seconds):
+    '''Choose the sleep after this cycle. Batching wakes the radio only
+    every n-th cycle and always sleeps deep.'''
+    global _mode
+    mode = config.sleep['mode']
+    if config.batch['enabled']:
+        mode = 'deep'
+    elif mode == 'auto':
+        est = estimates(seconds)
+        mode = 'deep'
+        if est is not None:
+            print('sleep estimates: deep %d uAs, light %d uAs' % est)
+            if est[1] < est[0]:
+                mode = 'light'
+    _mode = mode
+    return mode
+
+
+def store():
+    '''Keep the awake time of this cycle for estimates(). Call right
+    before going to sleep.'''
+    times = rtcmem.get('sleep') or [None, None, None]
+    if _kept:
+        times[2] = awake_ms()
+    else:
+        import sys
+        internet = sys.modules.get('internet')
+        if internet is not None and internet.stats.get('fast'):
+            times[0] = awake_ms()
+            times[1] = internet.radio_ms()
+    rtcmem.put('sleep', times)
+
+
+def sleep(client):
+    '''
+    Light sleep until the next cycle if plan() chose it and `client` is a
+    connected MQTT client. WLAN and the session are kept (pinged at half the
+    keepalive) and the watchdog is fed. Returns True after the light sleep,
+    False if the caller should go to deepsleep.
+    '''
+    global _start, _kept
+    if _mode != 'light' or client is None:
+        return False
+    import scheduler
+    import budget
+    import phases
+    import alert
+    import mqtt
+
+    ms = scheduler.interval() * 1000 - awake_ms()
+    budget.check()
+    store()
+    phases.store()
+    alert.wake_source()
+    print('> lightsleep %d ms' % ms)
+    try:
+        _light(max(ms, 1), client)
+    except OSError as exc:
+        # session lost, sleep the rest deep and start over
+        print('light sleep: session lost:', exc)
+        return False
+    _start = ticks_ms()
+    _kept = True
+    phases.restart()
+    mqtt.keep(client)
+    return True
+
+
+def _light(ms, client):
+    import machine
+    import network
+    import budget
+    import mqtt
+    from deadline import Deadline
+
+    nic = network.WLAN(network.STA_IF)
+    try:
+        # listen to the AP's DTIM beacons only
+        nic.config(pm=nic.PM_POWERSAVE)
+    except (AttributeError, ValueError):
+        pass
+
+    ping_ms = client.keepalive * 500
+    step = config.budget['wdt_ms'] // 2 or ms
+    if ping_ms:
+        step = min(step, ping_ms)
+    end = ticks_add(ticks_ms(), ms)
+    pinged = ticks_ms()
+    while True:
+        left = ticks_diff(end, ticks_ms())
+        if left <= 0:
+            break
+        machine.lightsleep(min(left, step))
+        budget.feed()
+        if machine.wake_reason() == machine.EXT0_WAKE:
+            # ALERT, measure now
+            break
+        if ping_ms and ticks_diff(ticks_ms(), pinged) >= ping_ms:
+            client.deadline = Deadline(config.mqtt.get('budget_ms'))
+            # raises OSError if the broker does not answer
+            mqtt.ping(client)
+            pinged = ticks_ms()
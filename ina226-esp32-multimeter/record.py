@@ -0,0 +1,157 @@
+'''Compact measurement records and their payload encodings.
+
+A record holds raw codes only:
+
+    [t, shunt_raw, bus_raw, bat_raw, charge_mAh, energy_mWh]
+
+t is seconds of the device RTC, shunt_raw/bus_raw are INA226 register
+codes, bat_raw the battery reading in bat.SCALE units (None if battery
+monitoring is off).
+`scale` is (INA226 calibration value, current LSB, bat.SCALE or None if
+battery monitoring is off).
+
+Binary format, version 1 (little endian), decoded by
+python-scripts/payload/ctbin.py:
+
+    header  <BBHffffI  version, count, cal value, current LSB, bat V/count
+                       (NaN if battery monitoring is off),
+                       charge_mAh, energy_mWh (newest record, NaN if unknown),
+                       device time at publish
+    first   <IhHH      t, shunt_raw, bus_raw, bat_raw (0xFFFF = none)
+    others  4 zigzag varints: deltas of t, shunt_raw, bus_raw, bat_raw
+
+Version 3 is version 1 followed by the phase timings of the wake (t_ms of
+the JSON payload, see phases.report()):
+
+    timings <B         number of phases, then per phase
+            <B         name length, the name (ASCII) and ms as zigzag varint
+
+Stream frame, version 2 (continuous mode, see stream.py), filled in place:
+
+    header  <BBHHfIII  version, 0, count, cal value, current LSB, frame
+                       sequence number, ticks_ms of the first sample,
+                       sample period in us
+    samples <hH        shunt_raw, bus_raw per sample
+
+A gap in the sequence numbers means frames were dropped on the device.
+'''
+
+import struct
+import time
+
+VERSION = 1
+TIMED_VERSION = 3
+
+# field names of the expanded JSON batch payload
+FIELDS = ('t', 'shunt_V', 'bus_V', 'current_A', 'power_W',
+          'charge_mAh', 'energy_mWh', 'bat_V', 'bat_perc')
+
+_HEADER = '<BBHffffI'
+_FIRST = '<IhHH'
+_NO_BAT = 0xFFFF
+
+FRAME_VERSION = 2
+_FRAME_HEADER = '<BBHHfIII'
+_SAMPLE = '<hH'
+FRAME_HEADER_SIZE = struct.calcsize(_FRAME_HEADER)
+SAMPLE_SIZE = struct.calcsize(_SAMPLE)
+
+
+def make(result):
+    '''Record from a `CurrentReader.read()` result (with optional 'bat' dict).'''
+    bat = result.get('bat') or {}
+    bat_raw = bat.get('raw')
+    return [
+        int(time.time()),
+        round(result['shunt_raw']),
+        round(result['bus_raw']),
+        None if bat_raw is None else round(bat_raw),
+        result.get('charge_mAh'),
+        result.get('energy_mWh'),
+    ]
+
+
+def expand(records, scale):
+    '''JSON batch payload: {"fields": FIELDS, "now": t, "records": [...]}'''
+    from lib.ina226 import convert
+    cal, current_lsb, bat_scale = scale
+    rows = []
+    for t, shunt, bus, bat, mah, mwh in records:
+        shunt_mv, bus_v, current, power = convert(shunt, bus, cal, current_lsb)
+        bat_v = bat_perc = None
+        if bat is not None and bat_scale is not None:
+            from bat import percentage
+            bat_v = bat * bat_scale
+            bat_perc = percentage(bat_v) * 100
+        rows.append([t, shunt_mv / 1000.0, bus_v, current, power, mah, mwh, bat_v, bat_perc])
+    return {'fields': FIELDS, 'now': int(time.time()), 'records': rows}
+
+
+def _varint(out, n):
+    # zigzag, then 7 bits per byte
+    n = (n << 1) ^ (n >> 31)
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def encode(records, scale, timings=None):
+    '''Binary payload (bytes) for up to 255 records, oldest first. With
+    `timings` ({phase: ms}, None values are left out) it is version 3.'''
+    records = records[-255:]
+    cal, current_lsb, bat_scale = scale
+    newest = records[-1]
+    nan = float('nan')
+    out = bytearray(struct.pack(
+        _HEADER, VERSION if timings is None else TIMED_VERSION,
+        len(records), cal, current_lsb, nan if bat_scale is None else bat_scale,
+        nan if newest[4] is None else newest[4],
+        nan if newest[5] is None else newest[5],
+        int(time.time())))
+    prev = None
+    for rec in records:
+        cur = (rec[0], rec[1], rec[2], _NO_BAT if rec[3] is None else rec[3])
+        if prev is None:
+            out.extend(struct.pack(_FIRST, *cur))
+        else:
+            for a, b in zip(cur, prev):
+                _varint(out, a - b)
+        prev = cur
+    if timings is not None:
+        timings = [(k, v) for k, v in timings.items() if v is not None][:255]
+        out.append(len(timings))
+        for name, ms in timings:
+            name = name.encode()
+            out.append(len(name))
+            out.extend(name)
+            _varint(out, int(ms))
+    return bytes(out)
+
+
+def frame_buffer(samples):
+    '''Buffer for a stream frame of up to `samples` samples.'''
+    return bytearray(FRAME_HEADER_SIZE + samples * SAMPLE_SIZE)
+
+
+def put_sample(buf, i, shunt_raw, bus_raw):
+    '''Store sample `i` of a frame in place.'''
+    struct.pack_into(_SAMPLE, buf, FRAME_HEADER_SIZE + i * SAMPLE_SIZE, shunt_raw, bus_raw)
+
+
+def finish_frame(buf, count, seq, t0_ms, period_us, scale):
+    '''Write the header; returns a memoryview of the frame's `count` samples.'''
+    cal, current_lsb = scale[0], scale[1]
+    struct.pack_into(_FRAME_HEADER, buf, 0, FRAME_VERSION, 0, count, cal, current_lsb,
+                     seq & 0xFFFFFFFF, t0_ms, period_us)
+    return memoryview(buf)[:FRAME_HEADER_SIZE + count * SAMPLE_SIZE]
+
+
+def frame_count(frame):
+    '''Number of samples in a stream frame.'''
+    return (len(frame) - FRAME_HEADER_SIZE) // SAMPLE_SIZE
+
+
+def get_sample(frame, i):
+    '''(shunt_raw, bus_raw) of sample `i` of a stream frame.'''
+    return struct.unpack_from(_SAMPLE, frame, FRAME_HEADER_SIZE + i * SAMPLE_SIZE)
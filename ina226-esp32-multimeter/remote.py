@@ -0,0 +1,126 @@
+'''Remotely tunable settings from a retained MQTT message.
+
+Every publishing wake subscribes to the device's config topic
+(config.mqtt['topics']['config'] with the device id filled in) in the MQTT
+session it already has open and waits at most config.remote['wait_ms'] for
+the retained message, a JSON object of dotted config keys:
+
+    {"v": 3, "ina226.interval_seconds": 300, "ina226.profile": "balanced"}
+
+Only keys listed in config.remote['keys'] with a value of the same type as
+in config.py are accepted; "v" is an optional version that is published
+with the measurements as `cfg`. New settings are cached in RTC memory and on
+flash and applied to the config module by load() at the start of every wake,
+so later wakes do not wait for the message. The interval applies from the
+current sleep on, sampling settings from the next wake.
+'''
+
+import errno
+import json
+import config
+import rtcmem
+
+_KEY = 'remote'
+
+
+def _read_flash():
+    try:
+        with open(config.remote['path']) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_flash(settings):
+    try:
+        with open(config.remote['path'], 'w') as f:
+            json.dump(settings, f)
+    except OSError as exc:
+        print('remote: saving settings failed:', exc)
+
+
+def _valid(settings):
+    '''The accepted part of a received settings object.'''
+    ok = {}
+    for key, value in settings.items():
+        if key == 'v':
+            ok[key] = value
+            continue
+        if key not in config.remote['keys']:
+            print('remote: ignoring', key)
+            continue
+        section, name = key.split('.', 1)
+        current = getattr(config, section).get(name)
+        if type(value) != type(current) and not (type(current) == float and type(value) == int):
+            print('remote: wrong type for', key)
+            continue
+        if key == 'ina226.profile' and value not in config.ina226['profiles']:
+            print('remote: unknown profile', value)
+            continue
+        ok[key] = value
+    return ok
+
+
+def _apply(settings):
+    for key, value in settings.items():
+        if key != 'v':
+            section, name = key.split('.', 1)
+            getattr(config, section)[name] = value
+
+
+def load():
+    '''Apply the cached settings to config. Call at the start of a wake.'''
+    settings = rtcmem.get(_KEY)
+    if settings is None:
+        # after a power loss; an empty dict keeps later wakes off the flash
+        settings = _read_flash() or {}
+        rtcmem.put(_KEY, settings)
+    _apply(settings)
+
+
+def version():
+    '''Version ("v") of the settings in use, None if unknown.'''
+    return (rtcmem.get(_KEY) or {}).get('v')
+
+
+def fetch(client):
+    '''
+    Read the retained config message with the connected `client`, waiting at
+    most config.remote['wait_ms'] (and not past the session's deadline).
+    Changed settings are stored and applied. Returns True if they changed.
+    '''
+    from deadline import Deadline
+    topic = config.mqtt['topics']['config'].format(config.id())
+    session = client.deadline
+    wait = config.remote['wait_ms']
+    remaining = session.remaining()
+    if remaining is not None:
+        wait = min(wait, remaining)
+    client.deadline = Deadline(wait)
+    msg = None
+    try:
+        client.subscribe(topic)
+        while msg is None:
+            op, t, m = client.wait_msg()
+            if op is not None and op & 0xF0 == 0x30 and t == topic:
+                msg = m
+    except OSError as exc:
+        # no retained message within the wait
+        if exc.args[0] != errno.ETIMEDOUT:
+            raise
+    finally:
+        client.deadline = session
+    if msg is None:
+        return False
+    try:
+        settings = _valid(json.loads(msg))
+    except (ValueError, AttributeError):
+        print('remote: invalid settings message')
+        return False
+    if settings == rtcmem.get(_KEY):
+        return False
+    print('remote: new settings', settings)
+    rtcmem.put(_KEY, settings)
+    _write_flash(settings)
+    _apply(settings)
+    return True
@@ -0,0 +1,77 @@
+'''Small key/value store kept in RTC memory.
+
+RTC memory survives deepsleep but not a power loss or a hard reset. The whole
+store is one JSON object; every module uses its own top-level key.
+
+usage:
+> import rtcmem
+> n = rtcmem.get('wakes', 0)
+> rtcmem.put('wakes', n + 1)
+> rtcmem.save()  # done by ds before going to sleep
+'''
+
+import json
+from machine import RTC
+
+_rtc = RTC()
+_store = None
+_SIZE = 2048
+# record lists (oldest first) that save() shortens if the store is too big
+_TRIM = ('batch', 'journal')
+
+
+def load():
+    '''Return the store, reading RTC memory on first use.'''
+    global _store
+    if _store is None:
+        try:
+            _store = json.loads(_rtc.memory() or b'{}')
+        except ValueError:
+            # garbage after power loss or a layout change
+            _store = {}
+    return _store
+
+
+def get(key, default=None):
+    return load().get(key, default)
+
+
+def put(key, value):
+    load()[key] = value
+
+
+def pop(key, default=None):
+    return load().pop(key, default)
+
+
+def save():
+    '''Write the store back to RTC memory (max. 2048 bytes on the ESP32).
+    If it does not fit, the oldest records of the longest list in _TRIM are
+    dropped, the other keys are always kept.'''
+    if _store is None:
+        return
+    data = json.dumps(_store)
+    while len(data) > _SIZE:
+        key = _longest()
+        if key is None:
+            print('rtcmem save failed: %d bytes' % len(data))
+            return
+        recs = _store[key]
+        # estimate the records to drop from their average size
+        size = len(json.dumps(recs)) // len(recs) + 1
+        n = min(len(recs), (len(data) - _SIZE) // size + 1)
+        del recs[:n]
+        print('rtcmem full, dropped %d %s records' % (n, key))
+        data = json.dumps(_store)
+    try:
+        _rtc.memory(data)
+    except ValueError as exc:
+        print('rtcmem save failed:', exc)
+
+
+def _longest():
+    key = None
+    for k in _TRIM:
+        if _store.get(k) and (key is None or len(_store[k]) > len(_store[key])):
+            key = k
+    return key
@@ -0,0 +1,78 @@
+'''Adaptive sampling interval.
+
+Picks the deepsleep interval from the battery level and the measured
+(harvest) current:
+
+    low      battery low or no harvest -> config.schedule['max_seconds']
+    normal                              -> base interval
+    surplus  battery full and harvest   -> config.schedule['min_seconds']
+
+Thresholds get a hysteresis band in the direction of the current state, so
+the node does not toggle between two intervals around a threshold. The state
+and the chosen interval are kept in RTC memory.
+
+The base interval is config.ina226['interval_seconds'], or the long
+config.alert['interval_seconds'] while the ALERT wakeup is armed.
+'''
+
+import config
+import rtcmem
+import alert
+
+_KEY = 'sched'
+
+
+def _base():
+    if alert.armed():
+        return config.alert['interval_seconds']
+    return config.ina226['interval_seconds']
+
+
+def _state(perc, current, prev):
+    cfg = config.schedule
+    # thresholds move away from the current state so it is sticky
+    h_perc = cfg['hysteresis_perc']
+    h_current = cfg['hysteresis_A']
+    if (perc is not None and perc <= cfg['low_perc'] + (h_perc if prev == 'low' else 0)) \
+            or current <= cfg['dark_A'] + (h_current if prev == 'low' else 0):
+        return 'low'
+    if (perc is None or perc >= cfg['high_perc'] - (h_perc if prev == 'surplus' else 0)) \
+            and current >= cfg['surplus_A'] - (h_current if prev == 'surplus' else 0):
+        return 'surplus'
+    return 'normal'
+
+
+def next_interval(result):
+    '''
+    Choose the interval in seconds for the next sleep from a
+    `CurrentReader.read()` result (with optional 'bat' dict).
+    '''
+    if not config.schedule['adaptive']:
+        return _base()
+    bat = result.get('bat') or {}
+    prev = rtcmem.get(_KEY, ['normal'])[0]
+    state = _state(bat.get('percentage'), result['current_A'], prev)
+    if state == 'low':
+        seconds = config.schedule['max_seconds']
+    elif state == 'surplus':
+        seconds = config.schedule['min_seconds']
+    else:
+        seconds = _base()
+    if state != prev:
+        print('schedule: %s -> %s, %d s' % (prev, state, seconds))
+    rtcmem.put(_KEY, [state, seconds])
+    return seconds
+
+
+def interval():
+    '''Interval chosen during this or the last wake.'''
+    if not config.schedule['adaptive']:
+        return _base()
+    return rtcmem.get(_KEY, [None, _base()])[1]
+
+
+def critical_interval():
+    '''Sleep time in ms on critical battery; -1 sleeps until reset.'''
+    if not config.schedule['adaptive']:
+        return -1
+    return config.schedule['critical_seconds'] * 1000
@@ -0,0 +1,92 @@
+'''Streaming sample statistics without per-sample allocations.
+
+Samples go into one preallocated array('f') per channel; mean and standard
+deviation are updated on the fly (Welford), min/max are tracked and the
+median is selected in place, so taking hundreds of samples does not create
+garbage for the GC to collect.
+
+usage:
+> s = Stats(100)
+> for x in samples:
+>     s.add(x)
+> s.median(), s.summary()  # summary: {'mean', 'min', 'max', 'std'}
+'''
+
+from array import array
+from math import sqrt
+
+
+def _select(a, n, k):
+    '''k-th smallest of a[:n] (quickselect, reorders a).'''
+    lo, hi = 0, n - 1
+    while lo < hi:
+        pivot = a[(lo + hi) >> 1]
+        i, j = lo, hi
+        while i <= j:
+            while a[i] < pivot:
+                i += 1
+            while a[j] > pivot:
+                j -= 1
+            if i <= j:
+                a[i], a[j] = a[j], a[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return a[k]
+
+
+class Stats:
+    def __init__(self, size):
+        self.buf = array('f', (0 for _ in range(size)))
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, x):
+        n = self.n
+        # samples beyond the buffer still count for mean/std/min/max
+        if n < len(self.buf):
+            self.buf[n] = x
+        n += 1
+        self.n = n
+        d = x - self.mean
+        self.mean += d / n
+        self._m2 += d * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def std(self):
+        '''Population standard deviation.'''
+        return sqrt(self._m2 / self.n) if self.n else 0.0
+
+    def median(self):
+        '''Median of the buffered samples; reorders the buffer.'''
+        n = min(self.n, len(self.buf))
+        if not n:
+            return None
+        a = self.buf
+        mid = n // 2
+        upper = _select(a, n, mid)
+        if n % 2:
+            return upper
+        # after the selection everything left of mid is <= upper
+        lower = a[0]
+        for i in range(1, mid):
+            if a[i] > lower:
+                lower = a[i]
+        return (lower + upper) / 2
+
+    def summary(self):
+        return {'mean': self.mean, 'min': self.min, 'max': self.max, 'std': self.std()}
@@ -0,0 +1,85 @@
+'''Continuous streaming for bench and mains-powered monitors.
+
+With config.stream['enabled'] main.py does not go to deepsleep. It keeps
+WLAN and one MQTT session up and runs CurrentReader.run(), which samples at
+config.stream['rate_hz'] and hands a binary frame (record.py, version 2)
+to Sender every config.stream['frame_ms']. Sender publishes the frames on
+config.mqtt['topics']['stream'] (QoS 0) in a second thread, so a slow
+broker costs frames, never samples.
+
+Frames are decoded by python-scripts/payload/ctbin.py.
+'''
+
+from time import ticks_ms, ticks_diff
+import config
+from deadline import Deadline
+
+
+class Sender:
+    '''Sink for CurrentReader.run(): publishes frames on a persistent MQTT
+    session, pings the broker at half the keepalive interval and reconnects
+    on the next frame after an error.'''
+
+    def __init__(self, topic, keepalive):
+        self.topic = topic
+        self.keepalive = keepalive
+        self.client = None
+        self._pinged = 0
+        self.sent = 0
+
+    def _connect(self):
+        from mqtt import make_client
+        client = make_client(self.keepalive)
+        client.connect(deadline=Deadline(config.mqtt.get('budget_ms')))
+        self.client = client
+        self._pinged = ticks_ms()
+        print('stream: connected')
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.disconnect()
+            except OSError:
+                pass
+            self.client = None
+
+    def __call__(self, frame):
+        if self.client is None:
+            self._connect()
+        client = self.client
+        try:
+            # every operation gets the budget anew, the session lives on
+            client.deadline = Deadline(config.mqtt.get('budget_ms'))
+            client.publish(self.topic, frame)
+            if ticks_diff(ticks_ms(), self._pinged) >= self.keepalive * 500:
+                client.ping()
+                self._pinged = ticks_ms()
+            # PINGRESP and anything else the broker sent
+            while client.check_msg()[0] is not None:
+                pass
+        except OSError:
+            self.close()
+            raise
+        self.sent += 1
+
+
+def run(reader):
+    '''Stream until Ctrl-C. Call with the reader powered on. Resets the MCU
+    if sampling fails, to start over from a clean state.'''
+    import internet
+    cfg = config.stream
+    internet.begin()
+    # on timeout this goes to deepsleep for one interval and starts over
+    if not internet.wait(reader):
+        return
+    sender = Sender(config.mqtt['topics']['stream'], cfg['keepalive'])
+    try:
+        frames, dropped = reader.run(sink=sender)
+    except Exception as exc:
+        print('stream: sampling failed:', exc)
+        import machine
+        machine.reset()
+        return
+    finally:
+        sender.close()
+    print('stream: %d frames, %d sent, %d dropped' % (frames, sender.sent, dropped))
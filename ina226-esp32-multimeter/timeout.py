@@ -1,12 +1,19 @@
-def timeout(callback, ms):
+def timeout(callback, ms, work=None):
     '''Calls repeatedly the callback until it returns True or the timeout 
-    ms (int) is reached. '''
-    from time import ticks_ms as millis
+    ms (int) is reached. Returns True on timeout.
+
+    Instead of idling between polls, callables from the `work` list are
+    popped and run one at a time. Work that is left when the callback
+    returns True stays in the list for the caller.'''
+    from time import ticks_ms, ticks_diff
     from machine import idle
 
-    timeout = millis() + ms
-    while millis() < timeout:
+    start = ticks_ms()
+    while ticks_diff(ticks_ms(), start) < ms:
         if callback():
             return False
-        idle()
-    return True
\ No newline at end of file
+        if work:
+            work.pop(0)()
+        else:
+            idle()
+    return not callback()
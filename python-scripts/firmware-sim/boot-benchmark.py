@@ -0,0 +1,89 @@
+"""boot-benchmark.py
+
+Time from reset to the first I2C transfer with the INA226, with the firmware
+imported from source and, given --mpy-dir, from a precompiled .mpy build
+(python-scripts/mpy-build/build-mpy.py). Imports repeat on every wake, so
+this is paid once per measurement.
+
+Usage examples:
+  python boot-benchmark.py
+  python boot-benchmark.py --mpy-dir ../mpy-build/build
+  python boot-benchmark.py --mpy-dir ../mpy-build/build --set batch.enabled=True --wakes 10
+  python boot-benchmark.py --py-ms-per-kb 8 --mpy-ms-per-kb 1
+
+The import time is a model (`ImportCost` in fwsim.py): ms per kB of source
+compiled or of .mpy loaded. Calibrate it against the `t_first_i2c_ms` /
+`t_import_ms` fields a real device publishes (see wake-timing/).
+
+Requirements: none
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import statistics
+import sys
+from pathlib import Path
+
+from fwsim import ImportCost, Simulator, parse_overrides
+
+
+def benchmark(name: str, cost: ImportCost, overrides: dict, wakes: int) -> dict:
+	sim = Simulator(overrides=overrides, import_cost=cost)
+	results = sim.run(wakes)
+	errors = [r["error"] for r in results if r["error"]]
+	if errors:
+		logging.warning("%s: %s", name, errors[0])
+	first_i2c = [r["first_i2c_ms"] for r in results if r["first_i2c_ms"] is not None]
+	return {
+		"build": name,
+		"import_ms": statistics.mean(r["import_ms"] for r in results),
+		"first_i2c_ms": statistics.mean(first_i2c) if first_i2c else float("nan"),
+		"awake_ms": statistics.mean(r["awake_ms"] for r in results),
+		"charge_uAh": statistics.mean(r["awake_uAh"] for r in results),
+	}
+
+
+def print_table(rows: list[dict]) -> None:
+	header = f"{'build':<8} {'import ms':>10} {'first I2C ms':>13} {'awake ms':>9} {'awake uAh':>10}"
+	print(header)
+	print("-" * len(header))
+	for r in rows:
+		print(f"{r['build']:<8} {r['import_ms']:>10.1f} {r['first_i2c_ms']:>13.1f} {r['awake_ms']:>9.1f} {r['charge_uAh']:>10.3f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Reset-to-first-I2C time of source and .mpy firmware builds")
+	parser.add_argument("--mpy-dir", type=Path, help="Output directory of build-mpy.py")
+	parser.add_argument("--wakes", type=int, default=5, help="Wake cycles per build")
+	parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+						help="Config override, e.g. batch.enabled=True (repeatable)")
+	parser.add_argument("--py-ms-per-kb", type=float, default=ImportCost.py_ms_per_kb, help="Compile time per kB of source")
+	parser.add_argument("--mpy-ms-per-kb", type=float, default=ImportCost.mpy_ms_per_kb, help="Load time per kB of .mpy")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	try:
+		overrides = parse_overrides(args.overrides)
+	except ValueError as exc:
+		parser.error(str(exc))
+
+	builds = [("source", None)]
+	if args.mpy_dir:
+		if not args.mpy_dir.is_dir():
+			logging.error("'%s' is not a directory, run build-mpy.py first", args.mpy_dir)
+			return 2
+		builds.append(("mpy", args.mpy_dir))
+
+	rows = [
+		benchmark(name, ImportCost(args.py_ms_per_kb, args.mpy_ms_per_kb, mpy_dir), overrides, args.wakes)
+		for name, mpy_dir in builds
+	]
+	print_table(rows)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
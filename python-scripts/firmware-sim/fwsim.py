@@ -0,0 +1,1483 @@
+"""fwsim.py
+
+Run the ESP32 firmware (ina226-esp32-multimeter) under CPython. Fake
+`machine`, `network`, `esp32`, `micropython`, `socket`, `select`, `binascii`,
+`_thread` and `time` modules replace the MicroPython ones:
+
+- a virtual clock: sleeps, I2C transfers, WLAN association and broker round
+  trips advance simulated time, CPython run time does not count
+- a register-level INA226 (`SimulatedINA226`) on a fake I2C bus, powered
+  through the MOSFET pin from config.ina226['pwr_pin']
+- a WLAN station with scan/association/DHCP latencies
+- a local MQTT stand-in (`Broker`) that answers CONNECT, PUBLISH (QoS 0/1),
+  SUBSCRIBE (with retained messages) and PINGREQ, or stays silent (`mute`);
+  non-blocking sockets are waited on with a fake `select.poll`;
+  `serve_broker()` puts it on a real TCP port for asyncio clients
+- RTC memory and pin levels that survive deepsleep, a flash directory for
+  files written by the firmware and a watchdog
+- threads (`_thread`) that take turns like under the GIL of the esp32 port
+- an energy model (`EnergyModel`) integrating the supply current over the
+  simulated time
+- optionally the time to compile or load the imported firmware modules
+  (`ImportCost`), to compare source against .mpy builds
+
+Each wake imports the firmware afresh and runs main.py until it calls
+deepsleep. Cycles that end in machine.lightsleep() (config.sleep, see
+planner.py) are results of their own, with outcome "light". The MCU and radio currents are rough datasheet values, use the
+charge figures to compare firmware versions, not as absolute numbers.
+
+As a module:
+  from fwsim import Simulator
+  sim = Simulator(overrides={"batch.enabled": True})
+  results = sim.run(10)
+"""
+
+from __future__ import annotations
+
+import ast
+import asyncio
+import collections
+import contextlib
+import errno
+import importlib
+import importlib.abc
+import importlib.machinery
+import io
+import math
+import random
+import runpy
+import sys
+import tempfile
+import threading
+import types
+from dataclasses import dataclass, field
+from pathlib import Path
+
+FIRMWARE_DIR = Path(__file__).resolve().parents[2] / "ina226-esp32-multimeter"
+
+# ADC noise (1 sigma) of a single conversion at 140 us conversion time.
+# Noise is assumed to scale with 1/sqrt(conversion time * averages).
+_NOISE_SHUNT_UV = 60.0
+_NOISE_BUS_MV = 8.0
+
+# machine.reset_cause() / wake_reason() values of the esp32 port
+PWRON_RESET = 1
+WDT_RESET = 3
+DEEPSLEEP_RESET = 4
+EXT0_WAKE = 2
+TIMER_WAKE = 4
+
+_EPOCH = 1_700_000_000
+
+
+class DeepSleep(BaseException):
+	"""Raised by the fake machine.deepsleep(); ends a wake. ms is None for 'until reset'."""
+
+	def __init__(self, ms: int | None) -> None:
+		super().__init__(ms)
+		self.ms = ms
+
+
+class WatchdogReset(BaseException):
+	"""Raised when simulated time passes the watchdog timeout without a feed()."""
+
+
+class CycleLimit(BaseException):
+	"""Raised when Simulator.run() has all its cycles while the firmware light sleeps."""
+
+
+@dataclass
+class EnergyModel:
+	"""Supply current in mA per state."""
+
+	cpu_ma: float = 40.0        # ESP32 active, radio off
+	radio_ma: float = 80.0      # extra while the WLAN interface is active
+	light_ma: float = 0.8       # machine.lightsleep(), radio off
+	light_wlan_ma: float = 2.0  # machine.lightsleep(), associated in power save (DTIM beacons)
+	sleep_ua: float = 10.0      # deepsleep incl. board quiescent current
+	ina_ma: float = 0.35        # INA226 while powered
+	ina_pd_ua: float = 2.0      # INA226 in power-down mode (datasheet max.)
+
+
+@dataclass
+class ImportCost:
+	"""
+	Time the MCU spends importing firmware modules: compiling .py source or
+	loading precompiled .mpy files (see python-scripts/mpy-build). Modules
+	with a .mpy in `mpy_dir` count as precompiled. Rough figures for an ESP32
+	at 160 MHz, good for comparing builds.
+	"""
+
+	py_ms_per_kb: float = 6.0    # compile from source
+	mpy_ms_per_kb: float = 0.8   # load bytecode
+	mpy_dir: Path | None = None
+
+	def ms(self, source: Path) -> float:
+		if self.mpy_dir is not None:
+			try:
+				rel = source.resolve().relative_to(FIRMWARE_DIR)
+			except ValueError:
+				rel = None
+			mpy = self.mpy_dir / rel.with_suffix(".mpy") if rel else None
+			if mpy is not None and mpy.exists():
+				return mpy.stat().st_size / 1024 * self.mpy_ms_per_kb
+		return source.stat().st_size / 1024 * self.py_ms_per_kb
+
+
+class _TimedLoader(importlib.abc.Loader):
+	"""Advances the virtual clock by the import cost before running a module."""
+
+	def __init__(self, loader, sim: "Simulator", origin: Path) -> None:
+		self.loader = loader
+		self.sim = sim
+		self.origin = origin
+
+	def create_module(self, spec):
+		return self.loader.create_module(spec)
+
+	def exec_module(self, module) -> None:
+		self.sim._charge_import(self.origin)
+		self.loader.exec_module(module)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+	"""Meta path hook charging Simulator.import_cost for firmware modules."""
+
+	def __init__(self, sim: "Simulator") -> None:
+		self.sim = sim
+
+	def find_spec(self, name, path, target=None):
+		spec = importlib.machinery.PathFinder.find_spec(name, path)
+		if spec is None or not spec.origin or not spec.has_location:
+			return None
+		origin = Path(spec.origin)
+		if not origin.resolve().is_relative_to(FIRMWARE_DIR):
+			return None
+		spec.loader = _TimedLoader(spec.loader, self.sim, origin)
+		return spec
+
+
+class VirtualClock:
+	"""Simulated time in us. Charge is integrated on every advance()."""
+
+	def __init__(self) -> None:
+		self.us = 0
+		self.boot_us = 0
+		# callable returning the current draw in mA, set by the simulator
+		self.load = None
+		self.charge_nas = 0.0  # mA * us = nAs
+		self.watchdog = None
+
+	def advance(self, us: float) -> None:
+		us = int(us)
+		if us <= 0:
+			return
+		if self.load is not None:
+			self.charge_nas += self.load() * us
+		self.us += us
+		if self.watchdog is not None:
+			self.watchdog.check()
+
+	# MicroPython time API
+	def ticks_ms(self) -> int:
+		return (self.us - self.boot_us) // 1000
+
+	def ticks_us(self) -> int:
+		return self.us - self.boot_us
+
+	@staticmethod
+	def ticks_diff(a: int, b: int) -> int:
+		return a - b
+
+	@staticmethod
+	def ticks_add(a: int, b: int) -> int:
+		return a + b
+
+	def sleep_ms(self, ms: float) -> None:
+		self.advance(ms * 1000)
+
+	def sleep_us(self, us: float) -> None:
+		self.advance(us)
+
+	def sleep(self, s: float) -> None:
+		self.advance(s * 1_000_000)
+
+	def time(self) -> float:
+		return _EPOCH + self.us / 1_000_000
+
+
+class SimulatedINA226:
+	"""Register-level INA226 model on a fake I2C bus (readfrom_mem_into/writeto_mem)."""
+
+	_CT_US = (140, 204, 332, 588, 1100, 2116, 4156, 8244)
+	_AVG = (1, 4, 16, 64, 128, 256, 512, 1024)
+	_POR = {0: 0x4127, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0}
+
+	def __init__(self, clock: VirtualClock, r_shunt_ohm: float, current_a, bus_v: float = 4.1, seed: int = 1) -> None:
+		self.clock = clock
+		self.r_shunt_ohm = r_shunt_ohm
+		# callable returning the true current at a given time in us
+		self.current_a = current_a
+		self.bus_v = bus_v
+		self.rng = random.Random(seed)
+		self.regs = dict(self._POR)
+		self.ready_at = None
+		self.powered = True
+		self.i2c_transactions = 0
+
+	def power(self, on: bool) -> None:
+		"""Supply switched; registers are back at power-on defaults after power-up."""
+		if on and not self.powered:
+			self.regs = dict(self._POR)
+			self.ready_at = None
+			if self.regs[0] & 4:
+				self._start_conversion()
+		self.powered = on
+
+	def _conversion_us(self) -> tuple[int, int, int]:
+		cfg = self.regs[0]
+		avg = self._AVG[(cfg >> 9) & 7]
+		return avg, self._CT_US[(cfg >> 6) & 7], self._CT_US[(cfg >> 3) & 7]
+
+	def _start_conversion(self, at: int | None = None) -> None:
+		avg, vbus_ct, vshunt_ct = self._conversion_us()
+		self.ready_at = (self.clock.us if at is None else at) + avg * (vbus_ct + vshunt_ct)
+
+	def _finish_conversion(self) -> None:
+		if self.ready_at is None or self.clock.us < self.ready_at:
+			return
+		avg, vbus_ct, vshunt_ct = self._conversion_us()
+		shunt_uv = self.current_a(self.ready_at) * self.r_shunt_ohm * 1e6
+		shunt_uv += self.rng.gauss(0, _NOISE_SHUNT_UV * math.sqrt(140 / vshunt_ct / avg))
+		bus_mv = self.bus_v * 1000 + self.rng.gauss(0, _NOISE_BUS_MV * math.sqrt(140 / vbus_ct / avg))
+		shunt = max(-32768, min(32767, round(shunt_uv / 2.5)))
+		bus = max(0, min(0x7FFF, round(bus_mv / 1.25)))
+		current = shunt * self.regs[5] // 2048
+		self.regs[1] = shunt & 0xFFFF
+		self.regs[2] = bus
+		self.regs[4] = current & 0xFFFF
+		self.regs[3] = abs(current) * bus // 20000
+		self.regs[6] |= 0x0008
+		self._check_alert(shunt, bus, self.regs[3])
+		done = self.ready_at
+		self.ready_at = None
+		if self.regs[0] & 4:
+			# continuous mode: next conversion, skipping the ones nobody read
+			period = avg * (vbus_ct + vshunt_ct)
+			self._start_conversion(done + (self.clock.us - done) // period * period)
+
+	def _check_alert(self, shunt: int, bus: int, power: int) -> None:
+		mask = self.regs[6]
+		limit = self.regs[7]
+		signed = limit - 0x10000 if limit & 0x8000 else limit
+		# only the highest enabled alert function counts
+		if mask & 0x8000:
+			hit = shunt > signed
+		elif mask & 0x4000:
+			hit = shunt < signed
+		elif mask & 0x2000:
+			hit = bus > limit
+		elif mask & 0x1000:
+			hit = bus < limit
+		elif mask & 0x0800:
+			hit = power > limit
+		else:
+			hit = False
+		if hit:
+			self.regs[6] |= 0x0010
+		elif not mask & 0x0001:
+			# transparent mode: flag follows the last conversion
+			self.regs[6] &= ~0x0010
+
+	def poll(self) -> None:
+		"""Let a pending (continuous mode) conversion complete without I2C access."""
+		self._finish_conversion()
+
+	@property
+	def alert_asserted(self) -> bool:
+		"""State of the ALERT output (True = asserted)."""
+		return self.powered and bool(self.regs[6] & 0x0010)
+
+	def supply_ma(self, energy: EnergyModel) -> float:
+		"""Supply current: none when switched off, less in power-down mode."""
+		if not self.powered:
+			return 0.0
+		if not self.regs[0] & 7:
+			return energy.ina_pd_ua / 1000
+		return energy.ina_ma
+
+	def writeto_mem(self, addr: int, reg: int, buf) -> None:
+		self.i2c_transactions += 1
+		value = (buf[0] << 8) | buf[1]
+		if reg == 0 and value & 0x8000:
+			# software reset
+			self.regs = dict(self._POR)
+			self.ready_at = None
+			return
+		self.regs[reg] = value
+		if reg == 0:
+			if self.regs[0] & 7:
+				self.regs[6] &= ~0x0008
+				self._start_conversion()
+			else:
+				# power-down aborts a conversion
+				self.ready_at = None
+
+	def readfrom_mem_into(self, addr: int, reg: int, buf) -> None:
+		self.i2c_transactions += 1
+		self._finish_conversion()
+		value = self.regs.get(reg, 0)
+		if reg == 6:
+			# reading Mask/Enable clears CVRF and a latched alert
+			self.regs[6] &= ~0x0018
+		buf[0] = (value >> 8) & 0xFF
+		buf[1] = value & 0xFF
+
+
+def _topic_matches(pattern: str, topic: str) -> bool:
+	p = pattern.split("/")
+	t = topic.split("/")
+	for i, part in enumerate(p):
+		if part == "#":
+			return True
+		if i >= len(t) or (part != "+" and part != t[i]):
+			return False
+	return len(p) == len(t)
+
+
+class Broker:
+	"""MQTT 3.1.1 stand-in. Keeps every published message and retained messages."""
+
+	def __init__(self, clock: VirtualClock, rtt_ms: float = 20.0) -> None:
+		self.clock = clock
+		self.rtt_us = int(rtt_ms * 1000)
+		self.up = True
+		# accepts TCP connections but never answers (hung broker)
+		self.mute = False
+		self.messages: list[dict] = []
+		self.retained: dict[str, bytes] = {}
+		self.connects = 0
+
+	def retain(self, topic: str, payload: bytes) -> None:
+		"""Set a retained message, delivered to later subscribers."""
+		if payload:
+			self.retained[topic] = bytes(payload)
+		else:
+			self.retained.pop(topic, None)
+
+	@staticmethod
+	def _packet(kind: int, body: bytes) -> bytes:
+		out = bytearray([kind])
+		n = len(body)
+		while True:
+			b = n & 0x7F
+			n >>= 7
+			out.append(b | (0x80 if n else 0))
+			if not n:
+				break
+		return bytes(out) + body
+
+	def handle(self, kind: int, body: bytes, conn: "FakeSocket") -> list[bytes]:
+		"""Responses to one client packet."""
+		if self.mute:
+			return []
+		ptype = kind & 0xF0
+		if ptype == 0x10:
+			self.connects += 1
+			return [b"\x20\x02\x00\x00"]
+		if ptype == 0x30:
+			qos = (kind >> 1) & 3
+			tl = (body[0] << 8) | body[1]
+			topic = body[2:2 + tl].decode()
+			pos = 2 + tl
+			pid = None
+			if qos:
+				pid = body[pos:pos + 2]
+				pos += 2
+			payload = bytes(body[pos:])
+			self.messages.append({"topic": topic, "payload": payload, "qos": qos,
+				"retain": bool(kind & 1), "us": self.clock.us})
+			if kind & 1:
+				self.retain(topic, payload)
+			return [b"\x40\x02" + pid] if qos == 1 else []
+		if ptype == 0x80:
+			pid = body[:2]
+			pos = 2
+			granted = bytearray()
+			topics = []
+			while pos < len(body):
+				tl = (body[pos] << 8) | body[pos + 1]
+				topics.append(body[pos + 2:pos + 2 + tl].decode())
+				granted.append(min(body[pos + 2 + tl], 1))
+				pos += 3 + tl
+			out = [self._packet(0x90, pid + bytes(granted))]
+			for pattern in topics:
+				for topic, payload in self.retained.items():
+					if _topic_matches(pattern, topic):
+						t = topic.encode()
+						out.append(self._packet(0x31, len(t).to_bytes(2, "big") + t + payload))
+			return out
+		if ptype == 0xC0:
+			return [b"\xd0\x00"]
+		return []
+
+
+async def serve_broker(broker: Broker, host: str = "127.0.0.1", port: int = 0) -> asyncio.base_events.Server:
+	"""
+	Serve `broker` over real TCP for clients running under CPython asyncio
+	(lib/umqttasync.py). Responses are sent broker.rtt_us after the request,
+	in wall-clock time and without holding back later requests, so several
+	messages can be in flight. The port is in server.sockets[0].getsockname().
+	"""
+	loop = asyncio.get_running_loop()
+
+	async def session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		try:
+			while True:
+				kind = (await reader.readexactly(1))[0]
+				n = 0
+				shift = 0
+				while True:
+					b = (await reader.readexactly(1))[0]
+					n |= (b & 0x7F) << shift
+					shift += 7
+					if not b & 0x80:
+						break
+				body = await reader.readexactly(n) if n else b""
+				if kind == 0xE0:  # DISCONNECT
+					break
+				for resp in broker.handle(kind, body, None):
+					loop.call_later(broker.rtt_us / 1e6, writer.write, resp)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	return await asyncio.start_server(session, host, port)
+
+
+class FakeSocket:
+	"""TCP connection to the Broker with MicroPython socket semantics."""
+
+	def __init__(self, sim: "Simulator", *args) -> None:
+		self.sim = sim
+		self.broker = sim.broker
+		self.clock = sim.clock
+		self.timeout = None  # None = blocking, 0 = non-blocking
+		self.connected = False
+		# non-blocking connect in progress: (done time in us, refused)
+		self.connecting: tuple[int, bool] | None = None
+		self.out = bytearray()
+		self.inbox = bytearray()
+		# (ready time in us, data)
+		self.pending: list[tuple[int, bytes]] = []
+
+	def settimeout(self, t) -> None:
+		self.timeout = t
+
+	def setblocking(self, flag: bool) -> None:
+		self.timeout = None if flag else 0
+
+	def setsockopt(self, *args) -> None:
+		pass
+
+	def connect(self, addr) -> None:
+		refused = not self.sim.wlan.isconnected() or not self.broker.up
+		if self.timeout == 0:
+			self.connecting = (self.clock.us + self.broker.rtt_us, refused)
+			raise OSError(errno.EINPROGRESS)
+		self.clock.advance(self.broker.rtt_us)
+		if refused:
+			raise OSError(errno.EHOSTUNREACH)
+		self.connected = True
+
+	def _events(self, mask: int) -> tuple[int, int | None]:
+		"""Poll events ready now and the time in us when more may become ready."""
+		if self.connecting:
+			done, refused = self.connecting
+			if self.clock.us < done:
+				return 0, done
+			self.connecting = None
+			if refused:
+				return POLLERR | POLLHUP, None
+			self.connected = True
+		if not self.connected:
+			return POLLHUP, None
+		self._deliver(wait=False)
+		ready = POLLOUT & mask
+		if self.inbox:
+			ready |= POLLIN & mask
+		return ready, self.pending[0][0] if self.pending else None
+
+	def _deliver(self, wait: bool) -> None:
+		if wait and self.pending and not self.inbox:
+			self.clock.advance(self.pending[0][0] - self.clock.us)
+		while self.pending and self.pending[0][0] <= self.clock.us:
+			self.inbox += self.pending.pop(0)[1]
+
+	def write(self, buf, n=None) -> int:
+		if not self.connected:
+			raise OSError(errno.ENOTCONN)
+		if not self.broker.up or not self.sim.wlan.isconnected():
+			# session kept over a light sleep, but the broker or the AP went away
+			self.connected = False
+			raise OSError(errno.ECONNRESET)
+		if isinstance(buf, str):
+			buf = buf.encode()
+		data = bytes(memoryview(buf)[:n] if n is not None else buf)
+		# transmit time at roughly 1 Mbit/s effective
+		self.clock.advance(len(data) * 8)
+		self.out += data
+		self._parse()
+		return len(data)
+
+	send = write
+	sendall = write
+
+	def _parse(self) -> None:
+		while len(self.out) >= 2:
+			n = 0
+			shift = 0
+			i = 1
+			while True:
+				if i >= len(self.out):
+					return
+				b = self.out[i]
+				n |= (b & 0x7F) << shift
+				i += 1
+				if not b & 0x80:
+					break
+				shift += 7
+			if len(self.out) < i + n:
+				return
+			kind = self.out[0]
+			body = bytes(self.out[i:i + n])
+			del self.out[:i + n]
+			ready = self.clock.us + self.broker.rtt_us
+			for resp in self.broker.handle(kind, body, self):
+				self.pending.append((ready, resp))
+
+	def _take(self, n: int):
+		self._deliver(wait=self.timeout != 0)
+		if not self.inbox:
+			if self.timeout == 0:
+				return None
+			# nothing will arrive: time out like lwIP
+			self.clock.advance((self.timeout or 5) * 1_000_000)
+			raise OSError(errno.ETIMEDOUT)
+		data = bytes(self.inbox[:n])
+		del self.inbox[:n]
+		return data
+
+	def read(self, n: int = 4096):
+		return self._take(n)
+
+	def recv(self, n: int):
+		data = self._take(n)
+		if data is None:
+			raise OSError(errno.EAGAIN)
+		return data
+
+	def readinto(self, buf, n: int | None = None):
+		data = self._take(len(buf) if n is None else n)
+		if data is None:
+			return None
+		buf[:len(data)] = data
+		return len(data)
+
+	def readable(self) -> bool:
+		self._deliver(wait=False)
+		return bool(self.inbox)
+
+	def close(self) -> None:
+		self.connected = False
+		self.connecting = None
+
+
+POLLIN, POLLOUT, POLLERR, POLLHUP = 1, 4, 8, 16
+
+
+class FakePoll:
+	"""select.poll() over FakeSockets; waiting advances the virtual clock."""
+
+	def __init__(self, clock: VirtualClock) -> None:
+		self.clock = clock
+		self.socks: dict[FakeSocket, int] = {}
+
+	def register(self, sock: FakeSocket, mask: int = POLLIN | POLLOUT) -> None:
+		self.socks[sock] = mask
+
+	modify = register
+
+	def unregister(self, sock: FakeSocket) -> None:
+		self.socks.pop(sock, None)
+
+	def poll(self, timeout: int = -1) -> list[tuple[FakeSocket, int]]:
+		end = None if timeout is None or timeout < 0 else self.clock.us + timeout * 1000
+		while True:
+			ready = []
+			wake = end
+			for sock, mask in self.socks.items():
+				events, later = sock._events(mask)
+				if events:
+					ready.append((sock, events))
+				elif later is not None and (wake is None or later < wake):
+					wake = later
+			if ready:
+				return ready
+			if wake is None:
+				raise RuntimeError("poll() without timeout on sockets that stay silent")
+			if wake <= self.clock.us:
+				return []
+			self.clock.advance(wake - self.clock.us)
+
+	def ipoll(self, timeout: int = -1, flags: int = 0):
+		return iter(self.poll(timeout))
+
+
+class Station:
+	"""network.WLAN(STA_IF) model."""
+
+	def __init__(self, sim: "Simulator") -> None:
+		self.sim = sim
+		self.reset()
+
+	def reset(self) -> None:
+		self._active = False
+		self._static = None
+		self._connected_at = None
+
+	def active(self, *args):
+		if args:
+			self._active = bool(args[0])
+			if not self._active:
+				self._connected_at = None
+		return self._active
+
+	def scan(self):
+		self.sim.clock.advance(self.sim.scan_ms * 1000)
+		return [(self.sim.ssid.encode(), b"\x01\x02\x03\x04\x05\x06", 6, -55, 3, False)]
+
+	def connect(self, ssid, key=None, *, bssid=None):
+		if not self._active:
+			raise OSError("WLAN not active")
+		if not self.sim.wlan_up or ssid != self.sim.ssid:
+			self._connected_at = math.inf
+			return
+		ms = self.sim.assoc_ms
+		if bssid is None:
+			# the driver scans all channels itself
+			ms += self.sim.scan_ms
+		if self._static is None:
+			ms += self.sim.dhcp_ms
+		self._connected_at = self.sim.clock.us + ms * 1000
+
+	def disconnect(self):
+		self._connected_at = None
+
+	def isconnected(self) -> bool:
+		# the AP may go away while associated (light sleep cycles)
+		return self._connected_at is not None and self.sim.clock.us >= self._connected_at and self.sim.wlan_up
+
+	def status(self, *args):
+		if args:
+			return -55 if args[0] == "rssi" else None
+		if self.isconnected():
+			return 1010
+		return 1001 if self._connected_at is not None else 1000
+
+	def ifconfig(self, *args):
+		if args:
+			self._static = None if args[0] == "dhcp" else tuple(args[0])
+			return None
+		return self._static or ("192.168.2.50", "255.255.255.0", "192.168.2.1", "192.168.2.1")
+
+	def config(self, *args, **kwargs):
+		if args and args[0] == "mac":
+			return b"\xd4\x8c\x49\xfa\x8c\xc0"
+		if args and args[0] == "channel":
+			return 6
+		return None
+
+
+class Watchdog:
+	def __init__(self, clock: VirtualClock, timeout_ms: int) -> None:
+		self.clock = clock
+		self.timeout_us = timeout_ms * 1000
+		self.feed()
+
+	def feed(self) -> None:
+		self.deadline = self.clock.us + self.timeout_us
+
+	def check(self) -> None:
+		if self.clock.us > self.deadline:
+			raise WatchdogReset()
+
+
+class GIL:
+	"""
+	MicroPython's global interpreter lock for the threads of the firmware
+	(fake `_thread`): one thread runs at a time and hands over only where the
+	esp32 port releases the lock, in time.sleep()/sleep_ms() and blocking lock
+	acquires. time.sleep_us() busy-waits and keeps it. Threads ready to run
+	get the lock in turn.
+	"""
+
+	def __init__(self) -> None:
+		self._cond = threading.Condition()
+		self._owner = None
+		# threads ready to run, in turn
+		self._waiting: collections.deque = collections.deque()
+
+	def _take(self, me: int) -> None:
+		# with _cond held and `me` queued
+		self._cond.wait_for(lambda: self._owner is None and self._waiting and self._waiting[0] == me)
+		self._waiting.popleft()
+		self._owner = me
+
+	def acquire(self) -> None:
+		me = threading.get_ident()
+		with self._cond:
+			self._waiting.append(me)
+			self._take(me)
+
+	def release(self) -> None:
+		with self._cond:
+			if self._owner == threading.get_ident():
+				self._owner = None
+				self._cond.notify_all()
+
+	def pause(self) -> None:
+		"""Let the threads ready to run go first (time.sleep_ms())."""
+		me = threading.get_ident()
+		with self._cond:
+			if self._owner != me or not self._waiting:
+				return
+			self._owner = None
+			self._cond.notify_all()
+			self._waiting.append(me)
+			self._take(me)
+
+	def start(self, function, args, kwargs=None) -> int:
+		# the starting thread runs on, the new one waits for its turn
+		if self._owner is None:
+			self.acquire()
+
+		def run():
+			self.acquire()
+			try:
+				function(*args, **(kwargs or {}))
+			except Exception as exc:
+				print("Unhandled exception in thread started by", function, repr(exc))
+			finally:
+				self.release()
+
+		thread = threading.Thread(target=run, daemon=True)
+		thread.start()
+		return thread.ident
+
+
+class _Lock:
+	"""_thread lock: a thread blocking on it lets the others run and is
+	ready to run again as soon as the lock is released to it."""
+
+	def __init__(self, gil: GIL) -> None:
+		self._gil = gil
+		self._locked = False
+		self._blocked: collections.deque = collections.deque()
+
+	def acquire(self, waitflag: int = 1) -> bool:
+		gil = self._gil
+		me = threading.get_ident()
+		with gil._cond:
+			if not self._locked:
+				self._locked = True
+				return True
+			if not waitflag:
+				return False
+			self._blocked.append(me)
+			if gil._owner == me:
+				gil._owner = None
+				gil._cond.notify_all()
+			# release() hands the lock over and queues this thread
+			gil._take(me)
+			return True
+
+	def release(self) -> None:
+		gil = self._gil
+		with gil._cond:
+			if not self._locked:
+				raise RuntimeError("release unlocked lock")
+			if self._blocked:
+				# stays locked, now held by the first blocked thread
+				gil._waiting.append(self._blocked.popleft())
+				gil._cond.notify_all()
+			else:
+				self._locked = False
+
+	def locked(self) -> bool:
+		return self._locked
+
+	def __enter__(self) -> bool:
+		return self.acquire()
+
+	def __exit__(self, *exc) -> None:
+		self.release()
+
+
+class Simulator:
+	"""
+	Firmware wakes against simulated hardware. `overrides` maps dotted config
+	keys ("batch.enabled") to values applied after config.py is imported.
+	`current_a(us)` is the true current through the shunt at a simulated time;
+	`channel_currents` overrides it per channel name for multi-INA setups.
+	"""
+
+	def __init__(
+		self,
+		overrides: dict | None = None,
+		current_a=None,
+		channel_currents: dict | None = None,
+		bat_v: float = 4.0,
+		energy: EnergyModel | None = None,
+		boot_ms: float = 250.0,
+		assoc_ms: float = 700.0,
+		dhcp_ms: float = 1200.0,
+		scan_ms: float = 1500.0,
+		rtt_ms: float = 20.0,
+		ssid: str | None = None,
+		seed: int = 1,
+		flash_dir: Path | None = None,
+		import_cost: ImportCost | None = None,
+		verbose: bool = False,
+	) -> None:
+		self.overrides = overrides or {}
+		self.current_a = current_a or (lambda us: 0.0005)
+		# per channel name (config.ina226['channels']), default current_a
+		self.channel_currents = channel_currents or {}
+		self.bat_v = bat_v
+		self.energy = energy or EnergyModel()
+		self.boot_ms = boot_ms
+		self.assoc_ms = assoc_ms
+		self.dhcp_ms = dhcp_ms
+		self.scan_ms = scan_ms
+		self.ssid = ssid
+		self.verbose = verbose
+		self.rng = random.Random(seed)
+		self.flash_dir = Path(flash_dir or tempfile.mkdtemp(prefix="fwsim-"))
+		# None: imports take no simulated time
+		self.import_cost = import_cost
+		self._import_timer = _ImportTimer(self)
+		self.import_us = 0
+		self.first_i2c_us = None
+		# cycles of the running wake ended by a light sleep, see _light_sleep()
+		self._rows: list[dict] = []
+		self._cycle: dict = {}
+		self._faults = (frozenset(), frozenset(), frozenset())
+		self._run_start = 0
+		self._cycle_limit = None
+		self._log = io.StringIO()
+
+		self.clock = VirtualClock()
+		self.clock.load = self._load_ma
+		self.broker = Broker(self.clock, rtt_ms)
+		self.wlan = Station(self)
+		self.wlan_up = True
+		self.rtc_memory = b""
+		self.pins: dict = {}
+		# simulated INA226 by I2C address, all behind the same power switch
+		self.inas: dict[int, SimulatedINA226] = {}
+		self.ina_pwr_pin = None
+		self.cpu = "run"  # run, light, sleep
+		self.reset_cause = PWRON_RESET
+		self.wake_reason = TIMER_WAKE
+		# (pin, level) set by esp32.wake_on_ext0(); the pin wired to ALERT
+		self.ext0 = None
+		self.alert_pin = None
+		self.wakes = 0
+		self._saved_modules: dict = {}
+		self.gil = GIL()
+
+	# energy
+
+	def _load_ma(self) -> float:
+		e = self.energy
+		if self.cpu == "sleep":
+			ma = e.sleep_ua / 1000
+		elif self.cpu == "light":
+			ma = e.light_wlan_ma if self.wlan.isconnected() else e.light_ma
+		else:
+			ma = e.cpu_ma
+		if self.cpu == "run" and self.wlan.active():
+			ma += e.radio_ma
+		ma += sum(ina.supply_ma(e) for ina in self.inas.values())
+		return ma
+
+	# hardware seen through the fake modules
+
+	def _set_pin(self, pin, level: int) -> None:
+		self.pins[pin] = level
+		if pin == self.ina_pwr_pin:
+			# AO3401 P-MOSFET: gate low = INA226 powered
+			for ina in self.inas.values():
+				ina.power(level == 0)
+
+	def _modules(self) -> dict[str, types.ModuleType]:
+		sim = self
+		clock = self.clock
+
+		machine = types.ModuleType("machine")
+
+		class Pin:
+			IN = 1
+			OUT = 3
+			OPEN_DRAIN = 7
+			PULL_UP = 2
+			PULL_DOWN = 1
+			IRQ_RISING = 1
+			IRQ_FALLING = 2
+			WAKE_LOW = 4
+			WAKE_HIGH = 5
+
+			def __init__(self, pin, mode=-1, pull=-1, *, value=None, hold=None, **kwargs):
+				self.pin = pin
+				if value is not None:
+					sim._set_pin(pin, int(bool(value)))
+
+			def init(self, *args, value=None, **kwargs):
+				if value is not None:
+					sim._set_pin(self.pin, int(bool(value)))
+
+			def value(self, *args):
+				if args:
+					sim._set_pin(self.pin, int(bool(args[0])))
+					return None
+				return sim.pins.get(self.pin, 1)
+
+			__call__ = value
+
+			def on(self):
+				self.value(1)
+
+			def off(self):
+				self.value(0)
+
+			def irq(self, *args, **kwargs):
+				return None
+
+			def __repr__(self):
+				return "Pin(%s)" % self.pin
+
+		class ADC:
+			ATTN_0DB = 0
+			ATTN_2_5DB = 1
+			ATTN_6DB = 2
+			ATTN_11DB = 3
+			WIDTH_9BIT = 0
+			WIDTH_10BIT = 1
+			WIDTH_11BIT = 2
+			WIDTH_12BIT = 3
+
+			def __init__(self, pin, *args, **kwargs):
+				self.pin = pin
+
+			def atten(self, a):
+				pass
+
+			def width(self, w):
+				pass
+
+			def read_uv(self):
+				clock.advance(40)
+				# 1M/1M divider, a few mV of noise
+				return int((sim.bat_v / 2 + sim.rng.gauss(0, 0.003)) * 1_000_000)
+
+			def read(self):
+				return min(4095, max(0, round(self.read_uv() / 1_000_000 / 3.578 * 4095)))
+
+			def read_u16(self):
+				return self.read() << 4
+
+		class I2C:
+			def __init__(self, *args, freq=400000, **kwargs):
+				self.freq = freq
+
+			def _device(self, addr, nbytes):
+				if sim.first_i2c_us is None:
+					sim.first_i2c_us = clock.us
+				if sim._cycle.get("slept"):
+					# measuring again after a light sleep: the cycle is over
+					sim._end_light_cycle()
+				# START, address, register, (repeated START, address), data, STOP
+				clock.advance((nbytes + 3) * 9 * 1_000_000 / self.freq)
+				dev = sim.inas.get(addr)
+				if dev is None or not dev.powered:
+					raise OSError(19)  # ENODEV
+				return dev
+
+			def scan(self):
+				return sorted(addr for addr, ina in sim.inas.items() if ina.powered)
+
+			def writeto_mem(self, addr, reg, buf, **kwargs):
+				self._device(addr, len(buf)).writeto_mem(addr, reg, buf)
+
+			def readfrom_mem_into(self, addr, reg, buf, **kwargs):
+				self._device(addr, len(buf)).readfrom_mem_into(addr, reg, buf)
+
+			def readfrom_mem(self, addr, reg, n, **kwargs):
+				buf = bytearray(n)
+				self.readfrom_mem_into(addr, reg, buf)
+				return bytes(buf)
+
+		class RTC:
+			def memory(self, *args):
+				if args:
+					data = args[0].encode() if isinstance(args[0], str) else bytes(args[0])
+					if len(data) > 2048:
+						raise ValueError("buffer too long")
+					sim.rtc_memory = data
+					return None
+				return sim.rtc_memory
+
+			def datetime(self, *args):
+				return None
+
+		class WDT:
+			def __init__(self, id=0, timeout=5000):
+				clock.watchdog = Watchdog(clock, timeout)
+
+			def feed(self):
+				clock.watchdog.feed()
+
+		def deepsleep(ms=None):
+			raise DeepSleep(ms)
+
+		def lightsleep(ms=None):
+			sim._light_sleep(ms or 0)
+
+		machine.Pin = Pin
+		machine.ADC = ADC
+		machine.I2C = I2C
+		machine.SoftI2C = I2C
+		machine.RTC = RTC
+		machine.WDT = WDT
+		machine.deepsleep = deepsleep
+		machine.lightsleep = lightsleep
+		machine.idle = lambda: clock.advance(1000)
+		machine.unique_id = lambda: b"\xd4\x8c\x49\xfa\x8c\xc0"
+		machine.reset_cause = lambda: sim.reset_cause
+		machine.wake_reason = lambda: sim.wake_reason if sim.reset_cause == DEEPSLEEP_RESET else 0
+		machine.freq = lambda *args: 160_000_000
+		machine.PWRON_RESET = PWRON_RESET
+		machine.HARD_RESET = 2
+		machine.WDT_RESET = WDT_RESET
+		machine.DEEPSLEEP_RESET = DEEPSLEEP_RESET
+		machine.SOFT_RESET = 5
+		machine.PIN_WAKE = machine.EXT0_WAKE = EXT0_WAKE
+		machine.EXT1_WAKE = 3
+		machine.TIMER_WAKE = TIMER_WAKE
+
+		esp32 = types.ModuleType("esp32")
+		esp32.gpio_deep_sleep_hold = lambda enable: None
+		esp32.wake_on_ext0 = lambda pin, level: setattr(sim, "ext0", (getattr(pin, "pin", pin), level))
+		esp32.wake_on_ext1 = lambda pins, level: None
+		esp32.WAKEUP_ALL_LOW = False
+		esp32.WAKEUP_ANY_HIGH = True
+
+		micropython = types.ModuleType("micropython")
+		micropython.const = lambda x: x
+		micropython.alloc_emergency_exception_buf = lambda n: None
+		micropython.opt_level = lambda *args: 0
+		micropython.mem_info = lambda *args: None
+
+		network = types.ModuleType("network")
+		network.STA_IF = 0
+		network.AP_IF = 1
+		network.STAT_IDLE = 1000
+		network.STAT_CONNECTING = 1001
+		network.STAT_GOT_IP = 1010
+		network.WLAN = lambda interface=0: sim.wlan
+
+		socket = types.ModuleType("socket")
+		socket.socket = lambda *args: FakeSocket(sim, *args)
+		socket.getaddrinfo = lambda host, port, *args: [(2, 1, 0, "", (host, port))]
+		socket.AF_INET = 2
+		socket.SOCK_STREAM = 1
+		socket.SOL_SOCKET = 1
+		socket.SO_REUSEADDR = 4
+
+		select = types.ModuleType("select")
+		select.poll = lambda: FakePoll(clock)
+		select.POLLIN = POLLIN
+		select.POLLOUT = POLLOUT
+		select.POLLERR = POLLERR
+		select.POLLHUP = POLLHUP
+
+		import binascii as _binascii
+		binascii = types.ModuleType("binascii")
+		binascii.__dict__.update({k: getattr(_binascii, k) for k in dir(_binascii) if not k.startswith("_")})
+		# MicroPython accepts str buffers as well
+		binascii.hexlify = lambda data, *args: _binascii.hexlify(data.encode() if isinstance(data, str) else data, *args)
+
+		import time as _time
+		time = types.ModuleType("time")
+		time.__dict__.update({k: getattr(_time, k) for k in dir(_time) if not k.startswith("_")})
+		for name in ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add", "sleep", "sleep_ms", "sleep_us", "time"):
+			setattr(time, name, getattr(clock, name))
+		time.ticks_cpu = clock.ticks_us
+		gil = self.gil
+
+		def sleep_ms(ms):
+			clock.sleep_ms(ms)
+			gil.pause()
+
+		def sleep(s):
+			clock.sleep(s)
+			gil.pause()
+
+		time.sleep_ms = sleep_ms
+		time.sleep = sleep
+		time.time_ns = lambda: int(clock.time() * 1e9)
+		time.localtime = lambda secs=None: _time.gmtime(clock.time() if secs is None else secs)[:8]
+		time.gmtime = time.localtime
+
+		_thread = types.ModuleType("_thread")
+		_thread.allocate_lock = lambda: _Lock(gil)
+		_thread.start_new_thread = gil.start
+		_thread.get_ident = threading.get_ident
+
+		return {
+			"machine": machine,
+			"esp32": esp32,
+			"micropython": micropython,
+			"network": network,
+			"socket": socket,
+			"select": select,
+			"binascii": binascii,
+			"time": time,
+			"_thread": _thread,
+		}
+
+	# module juggling
+
+	def __enter__(self) -> "Simulator":
+		self.install()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.uninstall()
+
+	def install(self) -> None:
+		"""Put the fake modules and the firmware directory on the import path."""
+		for name, module in self._modules().items():
+			self._saved_modules[name] = sys.modules.get(name)
+			sys.modules[name] = module
+		sys.path.insert(0, str(FIRMWARE_DIR))
+		sys.meta_path.insert(0, self._import_timer)
+
+	def uninstall(self) -> None:
+		# threads the firmware left behind may finish
+		self.gil.release()
+		self._unload_firmware()
+		for name, module in self._saved_modules.items():
+			if module is None:
+				sys.modules.pop(name, None)
+			else:
+				sys.modules[name] = module
+		self._saved_modules.clear()
+		with contextlib.suppress(ValueError):
+			sys.path.remove(str(FIRMWARE_DIR))
+		with contextlib.suppress(ValueError):
+			sys.meta_path.remove(self._import_timer)
+
+	def _charge_import(self, source: Path) -> None:
+		if self.import_cost is None:
+			return
+		us = int(self.import_cost.ms(source) * 1000)
+		self.clock.advance(us)
+		self.import_us += us
+
+	@staticmethod
+	def _unload_firmware() -> None:
+		for name, module in list(sys.modules.items()):
+			paths = [getattr(module, "__file__", None)] + list(getattr(module, "__path__", []) or [])
+			if any(p and Path(p).resolve().is_relative_to(FIRMWARE_DIR) for p in paths):
+				del sys.modules[name]
+
+	def import_firmware(self, name: str):
+		"""Import a firmware module (e.g. 'config', 'lib.ina226') with overrides applied to config."""
+		module = importlib.import_module(name)
+		if name == "config":
+			self._apply_overrides(module)
+		return module
+
+	def _apply_overrides(self, config) -> None:
+		# files the firmware keeps on flash
+		for section in ("journal", "remote"):
+			cfg = getattr(config, section, None)
+			if isinstance(cfg, dict) and "path" in cfg:
+				cfg["path"] = str(self.flash_dir / Path(cfg["path"]).name)
+		for key, value in self.overrides.items():
+			section, *path = key.split(".")
+			if not path:
+				setattr(config, section, value)
+				continue
+			target = getattr(config, section)
+			for part in path[:-1]:
+				target = target[part]
+			target[path[-1]] = value
+
+	def _attach_ina(self, config) -> None:
+		"""One simulated INA226 per configured address (ina226['channels'] or ina_addr)."""
+		cfg = config.ina226
+		self.ina_pwr_pin = cfg.get("pwr_pin")
+		channels = cfg.get("channels") or [{"name": None, "addr": cfg["ina_addr"]}]
+		for ch in channels:
+			if ch["addr"] in self.inas:
+				continue
+			r_shunt = ch.get("r_shunt_mohm", cfg["r_shunt_mohm"]) / 1000
+			current_a = self.channel_currents.get(ch["name"], self.current_a)
+			ina = SimulatedINA226(self.clock, r_shunt, current_a, seed=self.rng.randrange(1 << 30))
+			# powered unless the MOSFET pin was driven high before
+			ina.powered = self.pins.get(self.ina_pwr_pin, 0) == 0
+			self.inas[ch["addr"]] = ina
+		alert = getattr(config, "alert", None)
+		self.alert_pin = alert.get("pin") if isinstance(alert, dict) else None
+		if self.ssid is None:
+			self.ssid = config.wlan["ssid"]
+
+	# wakes
+
+	def wake(self) -> list[dict]:
+		"""Boot, run main.py until deepsleep and sleep. Returns the figures per
+		cycle: one for every light sleep cycle of the firmware (outcome "light",
+		see _light_sleep()), then the wake's own."""
+		clock = self.clock
+		clock.boot_us = clock.us
+		clock.watchdog = None
+		self.cpu = "run"
+		self.ext0 = None
+		self.wlan.reset()
+		self._rows = []
+		self._log = io.StringIO()
+		# the previous deepsleep ended by the timer or the ALERT line (_sleep())
+		woke = None
+		if self.reset_cause == DEEPSLEEP_RESET:
+			woke = "alert" if self.wake_reason == EXT0_WAKE else "timer"
+		self._begin_cycle(woke)
+		outcome = "return"
+		sleep_ms = None
+		error = None
+		self.import_us = 0
+		self.first_i2c_us = None
+
+		self._unload_firmware()
+		clock.advance(self.boot_ms * 1000)
+		try:
+			with contextlib.redirect_stdout(sys.stdout if self.verbose else self._log):
+				self._attach_ina(self.import_firmware("config"))
+				# main.py is compiled from source on every boot
+				self._charge_import(FIRMWARE_DIR / "main.py")
+				runpy.run_path(str(FIRMWARE_DIR / "main.py"), run_name="__main__")
+		except DeepSleep as exc:
+			sleep_ms = exc.ms
+			outcome = "sleep" if exc.ms is not None else "forever"
+		except WatchdogReset:
+			outcome = "wdt"
+		except CycleLimit:
+			# run() has all its cycles, stop in the middle of the wake
+			return self._rows
+		except Exception as exc:
+			outcome = "error"
+			error = repr(exc)
+
+		row = self._cycle_row(outcome, error)
+
+		# deepsleep: RTC memory, pin levels (held) and the INA226 power state stay
+		self.wlan.reset()
+		clock.watchdog = None
+		self.wake_reason = TIMER_WAKE
+		if sleep_ms:
+			self.cpu = "sleep"
+			before = clock.charge_nas
+			sleep_ms = self._sleep(sleep_ms)
+			row["sleep_s"] += sleep_ms / 1000
+			row["sleep_uAh"] += (clock.charge_nas - before) / 3.6e6
+			self.cpu = "run"
+
+		self.reset_cause = {"sleep": DEEPSLEEP_RESET, "wdt": WDT_RESET}.get(outcome, PWRON_RESET)
+		self.wakes += 1
+		return self._rows + [row]
+
+	def _i2c(self) -> int:
+		return sum(ina.i2c_transactions for ina in self.inas.values())
+
+	def _begin_cycle(self, woke: str | None) -> None:
+		"""Start the figures of a cycle; `woke` is what ended the sleep before
+		it ("timer", "alert"), None after a reset."""
+		clock = self.clock
+		self._cycle = {"us": clock.us, "nas": clock.charge_nas, "msgs": len(self.broker.messages),
+			"i2c": self._i2c(), "log": self._log.tell(), "sleep_us": 0, "sleep_nas": 0.0, "slept": False,
+			"woke": woke}
+
+	def _cycle_row(self, outcome: str, error: str | None = None) -> dict:
+		"""Figures of the cycle so far. Light sleep counts as sleep, import and
+		first I2C only for the first cycle after reset."""
+		c = self._cycle
+		clock = self.clock
+		first = not self._rows
+		msgs = self.broker.messages[c["msgs"]:]
+		return {
+			"wake": self.wakes + 1,
+			"outcome": outcome,
+			"awake_ms": (clock.us - c["us"] - c["sleep_us"]) / 1000,
+			"sleep_s": c["sleep_us"] / 1e6,
+			"woke": c["woke"],
+			"import_ms": self.import_us / 1000 if first else 0.0,
+			"first_i2c_ms": None if not first or self.first_i2c_us is None else (self.first_i2c_us - c["us"]) / 1000,
+			"i2c": self._i2c() - c["i2c"],
+			"awake_uAh": (clock.charge_nas - c["nas"] - c["sleep_nas"]) / 3.6e6,
+			"sleep_uAh": c["sleep_nas"] / 3.6e6,
+			"messages": len(msgs),
+			"bytes": sum(len(m["payload"]) for m in msgs),
+			"error": error,
+			"log": self._log.getvalue()[c["log"]:],
+		}
+
+	def _light_sleep(self, ms: int) -> None:
+		"""machine.lightsleep(): WLAN stays associated if it was. The cycle ends
+		with the next I2C transfer, i.e. the next measurement, so a sleep split
+		into several calls (watchdog, MQTT pings) still counts once."""
+		c = self._cycle
+		clock = self.clock
+		before_us, before_nas = clock.us, clock.charge_nas
+		self.cpu = "light"
+		try:
+			clock.sleep_ms(ms)
+		finally:
+			self.cpu = "run"
+			c["sleep_us"] += clock.us - before_us
+			c["sleep_nas"] += clock.charge_nas - before_nas
+			c["slept"] = True
+
+	def _end_light_cycle(self) -> None:
+		self._rows.append(self._cycle_row("light"))
+		self.wakes += 1
+		# lightsleep() has no ALERT wake in the simulation
+		self._begin_cycle("timer")
+		self._apply_faults()
+		if self._cycle_limit is not None and self.wakes >= self._cycle_limit:
+			raise CycleLimit()
+
+	def _apply_faults(self) -> None:
+		"""WLAN and broker state of the next cycle (1-based within run())."""
+		wlan_down, broker_down, broker_mute = self._faults
+		i = self.wakes + 1 - self._run_start
+		self.wlan_up = i not in wlan_down
+		self.broker.up = i not in broker_down
+		self.broker.mute = i in broker_mute
+
+	def _sleep(self, ms: int) -> int:
+		"""Deepsleep for ms or until the ALERT line wakes the MCU (ext0). Returns the ms slept."""
+		clock = self.clock
+		if self.ext0 is None or self.ext0[0] != self.alert_pin:
+			clock.advance(ms * 1000)
+			return ms
+		end = clock.us + ms * 1000
+		start = clock.us
+		# the INA226 keeps converting; look at the ALERT line once per second
+		while clock.us < end:
+			clock.advance(min(1_000_000, end - clock.us))
+			for ina in self.inas.values():
+				ina.poll()
+			# open-drain, active low, wired-OR
+			if any(ina.alert_asserted for ina in self.inas.values()) == (not self.ext0[1]):
+				self.wake_reason = EXT0_WAKE
+				break
+		return (clock.us - start) // 1000
+
+	def run(self, wakes: int, wlan_down: set[int] = frozenset(), broker_down: set[int] = frozenset(),
+			broker_mute: set[int] = frozenset()) -> list[dict]:
+		"""Run `wakes` consecutive cycles, deep or light sleep (1-based indices in
+		`wlan_down` / `broker_down` fail, in `broker_mute` the broker accepts
+		connections but does not answer)."""
+		results = []
+		self._faults = (frozenset(wlan_down), frozenset(broker_down), frozenset(broker_mute))
+		self._run_start = self.wakes
+		self._cycle_limit = self.wakes + wakes
+		try:
+			with self:
+				while self.wakes < self._cycle_limit:
+					self._apply_faults()
+					results.extend(self.wake())
+					if results[-1]["outcome"] not in ("sleep", "wdt", "light"):
+						break
+		finally:
+			self._cycle_limit = None
+		return results
+
+	def stream(self, frames: int, sink_ms: float = 0.0, rate_hz: int | None = None,
+			frame_ms: int | None = None) -> dict:
+		"""Power the INA226 and run CurrentReader.run() (config.stream) for
+		`frames` frames. The sink stands in for stream.Sender: it keeps each
+		frame and waits `sink_ms` for the network. Returns the frames and
+		dropped counts of run() and the frames the sink got."""
+		sent = []
+		self.clock.boot_us = self.clock.us
+		self._log = io.StringIO()
+
+		def sink(frame):
+			sent.append(bytes(frame))
+			if sink_ms:
+				sys.modules["time"].sleep_ms(sink_ms)
+
+		with self, contextlib.redirect_stdout(sys.stdout if self.verbose else self._log):
+			self._unload_firmware()
+			self._attach_ina(self.import_firmware("config"))
+			reader = self.import_firmware("current_reader").CurrentReader()
+			reader.pwr(True)
+			try:
+				done, dropped = reader.run(rate_hz=rate_hz, frame_ms=frame_ms, sink=sink, frames=frames)
+			finally:
+				reader.pwr(False)
+		return {"frames": done, "dropped": dropped, "sent": sent}
+
+
+@dataclass
+class Summary:
+	wakes: int = 0
+	awake_ms: float = 0.0
+	charge_uAh: float = 0.0
+	period_s: float = 0.0
+	avg_current_uA: float = 0.0
+	outcomes: dict = field(default_factory=dict)
+
+
+def summarize(results: list[dict]) -> Summary:
+	"""Means per cycle (awake + following sleep) and the average supply current."""
+	s = Summary(wakes=len(results))
+	if not results:
+		return s
+	s.awake_ms = sum(r["awake_ms"] for r in results) / len(results)
+	s.charge_uAh = sum(r["awake_uAh"] + r["sleep_uAh"] for r in results) / len(results)
+	s.period_s = sum(r["awake_ms"] / 1000 + r["sleep_s"] for r in results) / len(results)
+	if s.period_s:
+		s.avg_current_uA = s.charge_uAh * 3600 / s.period_s
+	for r in results:
+		s.outcomes[r["outcome"]] = s.outcomes.get(r["outcome"], 0) + 1
+	return s
+
+
+def parse_overrides(items: list[str]) -> dict:
+	"""Simulator overrides from `--set key=value` arguments (values are Python literals)."""
+	overrides = {}
+	for item in items:
+		key, sep, value = item.partition("=")
+		if not sep:
+			raise ValueError(f"--set needs key=value, got '{item}'")
+		try:
+			overrides[key] = ast.literal_eval(value)
+		except (ValueError, SyntaxError):
+			# bare strings
+			overrides[key] = value
+	return overrides
@@ -0,0 +1,128 @@
+"""mqtt-async-check.py
+
+Run the asyncio MQTT client of the firmware (lib/umqttasync.py) under
+CPython against the simulator's broker stand-in (fwsim.Broker on a local
+TCP port) and check that it
+
+  - publishes QoS 1 messages one by one and with several in flight, every
+    message arriving once and in order
+  - receives a retained message after subscribe
+  - keeps a concurrent task (the sampling loop on the device) running while
+    it waits for the broker
+  - raises OSError(ETIMEDOUT) when the broker stops answering
+
+and how long the publishes take with and without a window of messages in
+flight at the given broker round trip time.
+
+Usage examples:
+  python mqtt-async-check.py
+  python mqtt-async-check.py --messages 100 --inflight 8 --rtt-ms 50
+
+Exits with 1 if a check fails.
+
+Requirements: none
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import errno
+import logging
+import sys
+import time
+
+from fwsim import FIRMWARE_DIR, Broker, VirtualClock, serve_broker
+
+sys.path.insert(0, str(FIRMWARE_DIR / "lib"))
+from umqttasync import MQTTClient  # noqa: E402
+
+TOPIC = "ct/check"
+
+
+async def ticker(period_s: float, ticks: list[int]) -> None:
+	"""Stand-in for sampling: counts how often it gets to run."""
+	while True:
+		await asyncio.sleep(period_s)
+		ticks[0] += 1
+
+
+async def publish_all(client: MQTTClient, messages: int, wait: bool) -> float:
+	start = time.perf_counter()
+	for i in range(messages):
+		await client.publish(TOPIC, str(i), qos=1, wait=wait)
+	await client.acked()
+	return time.perf_counter() - start
+
+
+async def check(args: argparse.Namespace) -> list[str]:
+	failures = []
+	broker = Broker(VirtualClock(), args.rtt_ms)
+	broker.retain("ct/config/check", b'{"v": 1}')
+	server = await serve_broker(broker)
+	port = server.sockets[0].getsockname()[1]
+
+	client = MQTTClient("check", "127.0.0.1", port=port, keepalive=30, max_inflight=args.inflight, timeout=2)
+	await client.connect()
+	ticks = [0]
+	tick_task = asyncio.create_task(ticker(0.005, ticks))
+
+	rows = []
+	for name, wait in (("one by one", True), (f"{args.inflight} in flight", False)):
+		before = len(broker.messages)
+		ticks[0] = 0
+		seconds = await publish_all(client, args.messages, wait)
+		got = [m["payload"].decode() for m in broker.messages[before:]]
+		if got != [str(i) for i in range(args.messages)]:
+			failures.append(f"{name}: broker got {len(got)} messages, expected {args.messages} in order")
+		if not ticks[0]:
+			failures.append(f"{name}: the concurrent task did not run")
+		rows.append((name, seconds, ticks[0]))
+
+	await client.subscribe("ct/config/check", qos=1)
+	try:
+		op, topic, msg = await asyncio.wait_for(client.wait_msg(), 2)
+		if (topic, msg) != ("ct/config/check", '{"v": 1}'):
+			failures.append(f"subscribe: got {topic} {msg!r}")
+	except asyncio.TimeoutError:
+		failures.append("subscribe: retained message not received")
+
+	broker.mute = True
+	try:
+		await client.publish(TOPIC, "muted", qos=1)
+		failures.append("muted broker: publish returned")
+	except OSError as exc:
+		if exc.args[0] != errno.ETIMEDOUT:
+			failures.append(f"muted broker: {exc!r}")
+	broker.mute = False
+
+	tick_task.cancel()
+	await client.disconnect()
+	server.close()
+	await server.wait_closed()
+
+	header = f"{'publish':<14} {'messages':>8} {'s':>7} {'ms/msg':>7} {'ticks':>6}"
+	print(header)
+	print("-" * len(header))
+	for name, seconds, n in rows:
+		print(f"{name:<14} {args.messages:>8} {seconds:>7.3f} {seconds * 1000 / args.messages:>7.2f} {n:>6}")
+	return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Check lib/umqttasync.py against a local broker stand-in")
+	parser.add_argument("--messages", type=int, default=40, help="QoS 1 messages per run")
+	parser.add_argument("--inflight", type=int, default=4, help="Messages in flight (max_inflight)")
+	parser.add_argument("--rtt-ms", type=float, default=20.0, help="Broker round trip time")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	failures = asyncio.run(check(args))
+	for f in failures:
+		logging.error(f)
+	return 1 if failures else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,88 @@
+"""power-benchmark.py
+
+Compare the INA226 power strategies of the firmware (config.ina226['power']):
+
+  switch     supply cut with the AO3401 MOSFET during deepsleep; every wake
+             waits pwr_on_delay_ms and calibrates the chip again
+  powerdown  chip stays powered in its power-down mode (~2 uA) and keeps its
+             registers; a wake checks the calibration register and writes
+             the config register
+
+Usage examples:
+  python power-benchmark.py
+  python power-benchmark.py --wakes 20 --set ina226.interval_seconds=300
+  python power-benchmark.py --ina-pd-ua 0.5 --set batch.enabled=True
+
+The first wake after power-on initialises the chip in both strategies and is
+left out of the means. "sleep uA" is the mean supply current while sleeping
+(board + INA226), "ina ms" the time from reset until the first I2C transfer.
+
+Requirements: none
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import statistics
+import sys
+
+from fwsim import EnergyModel, Simulator, parse_overrides, summarize
+
+STRATEGIES = ("switch", "powerdown")
+
+
+def benchmark(strategy: str, overrides: dict, wakes: int, energy: EnergyModel) -> dict:
+	sim = Simulator(overrides={**overrides, "ina226.power": strategy}, energy=energy)
+	results = sim.run(wakes + 1)
+	for r in results:
+		if r["error"]:
+			logging.warning("%s, wake %d: %s", strategy, r["wake"], r["error"])
+	steady = results[1:] or results
+	summary = summarize(steady)
+	sleep_s = sum(r["sleep_s"] for r in steady)
+	return {
+		"strategy": strategy,
+		"first_i2c_ms": statistics.mean(r["first_i2c_ms"] or 0.0 for r in steady),
+		"i2c": statistics.mean(r["i2c"] for r in steady),
+		"awake_ms": summary.awake_ms,
+		"sleep_ua": sum(r["sleep_uAh"] for r in steady) * 3600 / sleep_s if sleep_s else float("nan"),
+		"charge_uAh": summary.charge_uAh,
+		"avg_ua": summary.avg_current_uA,
+	}
+
+
+def print_table(rows: list[dict]) -> None:
+	header = (f"{'strategy':<10} {'ina ms':>7} {'i2c/wake':>9} {'awake ms':>9} {'sleep uA':>9} "
+		f"{'uAh/cycle':>10} {'avg uA':>8}")
+	print(header)
+	print("-" * len(header))
+	for r in rows:
+		print(f"{r['strategy']:<10} {r['first_i2c_ms']:>7.1f} {r['i2c']:>9.1f} {r['awake_ms']:>9.1f} "
+			f"{r['sleep_ua']:>9.2f} {r['charge_uAh']:>10.3f} {r['avg_ua']:>8.1f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Wake latency and sleep current of the INA226 power strategies")
+	parser.add_argument("--wakes", type=int, default=10, help="Wake cycles per strategy (after the power-on wake)")
+	parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+						help="Config override, e.g. ina226.pwr_on_delay_ms=50 (repeatable)")
+	parser.add_argument("--sleep-ua", type=float, default=EnergyModel.sleep_ua, help="Deepsleep current of the board")
+	parser.add_argument("--ina-ma", type=float, default=EnergyModel.ina_ma, help="INA226 supply current while active")
+	parser.add_argument("--ina-pd-ua", type=float, default=EnergyModel.ina_pd_ua, help="INA226 supply current in power-down mode")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	try:
+		overrides = parse_overrides(args.overrides)
+	except ValueError as exc:
+		parser.error(str(exc))
+
+	energy = EnergyModel(sleep_ua=args.sleep_ua, ina_ma=args.ina_ma, ina_pd_ua=args.ina_pd_ua)
+	print_table([benchmark(s, overrides, args.wakes, energy) for s in STRATEGIES])
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
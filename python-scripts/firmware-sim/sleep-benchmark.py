@@ -0,0 +1,93 @@
+"""sleep-benchmark.py
+
+Compare the sleep modes of the firmware (config.sleep['mode'], planner.py)
+over a range of measurement intervals:
+
+  deep   deepsleep after every measurement; every wake boots, reconnects
+         WLAN and opens a new MQTT session
+  light  machine.lightsleep() with WLAN associated and the MQTT session kept
+  auto   the planner's choice from its energy model and measured awake times
+
+Usage examples:
+  python sleep-benchmark.py
+  python sleep-benchmark.py --intervals 10 30 60 300 --cycles 20
+  python sleep-benchmark.py --set ina226.profile=fast --light-wlan-ma 1.2
+
+The means are over the steady state: the first two cycles are left out, the
+power-on wake (full scan + DHCP) and the first deep wake with fast reconnect,
+which auto needs to measure a deep cycle. "light" is the share of light
+sleep cycles. sleep.boot_ms is set to 0: the simulated ticks_ms() count from
+reset, on the device they start after the bootloader. Compare the auto rows against deep and light to check the
+planner's energy model (sleep.cpu_ma, sleep.radio_ma, sleep.light_ua)
+against the simulator's (--light-wlan-ma).
+
+Requirements: none
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+
+from fwsim import EnergyModel, Simulator, parse_overrides, summarize
+
+MODES = ("deep", "light", "auto")
+# cycles left out of the means, see above
+WARMUP = 2
+
+
+def benchmark(mode: str, interval: int, overrides: dict, cycles: int, energy: EnergyModel) -> dict:
+	overrides = {"sleep.boot_ms": 0, **overrides, "sleep.mode": mode, "ina226.interval_seconds": interval}
+	sim = Simulator(overrides=overrides, energy=energy)
+	results = sim.run(cycles + WARMUP)
+	for r in results:
+		if r["error"]:
+			logging.warning("%s, %d s, cycle %d: %s", mode, interval, r["wake"], r["error"])
+	steady = results[WARMUP:] or results
+	summary = summarize(steady)
+	return {
+		"mode": mode,
+		"interval": interval,
+		"light": sum(r["outcome"] == "light" for r in steady) / len(steady),
+		"awake_ms": summary.awake_ms,
+		"charge_uAh": summary.charge_uAh,
+		"avg_ua": summary.avg_current_uA,
+	}
+
+
+def print_table(rows: list[dict]) -> None:
+	header = f"{'interval s':>10} {'mode':<6} {'light':>6} {'awake ms':>9} {'uAh/cycle':>10} {'avg uA':>8}"
+	print(header)
+	print("-" * len(header))
+	for r in rows:
+		print(f"{r['interval']:>10} {r['mode']:<6} {r['light']:>6.0%} {r['awake_ms']:>9.1f} "
+			f"{r['charge_uAh']:>10.3f} {r['avg_ua']:>8.1f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Charge per cycle of deep and light sleep over the measurement interval")
+	parser.add_argument("--intervals", type=int, nargs="+", default=[10, 30, 60, 120, 300],
+						help="Measurement intervals in s")
+	parser.add_argument("--cycles", type=int, default=10, help="Cycles per mode and interval (after the warm-up)")
+	parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+						help="Config override, e.g. ina226.profile=fast (repeatable)")
+	parser.add_argument("--sleep-ua", type=float, default=EnergyModel.sleep_ua, help="Deepsleep current of the board")
+	parser.add_argument("--light-wlan-ma", type=float, default=EnergyModel.light_wlan_ma,
+						help="Lightsleep current with WLAN associated")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	try:
+		overrides = parse_overrides(args.overrides)
+	except ValueError as exc:
+		parser.error(str(exc))
+
+	energy = EnergyModel(sleep_ua=args.sleep_ua, light_wlan_ma=args.light_wlan_ma)
+	print_table([benchmark(m, i, overrides, args.cycles, energy) for i in args.intervals for m in MODES])
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,84 @@
+"""stream-check.py
+
+Run CurrentReader.run() of the firmware (config.stream, stream.py) in the
+simulator, with triggered and with continuous INA226 conversions, and a sink
+that takes --sink-ms per frame, and check that
+
+  - no frame is dropped: the sampling loop sleeps with time.sleep_ms(),
+    which releases the GIL, so the sender thread gets to run
+  - the sink gets every frame in sequence with the configured number of
+    samples
+
+The simulator runs the firmware's threads one at a time like the GIL of
+the esp32 port (fwsim.GIL).
+
+Usage examples:
+  python stream-check.py
+  python stream-check.py --rate-hz 100 --frame-ms 200 --frames 10 --sink-ms 5
+
+Exits with 1 if a check fails.
+
+Requirements: none
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from fwsim import Simulator, parse_overrides
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "payload"))
+from ctbin import decode_frame  # noqa: E402
+
+
+def check(result: dict, frames: int, per_frame: int) -> list[str]:
+	failures = []
+	if result["frames"] != frames:
+		failures.append(f"run() returned after {result['frames']} of {frames} frames")
+	if result["dropped"]:
+		failures.append(f"{result['dropped']} of {result['frames']} frames dropped")
+	decoded = [decode_frame(f) for f in result["sent"]]
+	seqs = [d["seq"] for d in decoded]
+	if seqs != list(range(frames)):
+		failures.append(f"sink got frames {seqs}, expected 0..{frames - 1}")
+	short = [d["seq"] for d in decoded if len(d["samples"]) != per_frame]
+	if short:
+		failures.append(f"frames {short} do not hold {per_frame} samples")
+	return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Check that streaming with a fast sink drops no frames")
+	parser.add_argument("--rate-hz", type=int, default=100, help="Sample rate")
+	parser.add_argument("--frame-ms", type=int, default=200, help="Frame length")
+	parser.add_argument("--frames", type=int, default=10, help="Frames to stream")
+	parser.add_argument("--sink-ms", type=float, default=2.0, help="Time the sink takes per frame")
+	parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+						help="Config override, e.g. stream.profile=balanced (repeatable)")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	try:
+		overrides = parse_overrides(args.overrides)
+	except ValueError as exc:
+		parser.error(str(exc))
+
+	per_frame = args.frame_ms * 1000 // (1000000 // args.rate_hz)
+	failures = []
+	for mode, triggered in (("triggered", True), ("continuous", False)):
+		sim = Simulator(overrides={"ina226.triggered": triggered, **overrides})
+		result = sim.stream(args.frames, args.sink_ms, args.rate_hz, args.frame_ms)
+		print(f"{mode:<10} {result['frames']} frames at {args.rate_hz} Hz, {len(result['sent'])} sent, "
+			f"{result['dropped']} dropped, {sim.clock.ticks_ms()} ms")
+		failures += [f"{mode}: {f}" for f in check(result, args.frames, per_frame)]
+	for f in failures:
+		logging.error(f)
+	return 1 if failures else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
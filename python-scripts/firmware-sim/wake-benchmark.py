@@ -0,0 +1,156 @@
+"""wake-benchmark.py
+
+Run full wake cycles of the firmware (main.py) under CPython against simulated
+hardware (see fwsim.py) and report the simulated awake time and the estimated
+charge per cycle.
+
+Usage examples:
+  python wake-benchmark.py
+  python wake-benchmark.py --wakes 20 --set batch.enabled=True --set batch.size=5
+  python wake-benchmark.py --wlan-down 3 4 --set mqtt.format="'bin'"
+  python wake-benchmark.py --broker-mute 2 --set mqtt.budget_ms=1500
+  python wake-benchmark.py --max-awake-ms 2500 --quiet    # regression check
+  python wake-benchmark.py --set alert.enabled=True --event 5000 120 0.02
+
+`--set` takes a dotted config key and a Python literal; it is applied after
+config.py is imported on every wake. `--max-awake-ms` / `--max-charge-uah`
+make the script exit with status 1 if the mean per cycle exceeds the limit,
+so a firmware change can be checked against a known-good figure.
+
+Requirements: none (pandas only for --trace)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+from dataclasses import asdict
+from pathlib import Path
+
+from fwsim import EnergyModel, Simulator, parse_overrides, summarize
+
+
+def load_trace(path: Path) -> list[float]:
+	import pandas as pd
+
+	df = pd.read_csv(path, comment="#")
+	if "_field" in df.columns:
+		df = df[df["_field"] == "current_A"]
+		values = df["_value"]
+	else:
+		values = df["current_A"]
+	values = pd.to_numeric(values, errors="coerce").dropna()
+	if values.empty:
+		raise RuntimeError(f"No current_A values in '{path}'")
+	return values.tolist()
+
+
+def print_table(results: list[dict]) -> None:
+	header = f"{'wake':>4} {'outcome':<8} {'woke':<6} {'awake ms':>9} {'sleep s':>8} {'awake uAh':>10} {'sleep uAh':>10} {'msgs':>5} {'bytes':>6}"
+	print(header)
+	print("-" * len(header))
+	for r in results:
+		print(f"{r['wake']:>4} {r['outcome']:<8} {r['woke'] or '-':<6} {r['awake_ms']:>9.1f} {r['sleep_s']:>8.1f} "
+			f"{r['awake_uAh']:>10.3f} {r['sleep_uAh']:>10.3f} {r['messages']:>5} {r['bytes']:>6}")
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Simulated wake cycles of the firmware: awake time and charge")
+	parser.add_argument("--wakes", type=int, default=10, help="Number of wake cycles")
+	parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+						help="Config override, e.g. batch.enabled=True (repeatable)")
+	parser.add_argument("--current", type=float, default=0.0005, help="Constant true current in A")
+	parser.add_argument("--trace", type=Path, help="InfluxDB CSV export to replay current_A from (one value per minute)")
+	parser.add_argument("--event", type=float, nargs=3, action="append", default=[], metavar=("START_S", "DURATION_S", "AMPS"),
+						help="Current of AMPS from START_S for DURATION_S simulated seconds (repeatable)")
+	parser.add_argument("--bat", type=float, default=4.0, help="Battery voltage in V")
+	parser.add_argument("--wlan-down", type=int, nargs="*", default=[], metavar="N", help="Wakes (1-based) without WLAN")
+	parser.add_argument("--broker-down", type=int, nargs="*", default=[], metavar="N", help="Wakes (1-based) without MQTT broker")
+	parser.add_argument("--broker-mute", type=int, nargs="*", default=[], metavar="N",
+						help="Wakes (1-based) where the broker accepts the connection but never answers")
+	parser.add_argument("--assoc-ms", type=float, default=700.0, help="WLAN association time")
+	parser.add_argument("--dhcp-ms", type=float, default=1200.0, help="DHCP lease time")
+	parser.add_argument("--scan-ms", type=float, default=1500.0, help="WLAN scan time")
+	parser.add_argument("--rtt-ms", type=float, default=20.0, help="Broker round trip time")
+	parser.add_argument("--boot-ms", type=float, default=250.0, help="Boot time before main.py")
+	parser.add_argument("--cpu-ma", type=float, default=EnergyModel.cpu_ma, help="Active current of the MCU")
+	parser.add_argument("--radio-ma", type=float, default=EnergyModel.radio_ma, help="Extra current with WLAN active")
+	parser.add_argument("--sleep-ua", type=float, default=EnergyModel.sleep_ua, help="Deepsleep current")
+	parser.add_argument("--max-awake-ms", type=float, help="Fail if the mean awake time is above")
+	parser.add_argument("--max-charge-uah", type=float, help="Fail if the mean charge per cycle is above")
+	parser.add_argument("--json", type=Path, help="Also write results and summary to this JSON file")
+	parser.add_argument("--verbose", action="store_true", help="Show the firmware output")
+	parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	try:
+		overrides = parse_overrides(args.overrides)
+	except ValueError as exc:
+		parser.error(str(exc))
+
+	if args.trace:
+		try:
+			trace = load_trace(args.trace)
+		except Exception as exc:
+			logging.error(str(exc))
+			return 3
+		current_a = lambda us: trace[(us // 60_000_000) % len(trace)]
+	else:
+		current_a = lambda us: args.current
+	if args.event:
+		base = current_a
+		def current_a(us, base=base):
+			for start, duration, amps in args.event:
+				if start <= us / 1e6 < start + duration:
+					return amps
+			return base(us)
+
+	sim = Simulator(
+		overrides=overrides,
+		current_a=current_a,
+		bat_v=args.bat,
+		energy=EnergyModel(cpu_ma=args.cpu_ma, radio_ma=args.radio_ma, sleep_ua=args.sleep_ua),
+		boot_ms=args.boot_ms,
+		assoc_ms=args.assoc_ms,
+		dhcp_ms=args.dhcp_ms,
+		scan_ms=args.scan_ms,
+		rtt_ms=args.rtt_ms,
+		verbose=args.verbose,
+	)
+	results = sim.run(args.wakes, wlan_down=set(args.wlan_down), broker_down=set(args.broker_down),
+		broker_mute=set(args.broker_mute))
+	summary = summarize(results)
+
+	if not args.quiet:
+		print_table(results)
+		print()
+	for r in results:
+		if r["error"]:
+			logging.warning("wake %d: %s", r["wake"], r["error"])
+	print(f"wakes {summary.wakes}  outcomes {summary.outcomes}")
+	print(f"mean awake {summary.awake_ms:.1f} ms  charge/cycle {summary.charge_uAh:.3f} uAh  "
+		f"period {summary.period_s:.1f} s  avg current {summary.avg_current_uA:.1f} uA")
+
+	if args.json:
+		args.json.write_text(json.dumps({
+			"summary": asdict(summary),
+			"results": [{k: v for k, v in r.items() if k != "log"} for r in results],
+		}, indent=2))
+		logging.info("Saved results to %s", args.json)
+
+	failed = False
+	if args.max_awake_ms is not None and summary.awake_ms > args.max_awake_ms:
+		logging.error("mean awake time %.1f ms above %.1f ms", summary.awake_ms, args.max_awake_ms)
+		failed = True
+	if args.max_charge_uah is not None and summary.charge_uAh > args.max_charge_uah:
+		logging.error("mean charge %.3f uAh above %.3f uAh", summary.charge_uAh, args.max_charge_uah)
+		failed = True
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,127 @@
+"""profile-benchmark.py
+
+Compare the INA226 averaging/conversion-time profiles from the firmware
+config (`config.ina226['profiles']`) by conversion latency and sample noise.
+
+Usage examples:
+  python profile-benchmark.py
+  python profile-benchmark.py --samples 200 --current 0.0005
+  python profile-benchmark.py --trace ../ina266/query.csv
+
+The firmware driver (lib/ina226.py) runs unchanged under CPython against a
+simulated INA226 on a fake I2C bus and a virtual clock. Each sample is taken
+the way `CurrentReader.read()` does it: trigger, wait for Conversion Ready,
+read. The simulated chip adds gaussian ADC noise that shrinks with longer
+conversion times and more averages. With `--trace` the true current is
+replayed from an InfluxDB CSV export (field `current_A`) instead of being
+constant.
+
+The simulated chip and the MicroPython shims come from
+../firmware-sim/fwsim.py. The noise figures are a model (see `_NOISE_*`
+there), not a measurement; use them to compare profiles, not as absolute
+accuracy.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "firmware-sim"))
+from fwsim import SimulatedINA226, Simulator, VirtualClock  # noqa: E402
+
+
+def load_firmware(sim: Simulator):
+	"""Import the firmware config and INA226 driver with the simulator's MicroPython shims."""
+	sim.install()
+	return sim.import_firmware("config"), sim.import_firmware("lib.ina226")
+
+
+def load_trace(path: Path) -> list[float]:
+	import pandas as pd
+
+	df = pd.read_csv(path, comment="#")
+	if "_field" in df.columns:
+		df = df[df["_field"] == "current_A"]
+		values = df["_value"]
+	else:
+		values = df["current_A"]
+	values = pd.to_numeric(values, errors="coerce").dropna()
+	if values.empty:
+		raise RuntimeError(f"No current_A values in '{path}'")
+	return values.tolist()
+
+
+def benchmark(config, ina226, clock: VirtualClock, current_a, samples: int) -> list[dict]:
+	cfg = config.ina226
+	rows = []
+	for name, profile in cfg["profiles"].items():
+		dev = SimulatedINA226(clock, cfg["r_shunt_mohm"] / 1000, current_a)
+		ina = ina226.INA226(dev, addr=cfg["ina_addr"])
+		ina.calibrate(
+			config=ina226.make_config(mode=ina226.CONFIG_MODE_SANDBVOLT_TRIGGERED, **profile),
+			r_shunt=cfg["r_shunt_mohm"],
+			v_shunt=cfg["v_shunt_drop_voltage_at_max_current_mv"],
+		)
+		currents = []
+		buses = []
+		dev.i2c_transactions = 0
+		start = clock.us
+		for _ in range(samples):
+			ina.trigger()
+			if not ina.wait_conversion():
+				raise RuntimeError(f"conversion timed out in profile '{name}'")
+			_, bus_v, current, _ = ina.read_all()
+			currents.append(current)
+			buses.append(bus_v)
+		rows.append({
+			"profile": name,
+			"avg": profile["avg"],
+			"ct_us": f"{profile['vbus_ct_us']}/{profile['vshunt_ct_us']}",
+			"latency_ms": (clock.us - start) / 1000 / samples,
+			"i2c_per_sample": dev.i2c_transactions / samples,
+			"current_std_uA": statistics.pstdev(currents) * 1e6,
+			"bus_std_mV": statistics.pstdev(buses) * 1e3,
+		})
+	return rows
+
+
+def print_table(rows: list[dict]) -> None:
+	header = f"{'profile':<10} {'avg':>5} {'ct bus/shunt us':>16} {'ms/sample':>10} {'i2c/sample':>10} {'std I uA':>9} {'std V mV':>9}"
+	print(header)
+	print("-" * len(header))
+	for r in rows:
+		print(f"{r['profile']:<10} {r['avg']:>5} {r['ct_us']:>16} {r['latency_ms']:>10.1f} "
+			f"{r['i2c_per_sample']:>10.1f} {r['current_std_uA']:>9.3f} {r['bus_std_mV']:>9.3f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Benchmark INA226 profiles against a simulated device")
+	parser.add_argument("--samples", type=int, default=100, help="Samples per profile")
+	parser.add_argument("--current", type=float, default=0.0005, help="Constant true current in A")
+	parser.add_argument("--trace", type=Path, help="InfluxDB CSV export to replay current_A from")
+	args = parser.parse_args(argv)
+
+	sim = Simulator()
+	clock = sim.clock
+	config, ina226 = load_firmware(sim)
+
+	if args.trace:
+		try:
+			trace = load_trace(args.trace)
+		except Exception as exc:
+			print(exc, file=sys.stderr)
+			return 3
+		# replay one recorded value per simulated second
+		current_a = lambda us: trace[(us // 1_000_000) % len(trace)]
+	else:
+		current_a = lambda us: args.current
+
+	print_table(benchmark(config, ina226, clock, current_a, args.samples))
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,155 @@
+"""build-mpy.py
+
+Cross-compile the firmware modules (ina226-esp32-multimeter) to MicroPython
+bytecode (.mpy) so the ESP32 does not compile them from source on every wake.
+
+Usage examples:
+  python build-mpy.py
+  python build-mpy.py --out build --arch xtensawin
+  python build-mpy.py --keep config.py      # keep config editable on the device
+  python build-mpy.py --mpy-cross ~/micropython/mpy-cross/build/mpy-cross
+
+boot.py and main.py are always copied as source: MicroPython only runs them
+by file name. Everything else is compiled into the same layout (lib/ included).
+Upload the output directory, e.g.
+
+  mpremote cp -r build/* :
+
+and delete the old .py files of compiled modules on the device, MicroPython
+prefers foo.py over foo.mpy. The .mpy version must match the firmware: use
+the mpy-cross of the same MicroPython release (pip install mpy-cross==<version>).
+
+Freezing the modules into the firmware image (manifest.py with `module()`)
+saves the import time as well and also the RAM of the loaded bytecode, but
+needs a firmware build; print a manifest for that with --manifest.
+
+Requirements: mpy-cross (pip install mpy-cross)
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+FIRMWARE_DIR = Path(__file__).resolve().parents[2] / "ina226-esp32-multimeter"
+
+# run by file name, must stay source
+_ALWAYS_SOURCE = ("boot.py", "main.py")
+
+
+def find_modules(src: Path) -> list[Path]:
+	"""Firmware .py files relative to `src`."""
+	return sorted(p.relative_to(src) for p in src.rglob("*.py") if "__pycache__" not in p.parts)
+
+
+def compile_module(mpy_cross: str, src: Path, rel: Path, out: Path, arch: str | None, opt: int) -> Path:
+	target = out / rel.with_suffix(".mpy")
+	target.parent.mkdir(parents=True, exist_ok=True)
+	cmd = [mpy_cross, f"-O{opt}", "-s", rel.as_posix(), "-o", str(target)]
+	if arch:
+		cmd.append(f"-march={arch}")
+	cmd.append(str(src / rel))
+	result = subprocess.run(cmd, capture_output=True, text=True)
+	if result.returncode:
+		raise RuntimeError(f"mpy-cross failed for {rel}: {result.stderr.strip()}")
+	return target
+
+
+def unsafe_out(out: Path, src: Path) -> str | None:
+	"""Why `out` must not be written to, None if it is fine."""
+	out, src, cwd = out.resolve(), src.resolve(), Path.cwd().resolve()
+	if out == cwd or out in cwd.parents:
+		return "it is or contains the current directory"
+	if out == src or out in src.parents:
+		return "it is or contains the firmware directory"
+	if src in out.parents:
+		return "it is inside the firmware directory"
+	return None
+
+
+def clean(out: Path, modules: list[Path]) -> None:
+	"""Remove what an earlier run wrote to `out`: all .mpy files and the
+	copied sources. Other files are left alone."""
+	for p in out.rglob("*.mpy"):
+		p.unlink()
+	for rel in modules:
+		(out / rel).unlink(missing_ok=True)
+
+
+def manifest(src: Path, modules: list[Path]) -> str:
+	"""manifest.py lines freezing the compiled modules into a firmware build."""
+	lines = ['include("$(PORT_DIR)/boards/manifest.py")']
+	for rel in modules:
+		# the path keeps packages: lib/ina226.py is frozen as lib.ina226
+		lines.append(f'module("{rel.as_posix()}", base_path="{src.as_posix()}")')
+	return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Cross-compile the firmware modules to .mpy")
+	parser.add_argument("--src", type=Path, default=FIRMWARE_DIR, help="Firmware directory")
+	parser.add_argument("--out", type=Path, default=Path("build"), help="Output directory, its .mpy and copied files are replaced")
+	parser.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross executable")
+	parser.add_argument("--arch", help="Allow native code for this architecture, e.g. xtensawin (ESP32)")
+	parser.add_argument("-O", dest="opt", type=int, default=0, choices=range(4),
+						help="Optimisation level (>= 1 strips asserts, lib/umqttsimple.py checks broker replies with them)")
+	parser.add_argument("--keep", action="append", default=[], metavar="FILE",
+						help="Also copy this module as source (repeatable)")
+	parser.add_argument("--manifest", action="store_true", help="Print a manifest.py for freezing instead of compiling")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	if not args.src.is_dir():
+		logging.error("Firmware directory '%s' not found", args.src)
+		return 2
+	keep = set(_ALWAYS_SOURCE) | {Path(k).as_posix() for k in args.keep}
+	modules = find_modules(args.src)
+	compiled = [rel for rel in modules if rel.as_posix() not in keep]
+
+	if args.manifest:
+		print(manifest(args.src, compiled))
+		return 0
+
+	if shutil.which(args.mpy_cross) is None:
+		logging.error("'%s' not found, install it with: pip install mpy-cross", args.mpy_cross)
+		return 2
+
+	reason = unsafe_out(args.out, args.src)
+	if reason:
+		logging.error("Refusing to write to '%s': %s", args.out, reason)
+		return 2
+	if args.out.exists():
+		clean(args.out, [rel for rel in modules if rel not in compiled])
+	args.out.mkdir(parents=True, exist_ok=True)
+
+	total_py = total_mpy = 0
+	print(f"{'module':<24} {'.py B':>7} {'.mpy B':>7}")
+	for rel in modules:
+		size = (args.src / rel).stat().st_size
+		if rel in compiled:
+			try:
+				target = compile_module(args.mpy_cross, args.src, rel, args.out, args.arch, args.opt)
+			except RuntimeError as exc:
+				logging.error(str(exc))
+				return 1
+			mpy = target.stat().st_size
+			total_py += size
+			total_mpy += mpy
+			print(f"{rel.as_posix():<24} {size:>7} {mpy:>7}")
+		else:
+			target = args.out / rel
+			target.parent.mkdir(parents=True, exist_ok=True)
+			shutil.copy2(args.src / rel, target)
+			print(f"{rel.as_posix():<24} {size:>7} {'source':>7}")
+	print(f"{'total compiled':<24} {total_py:>7} {total_mpy:>7}")
+	logging.info("Wrote %d .mpy and %d source file(s) to %s", len(compiled), len(modules) - len(compiled), args.out)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,248 @@
+"""ctbin.py
+
+Decode the compact binary measurement payload published by the firmware on
+`ct/current/bin` (config.mqtt['format'] = 'bin', see
+ina226-esp32-multimeter/record.py for the layout) and the stream frames of
+the continuous mode on `ct/current/stream` (config.stream).
+
+Usage examples:
+  python ctbin.py 0118...            # decode hex payload(s), print JSON
+  python ctbin.py --file dump.bin    # decode a raw payload file
+  python ctbin.py --bridge --host localhost
+
+With --bridge the script subscribes to the binary topic and republishes every
+payload as the JSON batch format on `ct/current`, so the Node-RED flow does
+not need to know about the binary format (requires paho-mqtt).
+
+As a module:
+  from ctbin import decode, decode_frame, decode_many
+  rows = decode_many(payloads)   # flat list of record dicts
+  frame = decode_frame(payload)  # stream frame: header fields and samples
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import struct
+import sys
+from pathlib import Path
+
+VERSION = 1
+FRAME_VERSION = 2
+# VERSION followed by the phase timings of the wake
+TIMED_VERSION = 3
+
+_HEADER = struct.Struct("<BBHffffI")
+_FIRST = struct.Struct("<IhHH")
+_NO_BAT = 0xFFFF
+_FRAME_HEADER = struct.Struct("<BBHHfIII")
+_SAMPLE = struct.Struct("<hH")
+
+# field names of the JSON batch payload, same as the firmware
+FIELDS = ("t", "shunt_V", "bus_V", "current_A", "power_W",
+	"charge_mAh", "energy_mWh", "bat_V", "bat_perc")
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+	n = 0
+	shift = 0
+	while True:
+		b = data[pos]
+		pos += 1
+		n |= (b & 0x7F) << shift
+		if not b & 0x80:
+			break
+		shift += 7
+	# undo zigzag
+	return (n >> 1) ^ -(n & 1), pos
+
+
+def _convert(shunt: int, bus: int, cal: int, current_lsb: float) -> tuple[float, float, float, float]:
+	# same arithmetic as lib/ina226.py convert()
+	raw_current = shunt * cal // 2048
+	raw_power = abs(raw_current) * bus // 20000
+	return shunt * 0.0025, bus * 1.25 / 1000, raw_current * current_lsb, raw_power * 25 * current_lsb
+
+
+def _bat_percentage(voltage: float) -> float:
+	# same mapping as bat.percentage() (3.3 V = 0 %, 4.2 V = 100 %)
+	return max(min((voltage - 3.3) / (4.2 - 3.3), 1.0), 0.0) * 100
+
+
+def decode_frame(data: bytes) -> dict:
+	"""Decode one stream frame into header fields and a list of sample dicts."""
+	if len(data) < _FRAME_HEADER.size:
+		raise ValueError(f"frame too short ({len(data)} bytes)")
+	version, _, count, cal, current_lsb, seq, t0_ms, period_us = _FRAME_HEADER.unpack_from(data)
+	if version != FRAME_VERSION:
+		raise ValueError(f"unsupported frame version {version}")
+	if len(data) != _FRAME_HEADER.size + count * _SAMPLE.size:
+		raise ValueError(f"frame of {len(data)} bytes does not hold {count} samples")
+
+	samples = []
+	for i, (shunt, bus) in enumerate(_SAMPLE.iter_unpack(data[_FRAME_HEADER.size:])):
+		shunt_mv, bus_v, current, power = _convert(shunt, bus, cal, current_lsb)
+		samples.append({
+			"t_ms": t0_ms + i * period_us / 1000,
+			"shunt_raw": shunt,
+			"bus_raw": bus,
+			"shunt_V": shunt_mv / 1000.0,
+			"bus_V": bus_v,
+			"current_A": current,
+			"power_W": power,
+		})
+	return {
+		"version": version,
+		"seq": seq,
+		"t0_ms": t0_ms,
+		"period_us": period_us,
+		"cal": cal,
+		"current_lsb": current_lsb,
+		"samples": samples,
+	}
+
+
+def decode(data: bytes) -> dict:
+	"""Decode one binary payload into header fields and a list of record dicts.
+	Stream frames are passed on to decode_frame()."""
+	if data and data[0] == FRAME_VERSION:
+		return decode_frame(data)
+	if len(data) < _HEADER.size + _FIRST.size:
+		raise ValueError(f"payload too short ({len(data)} bytes)")
+	version, count, cal, current_lsb, bat_scale, mah, mwh, now = _HEADER.unpack_from(data)
+	if version not in (VERSION, TIMED_VERSION):
+		raise ValueError(f"unsupported payload version {version}")
+
+	raw = [_FIRST.unpack_from(data, _HEADER.size)]
+	pos = _HEADER.size + _FIRST.size
+	for _ in range(count - 1):
+		deltas = []
+		for _ in range(4):
+			d, pos = _varint(data, pos)
+			deltas.append(d)
+		raw.append(tuple(p + d for p, d in zip(raw[-1], deltas)))
+	t_ms = None
+	if version == TIMED_VERSION:
+		t_ms = {}
+		n = data[pos]
+		pos += 1
+		for _ in range(n):
+			size = data[pos]
+			name = data[pos + 1:pos + 1 + size].decode("ascii")
+			t_ms[name], pos = _varint(data, pos + 1 + size)
+	if pos != len(data):
+		raise ValueError(f"{len(data) - pos} trailing bytes after {count} records")
+
+	records = []
+	for t, shunt, bus, bat in raw:
+		shunt_mv, bus_v, current, power = _convert(shunt, bus, cal, current_lsb)
+		bat_v = None if bat == _NO_BAT or math.isnan(bat_scale) else bat * bat_scale
+		records.append({
+			"t": t,
+			"age_s": now - t,
+			"shunt_raw": shunt,
+			"bus_raw": bus,
+			"bat_raw": None if bat == _NO_BAT else bat,
+			"shunt_V": shunt_mv / 1000.0,
+			"bus_V": bus_v,
+			"current_A": current,
+			"power_W": power,
+			"charge_mAh": None,
+			"energy_mWh": None,
+			"bat_V": bat_v,
+			"bat_perc": None if bat_v is None else _bat_percentage(bat_v),
+		})
+	# the totals are only transmitted for the newest record
+	records[-1]["charge_mAh"] = None if math.isnan(mah) else mah
+	records[-1]["energy_mWh"] = None if math.isnan(mwh) else mwh
+
+	decoded = {
+		"version": version,
+		"now": now,
+		"cal": cal,
+		"current_lsb": current_lsb,
+		"bat_scale": bat_scale,
+		"records": records,
+	}
+	if t_ms is not None:
+		decoded["t_ms"] = t_ms
+	return decoded
+
+
+def decode_many(payloads) -> list[dict]:
+	"""Decode an iterable of payloads into one flat list of record dicts."""
+	rows: list[dict] = []
+	for data in payloads:
+		rows.extend(decode(data)["records"])
+	return rows
+
+
+def to_json_batch(decoded: dict) -> dict:
+	"""JSON batch payload as published by the firmware in 'json' format."""
+	payload = {
+		"fields": FIELDS,
+		"now": decoded["now"],
+		"records": [[r[f] for f in FIELDS] for r in decoded["records"]],
+	}
+	if "t_ms" in decoded:
+		payload["t_ms"] = decoded["t_ms"]
+	return payload
+
+
+def bridge(host: str, port: int, src: str, dst: str) -> int:
+	try:
+		import paho.mqtt.client as mqtt
+	except ImportError:
+		logging.error("--bridge requires paho-mqtt (pip install paho-mqtt)")
+		return 2
+
+	def on_message(client, userdata, msg):
+		try:
+			payload = to_json_batch(decode(msg.payload))
+		except (ValueError, struct.error, IndexError) as exc:
+			logging.warning("dropping undecodable payload on %s: %s", msg.topic, exc)
+			return
+		client.publish(dst, json.dumps(payload), qos=1)
+		logging.info("%d record(s) %s -> %s", len(payload["records"]), msg.topic, dst)
+
+	client = mqtt.Client()
+	client.on_message = on_message
+	client.connect(host, port)
+	client.subscribe(src, qos=1)
+	client.loop_forever()
+	return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Decode binary ct/current payloads")
+	parser.add_argument("hex", nargs="*", help="Payload(s) as hex strings")
+	parser.add_argument("--file", type=Path, action="append", default=[], help="Raw binary payload file")
+	parser.add_argument("--bridge", action="store_true", help="Republish binary payloads as JSON via MQTT")
+	parser.add_argument("--host", default="localhost", help="MQTT broker for --bridge")
+	parser.add_argument("--port", type=int, default=1883, help="MQTT port for --bridge")
+	parser.add_argument("--src", default="ct/current/bin", help="Binary topic for --bridge")
+	parser.add_argument("--dst", default="ct/current", help="JSON topic for --bridge")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+	if args.bridge:
+		return bridge(args.host, args.port, args.src, args.dst)
+
+	payloads = [bytes.fromhex(h) for h in args.hex] + [f.read_bytes() for f in args.file]
+	if not payloads:
+		parser.error("no payload given")
+	try:
+		for data in payloads:
+			print(json.dumps(decode(data), indent=2))
+	except (ValueError, struct.error, IndexError) as exc:
+		logging.error("Failed to decode payload: %s", exc)
+		return 3
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""phase-analyzer.py
+
+Per-device percentile breakdown of the wake-cycle phase timings that the
+firmware publishes as `t_ms` (stored by Node-RED as fields `t_<phase>_ms`).
+
+Usage examples:
+  python phase-analyzer.py query.csv
+  python phase-analyzer.py query.csv --percentiles 50 95 --out phases.csv
+
+Export the data from InfluxDB with a query like:
+
+  from(bucket: "forschungsprojekt-solar-data")
+    |> range(start: -7d)
+    |> filter(fn: (r) => r._measurement == "ina226" and r._field =~ /^t_.*_ms$/)
+
+Phases overlap (wlan runs while sample and bat are taken), so they do not add
+up to the total. prev_total / prev_publish belong to the wake before the one
+that reported them.
+
+Requirements: pandas
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import re
+from pathlib import Path
+
+import pandas as pd
+
+_PHASE_RE = r"^t_(?P<phase>.+)_ms$"
+
+
+def load_phases(path: Path) -> pd.DataFrame:
+	"""Long table with columns device, phase, ms."""
+	try:
+		df = pd.read_csv(path, comment="#")
+	except Exception as exc:
+		raise RuntimeError(f"Failed to read CSV '{path}': {exc}")
+
+	if "_field" in df.columns and "_value" in df.columns:
+		# Influx "wide" export: one row per field value
+		long = df[["_field", "_value"]].rename(columns={"_field": "field", "_value": "ms"})
+		long["device"] = df["device"] if "device" in df.columns else "all"
+	else:
+		# one column per field
+		cols = [c for c in df.columns if re.match(_PHASE_RE, str(c))]
+		id_col = df["device"] if "device" in df.columns else pd.Series("all", index=df.index)
+		long = df[cols].assign(device=id_col).melt(id_vars="device", var_name="field", value_name="ms")
+
+	phase = long["field"].astype(str).str.extract(_PHASE_RE)["phase"]
+	long = long.assign(phase=phase, ms=pd.to_numeric(long["ms"], errors="coerce"))
+	long = long.dropna(subset=["phase", "ms"])
+	if long.empty:
+		raise RuntimeError("No t_<phase>_ms fields found in CSV")
+	long["device"] = long["device"].fillna("unknown")
+	return long[["device", "phase", "ms"]]
+
+
+def breakdown(long: pd.DataFrame, percentiles: list[float]) -> pd.DataFrame:
+	"""count, mean and percentiles of ms per device and phase."""
+	grouped = long.groupby(["device", "phase"])["ms"]
+	table = grouped.agg(["count", "mean"])
+	for p in percentiles:
+		table[f"p{p:g}"] = grouped.quantile(p / 100)
+	# slowest phases first within each device
+	return table.sort_values(["device", "mean"], ascending=[True, False]).round(1)
+
+
+def main(argv: list[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description="Percentile breakdown of wake phase timings per device")
+	parser.add_argument("csv", type=Path, nargs="?", default=Path("query.csv"),
+						help="Path to InfluxDB-exported CSV file (defaults to 'query.csv')")
+	parser.add_argument("--percentiles", type=float, nargs="+", default=[50, 90, 99], help="Percentiles to report")
+	parser.add_argument("--out", type=Path, help="Also write the table to this CSV file")
+	parser.add_argument("--quiet", action="store_true", help="Less verbose logging")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=(logging.WARNING if args.quiet else logging.INFO), format="%(levelname)s: %(message)s")
+
+	if not args.csv.exists():
+		logging.error("CSV file does not exist: %s", args.csv)
+		return 2
+
+	try:
+		table = breakdown(load_phases(args.csv), args.percentiles)
+	except Exception as exc:
+		logging.error(str(exc))
+		return 3
+
+	with pd.option_context("display.max_rows", None, "display.width", 120):
+		print(table)
+	if args.out:
+		table.to_csv(args.out)
+		logging.info("Saved table to %s", args.out)
+	return 0
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())